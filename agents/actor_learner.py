@@ -0,0 +1,419 @@
+""" Self-play actors feeding a learner through a shared-memory replay ring.
+
+Generation and training run at the same time instead of one batch job after
+the other:
+  - actor processes play self-play games with the current weights, as NumPy
+    engines (see numpy_mlp.py), and append the (observation, legal mask,
+    action) record of every move to a ring buffer in shared memory;
+  - the learner process samples training batches from the ring, trains the
+    keras Mlp on them and periodically publishes its weights, as best.h5
+    and as the flat weight file next to it that the actors memory-map again.
+The coordinating process prints one JSON line of counters per interval: the
+records produced and consumed per second, the ring fill, the published
+weight version, the learner loss and the mean score of the games finished.
+
+    python agents/actor_learner.py --init agents/imitator_models/iggi.save/best.h5 \
+        --output agents/imitator_models/iggi-selfplay.save/best.h5
+"""
+import os
+import sys
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, AGENTS_DIR)
+
+from runtime import available_cores, limit_threads  # noqa: E402
+
+if __name__ == '__main__':
+    # Single-threaded BLAS in the actors, see worker_pool.py
+    limit_threads(1, override=False)
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import multiprocessing  # noqa: E402
+import time  # noqa: E402
+from multiprocessing import resource_tracker, shared_memory  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from dataset import FIELDS  # noqa: E402
+from numpy_mlp import NumpyMlp, flat_path  # noqa: E402
+
+# Shared int64 counters at the start of the ring
+COUNTERS = ('written', 'consumed', 'version', 'games', 'score', 'steps',
+            'stop')
+# Shared float64 statistics of the learner
+STATS = ('loss', 'accuracy')
+RING_FIELDS = ('obs', 'mask', 'action')
+ALIGN = 64
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class ReplayRing(object):
+    def __init__(self, capacity, lock=None, name=None):
+        """ Fixed-size buffer of imitation records in shared memory.
+        The counters, the learner statistics and one array per field of
+        RING_FIELDS (dtypes and shapes of dataset.FIELDS) live in a single
+        SharedMemory block. Records are written at position written %
+        capacity, overwriting the oldest ones once the ring is full, and
+        sampled uniformly among the records held. Writes and samples copy
+        their rows under @lock, so that a sample never sees a half-written
+        record. The ring can be passed to processes started with any start
+        method; unpickling attaches to the block by name. Only the process
+        that created the block leaves it registered with the resource
+        tracker, so that an attached process exiting never unlinks it.
+        Arguments:
+            - capacity: int
+                Number of records held.
+            - lock: multiprocessing.Lock, default None
+                Lock shared by the processes, a new one if None.
+            - name: str, default None
+                Name of an existing block to attach to; a new block is
+                created if None.
+        """
+        self.capacity = capacity
+        self.lock = multiprocessing.Lock() if lock is None else lock
+        layout, size = self._layout(capacity)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self._owner = name is None
+        self.arrays = {key: np.ndarray(shape, dtype=dtype,
+                                       buffer=self.shm.buf, offset=offset)
+                       for key, (dtype, shape, offset) in layout.items()}
+        self.counters = self.arrays['counters']
+        self.stats = self.arrays['stats']
+        if self._owner:
+            self.counters[:] = 0
+            self.stats[:] = np.nan
+
+    @staticmethod
+    def _layout(capacity):
+        layout = {'counters': (np.int64, (len(COUNTERS), ), 0),
+                  'stats': (np.float64, (len(STATS), ),
+                            _align(8 * len(COUNTERS)))}
+        offset = _align(layout['stats'][2] + 8 * len(STATS))
+        for field in RING_FIELDS:
+            dtype, shape = FIELDS[field]
+            layout[field] = (dtype, (capacity, ) + shape, offset)
+            offset = _align(offset + capacity * np.dtype(dtype).itemsize *
+                            int(np.prod(shape)))
+        return layout, offset
+
+    def __getstate__(self):
+        return {'capacity': self.capacity, 'lock': self.lock,
+                'name': self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __getitem__(self, counter):
+        return int(self.counters[COUNTERS.index(counter)])
+
+    def _add(self, counter, value):
+        self.counters[COUNTERS.index(counter)] += value
+
+    def __len__(self):
+        """ Number of records held. """
+        return min(self['written'], self.capacity)
+
+    @property
+    def stopped(self):
+        return self['stop'] != 0
+
+    def stop(self):
+        with self.lock:
+            self.counters[COUNTERS.index('stop')] = 1
+
+    def write(self, obs, mask, action):
+        """ Append a batch of records.
+        Arguments:
+            - obs: np.ndarray
+                (n, 658) binary observation vectors, any numeric dtype.
+            - mask: np.ndarray
+                (n, 20) legal move masks.
+            - action: np.ndarray
+                (n, ) uids of the moves played.
+        """
+        n = len(action)
+        with self.lock:
+            rows = (self['written'] + np.arange(n)) % self.capacity
+            self.arrays['obs'][rows] = obs
+            self.arrays['mask'][rows] = mask
+            self.arrays['action'][rows] = action
+            self._add('written', n)
+
+    def sample(self, batch_size, rng):
+        """ Uniformly sampled copies of @batch_size records held.
+        Returns:
+            - obs, mask, action arrays, see write().
+        """
+        with self.lock:
+            rows = rng.integers(len(self), size=batch_size)
+            batch = tuple(self.arrays[field][rows] for field in RING_FIELDS)
+            self._add('consumed', batch_size)
+        return batch
+
+    def add_games(self, scores):
+        """ Count finished games and their scores. """
+        with self.lock:
+            self._add('games', len(scores))
+            self._add('score', int(sum(scores)))
+
+    def publish(self):
+        """ Tell the actors that new weights were written. """
+        with self.lock:
+            self._add('version', 1)
+
+    def set_stats(self, steps, values):
+        with self.lock:
+            self.counters[COUNTERS.index('steps')] = steps
+            self.stats[:] = values
+
+    def snapshot(self):
+        """ Counters and learner statistics, as a dict. """
+        with self.lock:
+            counters = self.counters.copy()
+            stats = self.stats.copy()
+        snapshot = {c: int(v) for c, v in zip(COUNTERS, counters)}
+        snapshot.update({s: None if np.isnan(v) else float(v)
+                         for s, v in zip(STATS, stats)})
+        snapshot['fill'] = min(snapshot['written'], self.capacity)
+        return snapshot
+
+    def close(self):
+        """ Detach the block, and free it in the process that created it.
+        """
+        self.arrays = self.counters = self.stats = None
+        self.shm.close()
+        if self._owner:
+            # Spawned processes share the tracker of their parent, so an
+            # attached process may have dropped the registration already
+            resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
+
+
+def _actor(ring, weights_path, actor_id, num_actors, seed, num_envs,
+           mode, players):
+    import itertools
+
+    from cross_play_wrappers.agent_wrapper import (legal_moves_mask,
+                                                   select_legal_actions)
+    from vector_runner import LockstepGames
+
+    rng = np.random.default_rng([seed, actor_id])
+    # Actors deal disjoint, endless series of decks
+    games = LockstepGames(num_envs, players,
+                          itertools.count(seed + actor_id, num_actors))
+    version, model = 0, None
+    while not ring.stopped:
+        if ring['version'] != version:
+            version = ring['version']
+            model = NumpyMlp.load_flat(weights_path)
+        if model is None:
+            # Waiting for the learner's first weights
+            time.sleep(0.05)
+            continue
+
+        observations = [g['observation'] for g in games.observe()]
+        vectors = games.vectors()
+        mask = legal_moves_mask(observations, model.io_sizes[1])
+        _, action_indices = select_legal_actions(
+            model.predict(vectors), observations, mode=mode, rng=rng,
+            mask=mask)
+        ring.write(vectors, mask[0], action_indices)
+
+        finished = games.step([int(action) for action in action_indices])
+        if finished:
+            ring.add_games([score for _, score in finished])
+
+
+def _save_weights(mlp, path):
+    """ Write best.h5 and then its flat export, both atomically. """
+    root, extension = os.path.splitext(path)
+    tmp_path = root + '.tmp' + extension
+    mlp.model.save_weights(tmp_path)
+    os.replace(tmp_path, path)
+    NumpyMlp.from_mlp(mlp).save_flat(flat_path(path))
+
+
+def _learner(ring, init_path, out_path, batch_size, publish_every,
+             min_records, max_steps, seed):
+    from cross_play_wrappers.agent_wrapper import load_imitator
+
+    mlp = load_imitator(init_path)
+    _save_weights(mlp, out_path)
+    ring.publish()
+    rng = np.random.default_rng(seed)
+    Y = np.zeros((batch_size, mlp.io_sizes[1]), dtype=np.float32)
+    rows = np.arange(batch_size)
+    step = 0
+    while not ring.stopped and (max_steps is None or step < max_steps):
+        if len(ring) < min_records:
+            time.sleep(0.05)
+            continue
+        obs, _, action = ring.sample(batch_size, rng)
+        Y[:] = 0.
+        Y[rows, action] = 1.
+        values = mlp.model.train_on_batch(obs.astype(np.float32), Y)
+        step += 1
+        ring.set_stats(step, values)
+        if step % publish_every == 0:
+            _save_weights(mlp, out_path)
+            ring.publish()
+    _save_weights(mlp, out_path)
+    ring.publish()
+
+
+def run(init_path, out_path, actors=None, capacity=1 << 20, batch_size=128,
+        publish_every=500, min_records=None, max_steps=None, seconds=None,
+        report_every=10., num_envs=16, mode='sample', players=2, seed=1,
+        start_method='fork'):
+    """ Train an imitator on its own self-play games as they are played.
+    Arguments:
+        - init_path: str
+            best.h5 the learner starts from.
+        - out_path: str
+            best.h5 the weights are published to; the actors play with its
+            flat export (see numpy_mlp.flat_path), which the agent wrapper
+            loads as well.
+        - actors: int, default None
+            Number of actor processes, one less than the available cores if
+            None, leaving one to the learner.
+        - capacity: int, default 1 << 20
+            Records held by the ring, about 680 bytes each.
+        - batch_size: int, default 128
+            Records per training batch.
+        - publish_every: int, default 500
+            Training steps between two published weight versions.
+        - min_records: int, default None
+            Records to collect before training starts, 10 batches if None.
+        - max_steps: int, default None
+            Training steps after which the run stops.
+        - seconds: float, default None
+            Duration after which the run stops. Runs until interrupted if
+            neither @max_steps nor @seconds is given.
+        - report_every: float, default 10.
+            Seconds between two printed reports.
+        - num_envs: int, default 16
+            Games an actor plays in lockstep, batching their forward passes.
+        - mode: str, default 'sample'
+            Action selection of the actors, see
+            agent_wrapper.select_legal_actions; 'sample' explores.
+        - players: int, default 2
+            Number of players of the games.
+        - seed: int, default 1
+            Deck seed of the first game; actor i plays seeds seed + i,
+            seed + i + actors, ...
+        - start_method: str, default 'fork'
+            Start method of the actor and learner processes.
+    Returns:
+        - report dict with the overall throughputs and the last counters.
+    """
+    if actors is None:
+        actors = max(1, available_cores() - 1)
+    if min_records is None:
+        min_records = 10 * batch_size
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+
+    context = multiprocessing.get_context(start_method)
+    ring = ReplayRing(capacity, lock=context.Lock())
+    learner = context.Process(
+        target=_learner, name='learner',
+        args=(ring, init_path, out_path, batch_size, publish_every,
+              min_records, max_steps, seed))
+    workers = [context.Process(
+        target=_actor, name='actor-%d' % i,
+        args=(ring, flat_path(out_path), i, actors, seed, num_envs, mode,
+              players)) for i in range(actors)]
+    report = {'actors': actors, 'capacity': capacity,
+              'batch_size': batch_size, 'mode': mode}
+    start = last_time = time.time()
+    try:
+        for process in [learner] + workers:
+            process.start()
+        last = ring.snapshot()
+        while learner.is_alive():
+            learner.join(report_every)
+            now = time.time()
+            current = ring.snapshot()
+            elapsed = now - last_time
+            games = current['games'] - last['games']
+            line = dict(current, seconds=now - start,
+                        produced_per_sec=(current['written'] -
+                                          last['written']) / elapsed,
+                        consumed_per_sec=(current['consumed'] -
+                                          last['consumed']) / elapsed,
+                        mean_score=(current['score'] - last['score']) / games
+                        if games else None)
+            print(json.dumps(line), flush=True)
+            last, last_time = current, now
+            if seconds is not None and now - start >= seconds:
+                ring.stop()
+            if any(w.exitcode not in (None, 0) for w in workers):
+                ring.stop()
+                raise RuntimeError('An actor failed')
+        if learner.exitcode != 0:
+            raise RuntimeError('The learner failed with exit code %s'
+                               % learner.exitcode)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.stop()
+        for process in [learner] + workers:
+            if process.pid is not None:
+                process.join()
+        elapsed = time.time() - start
+        final = ring.snapshot()
+        ring.close()
+
+    final.update(report,
+                 seconds=elapsed,
+                 produced_per_sec=final['written'] / elapsed,
+                 consumed_per_sec=final['consumed'] / elapsed,
+                 mean_score=final['score'] / final['games']
+                 if final['games'] else None,
+                 output=out_path)
+    return final
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--init', required=True,
+                        help='best.h5 the learner starts from')
+    parser.add_argument('--output', required=True,
+                        help='best.h5 the trained weights are written to')
+    parser.add_argument('--actors', type=int, default=None)
+    parser.add_argument('--capacity', type=int, default=1 << 20)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--publish-every', type=int, default=500)
+    parser.add_argument('--min-records', type=int, default=None)
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--seconds', type=float, default=None)
+    parser.add_argument('--report-every', type=float, default=10.)
+    parser.add_argument('--num-envs', type=int, default=16)
+    parser.add_argument('--mode', default='sample',
+                        choices=['argmax', 'sample', 'top_k'])
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--start-method', default='fork',
+                        choices=['fork', 'spawn', 'forkserver'])
+    args = parser.parse_args(argv)
+
+    report = run(args.init, args.output, actors=args.actors,
+                 capacity=args.capacity, batch_size=args.batch_size,
+                 publish_every=args.publish_every,
+                 min_records=args.min_records, max_steps=args.max_steps,
+                 seconds=args.seconds, report_every=args.report_every,
+                 num_envs=args.num_envs, mode=args.mode,
+                 players=args.players, seed=args.seed,
+                 start_method=args.start_method)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
 import os, sys
+import functools
+import json
 import numpy as np
-import keras
-from keras.layers import Input, Dense, ReLU, Dropout, Softmax
-from keras.models import Model, load_model
-from tensorflow.keras.optimizers import Adam #added tensorflow
 parentDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(1, parentDirectory)
-from mlp import Mlp
+from numpy_mlp import NumpyMlp, flat_path, numpy_path
+from cross_play_wrappers.model_cache import model_cache
+from cross_play_wrappers.inference_broker import BrokerClosed, get_broker
+from cross_play_wrappers.prediction_memo import prediction_memo
+from runtime import model_name
+from timings import timings
 
 def format_legal_moves(legal_moves, action_dim):
   """Returns formatted legal moves.
@@ -28,65 +31,282 @@ def format_legal_moves(legal_moves, action_dim):
 
 
 def choose_legal_action(action_raw, obs):
-  while True:
-      action_idx = np.argmax(action_raw)
-      if action_idx in obs['legal_moves_as_int']:
-          action_leg_idx = obs['legal_moves_as_int'].index(action_idx)
-          break
-      else:
-          action_raw[0][action_idx] = np.NINF
-  return action_leg_idx
+  """Returns the index in obs['legal_moves'] of the best legal action."""
+  masked = action_raw + format_legal_moves(obs['legal_moves_as_int'],
+                                           np.shape(action_raw)[-1])
+  action_idx = np.argmax(masked)
+  return obs['legal_moves_as_int'].index(action_idx)
+
+
+def legal_moves_mask(observations, action_dim=20):
+  """Builds the legal move mask of a batch of observations.
+
+  Args:
+    observations: list of N player observations.
+    action_dim: int, number of actions.
+  Returns:
+    mask: (N, action_dim) bool array, True where the move is legal.
+    positions: (N, action_dim) int array holding the index of each legal move
+      in the observation's 'legal_moves' list, -1 for illegal moves.
+  """
+  legal = [obs['legal_moves_as_int'] for obs in observations]
+  lengths = np.fromiter((len(l) for l in legal), dtype=np.intp,
+                        count=len(legal))
+  rows = np.repeat(np.arange(len(legal)), lengths)
+  cols = np.fromiter((m for l in legal for m in l), dtype=np.intp,
+                     count=lengths.sum())
+  starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+  mask = np.zeros((len(legal), action_dim), dtype=bool)
+  mask[rows, cols] = True
+  positions = np.full((len(legal), action_dim), -1, dtype=np.intp)
+  positions[rows, cols] = np.arange(len(cols)) - starts
+  return mask, positions
+
+
+def select_legal_actions(action_raw, observations, mode='argmax', k=3,
+                         rng=None, mask=None):
+  """Chooses one legal action per row of a batched policy output.
+
+  Args:
+    action_raw: (N, action_dim) array of action probabilities.
+    observations: list of the N player observations the policy was run on.
+    mode: str, 'argmax' takes the most likely legal action, 'sample' samples
+      from the policy restricted to the legal actions and 'top_k' samples
+      among the k most likely legal actions.
+    k: int, number of candidates in 'top_k' mode.
+    rng: np.random.Generator used by the sampling modes.
+    mask: optional output of legal_moves_mask() for these observations.
+  Returns:
+    actions: list of the N chosen entries of 'legal_moves'.
+    action_indices: (N,) int array of the chosen action indices.
+  """
+  action_raw = np.asarray(action_raw)
+  if mask is None:
+    mask = legal_moves_mask(observations, action_raw.shape[-1])
+  legal, positions = mask
+
+  if mode == 'argmax':
+    action_indices = np.where(legal, action_raw, -np.inf).argmax(axis=1)
+  elif mode in ('sample', 'top_k'):
+    rng = np.random.default_rng() if rng is None else rng
+    weights = np.where(legal, action_raw, 0.)
+    if mode == 'top_k':
+      # rank of each action among the legal ones, by decreasing probability
+      order = np.argsort(np.where(legal, -action_raw, np.inf), axis=1)
+      ranks = np.empty_like(order)
+      np.put_along_axis(ranks, order, np.arange(order.shape[1])[np.newaxis],
+                        axis=1)
+      weights = np.where(ranks < k, weights, 0.)
+    # Fall back to uniform over the legal moves when they all have zero mass
+    empty = weights.sum(axis=1) <= 0
+    weights[empty] = legal[empty]
+    cdf = np.cumsum(weights, axis=1)
+    u = rng.random((len(cdf), 1)) * cdf[:, -1:]
+    action_indices = np.minimum((cdf <= u).sum(axis=1), cdf.shape[1] - 1)
+  else:
+    raise ValueError('Unknown selection mode: %s' % mode)
+
+  legal_indices = positions[np.arange(len(positions)), action_indices]
+  actions = [obs['legal_moves'][i]
+             for obs, i in zip(observations, legal_indices)]
+  return actions, action_indices
+
+ARCHITECTURE_FILE = 'architecture.json'
+
+
+def load_architecture(path_to_my_model):
+  """Reads the hyperparameters a model overrides, e.g. a distilled student.
+
+  They are stored in architecture.json next to best.h5, holding any of
+  'hl_sizes', 'bNorm' and 'dropout'; the hidden activations are ReLUs.
+
+  Args:
+    path_to_my_model: str, path to best.h5.
+  Returns:
+    dict of the overridden hyperparameters, empty for the imitators.
+  """
+  path = os.path.join(os.path.dirname(path_to_my_model), ARCHITECTURE_FILE)
+  if not os.path.exists(path):
+    return {}
+  with open(path) as architecture:
+    return json.load(architecture)
+
+
+def load_imitator(path_to_my_model):
+  """Builds the imitator Mlp and loads its weights from disk.
+
+  Args:
+    path_to_my_model: str, path to the saved weights (best.h5).
+  Returns:
+    the constructed Mlp, with the keras model in its `model` attribute.
+  """
+  # keras is imported here so that the numpy backend runs without TensorFlow
+  from keras.layers import ReLU, Softmax
+  from mlp import Mlp
+
+  hypers = {'lr': 0.00015,
+            'batch_size': 128,
+            'hl_sizes': [1024,1024,512,512,512,256],
+            'decay': 0., 
+            'bNorm': True,
+            'dropout': True,
+            'regularizer': None}
+  hypers.update(load_architecture(path_to_my_model))
+  hypers['hl_activations'] = [ReLU] * len(hypers['hl_sizes'])
+
+  m = Mlp(
+      io_sizes=(658, 20),
+      out_activation=Softmax, loss='categorical_crossentropy',
+      metrics=['accuracy'], **hypers, verbose=1)
+  m.construct_model(path_to_my_model, weights_only=True)
+  return m
+
+
+def exported_weights(path_to_my_model, quantization=None):
+  """Returns the up to date NumPy export of best.h5, if any.
+
+  Args:
+    path_to_my_model: str, path to best.h5.
+    quantization: str, None for float32 weights, 'float16' or 'int8'.
+  Returns:
+    the path of the flat weight file, else of the .npz export, that is not
+    older than best.h5, or None.
+  """
+  mtime = os.path.getmtime(path_to_my_model)
+  for exported in (flat_path(path_to_my_model, quantization),
+                   numpy_path(path_to_my_model, quantization)):
+    if os.path.exists(exported) and os.path.getmtime(exported) >= mtime:
+      return exported
+  return None
+
+
+def default_backend(path_to_my_model):
+  """Returns 'numpy' if best.h5 has an up to date NumPy export, which loads
+  without TensorFlow, and 'keras' otherwise."""
+  if exported_weights(path_to_my_model) is not None:
+    return 'numpy'
+  return 'keras'
+
+
+def load_numpy_imitator(path_to_my_model, quantization=None):
+  """Loads the imitator as a NumpyMlp.
+
+  The flat weight file next to best.h5 (see export_weights.py) is memory
+  mapped when it is up to date, else the .npz export (see numpy_mlp.py and
+  quantize.py) is read, so that TensorFlow is never imported. Otherwise the
+  keras model is built, exported and quantized, and the .npz export is saved
+  for the next load.
+
+  Args:
+    path_to_my_model: str, path to best.h5 or to one of its .hnw or .npz
+      exports.
+    quantization: str, None for float32 weights, 'float16' or 'int8'.
+  Returns:
+    a NumpyMlp.
+  """
+  if path_to_my_model.endswith('.hnw'):
+    return NumpyMlp.load_flat(path_to_my_model)
+  if path_to_my_model.endswith('.npz'):
+    return NumpyMlp.load(path_to_my_model)
+  exported = exported_weights(path_to_my_model, quantization)
+  if exported is not None:
+    return load_numpy_imitator(exported)
+  if quantization is None:
+    model = NumpyMlp.from_mlp(load_imitator(path_to_my_model))
+  else:
+    model = load_numpy_imitator(path_to_my_model).quantize(quantization)
+  try:
+    model.save(numpy_path(path_to_my_model, quantization))
+  except OSError:
+    pass  # read-only model directory, the export is rebuilt next time
+  return model
+
+
+LOADERS = {'keras': load_imitator,
+           'numpy': load_numpy_imitator,
+           'float16': functools.partial(load_numpy_imitator,
+                                        quantization='float16'),
+           'int8': functools.partial(load_numpy_imitator,
+                                     quantization='int8')}
+
 
 class Agent():
   """
   path_to_my_model - file that saved the model
+  cache - ModelCache the model is fetched from, shared by all agents of the
+          process by default so that the weights are only loaded once
+  batched - if True, forward passes go through the process-wide
+            InferenceBroker of the model so that concurrent agents using the
+            same model are evaluated together; a dict is passed on to the
+            broker as its options
+  backend - 'keras' runs the Mlp through TensorFlow, 'numpy' runs the
+            exported NumpyMlp without loading TensorFlow, 'float16' and
+            'int8' run its quantized variants
+  memo - if True, predictions are memoized by observation in the
+         process-wide PredictionMemo, so that repeated positions skip the
+         forward pass; a PredictionMemo may be given instead
   """
-  def __init__(self, path_to_my_model):
+  def __init__(self, path_to_my_model, cache=model_cache, batched=False,
+               backend='keras', memo=None):
     """Initialize the agent."""
-    # self.pre_trained = keras.models.load_model(path_to_my_model)
-    
-    '''
-    input = Input(shape=(658, ))
-    h1 = Dropout(0.5)(ReLU()(Dense(1024, kernel_regularizer=None)(input)))
-    h2 = Dropout(0.5)(ReLU()(Dense(512, kernel_regularizer=None)(h1)))
-    h3 = Dropout(0.5)(ReLU()(Dense(256, kernel_regularizer=None)(h2)))
-    out = Softmax()(Dense(20)(h3))
-    m = Model(inputs=input, outputs=out)
-    '''
-    hypers = {'lr': 0.00015,
-              'batch_size': 128,
-              'hl_activations': [ReLU, ReLU, ReLU, ReLU, ReLU, ReLU],
-              'hl_sizes': [1024,1024,512,512,512,256],
-              'decay': 0., 
-              'bNorm': True,
-              'dropout': True,
-              'regularizer': None}
-
-    m = Mlp(
-        io_sizes=(658, 20),
-        out_activation=Softmax, loss='categorical_crossentropy',
-        metrics=['accuracy'], **hypers, verbose=1)
-    m.construct_model(path_to_my_model, weights_only=True)
-
-    #m.load_weights(path_to_my_model)
-    #m.compile(optimizer=Adam(lr=0), loss='categorical_crossentropy',
-    #metrics=['accuracy'])
-
-    self.pre_trained = m
+    self.path_to_my_model = path_to_my_model
+    self.name = model_name(path_to_my_model)
+    self.backend = backend
+    loader = LOADERS[backend]
+    if cache is None:
+      self.pre_trained = loader(path_to_my_model)
+    else:
+      self.pre_trained = cache.get(path_to_my_model, loader, variant=backend)
+
+    if backend == 'keras':
+      self._predict = self.pre_trained.model.predict
+      self._predict_batch = self.pre_trained.model.predict_on_batch
+    else:
+      self._predict = self._predict_batch = self.pre_trained.predict
+
+    self.broker = None
+    if batched:
+      broker_options = batched if isinstance(batched, dict) else {}
+      self.broker = get_broker(path_to_my_model, self._predict_batch,
+                               variant=backend, **broker_options)
+
+    self.memo = prediction_memo if memo is True else (memo or None)
+    self.model_key = (os.path.abspath(path_to_my_model),
+                      os.path.getmtime(path_to_my_model), backend)
+
+  def _predict_one(self, observation_vector):
+    """Forward pass of a (1, 658) observation, through the broker if any."""
+    if self.broker is not None:
+      try:
+        return self.broker.predict(observation_vector[0])[np.newaxis]
+      except BrokerClosed:
+        # The broker of an older version of the file was retired, possibly
+        # by another session since the last move
+        self.broker = None
+    return self._predict(observation_vector)
+
+  async def _predict_one_async(self, observation_vector):
+    """Awaitable forward pass of a (658,) observation, see _predict_one()."""
+    if self.broker is not None:
+      try:
+        action_raw = await self.broker.predict_async(observation_vector)
+        return action_raw[np.newaxis]
+      except BrokerClosed:
+        self.broker = None
+    return self._predict(observation_vector.reshape((1,658)))
 
   def _parse_observation(self, current_player_observation):
-    observation_vector = np.array(current_player_observation['vectorized']) #FIXME: this may need to be cast as np.float64
-    return observation_vector
+    """Returns the observation vector as float32, the dtype of the models.
 
-  def act(self, obs, num_moves):
-    if obs['current_player_offset'] != 0:
-      return None
+    'vectorized' may be the list built by the environment or a row of an
+    ObservationBuffer, which is used as is without any copy.
+    """
+    return np.asarray(current_player_observation['vectorized'],
+                      dtype=np.float32)
 
-    observation_vector = self._parse_observation(obs)
-    observation_vector = observation_vector.reshape((1,658))
-    action_raw = self.pre_trained.model.predict(observation_vector)
+  def _select_action(self, action_raw, obs):
     action_idx = np.argmax(action_raw)
-    one_hot_action_vector = [0]*num_moves
 
     if action_idx in obs['legal_moves_as_int']:
         action_leg_idx = obs['legal_moves_as_int'].index(action_idx)
@@ -95,3 +315,68 @@ class Agent():
 
     action = obs['legal_moves'][action_leg_idx]
     return action, action_idx
+
+  def act(self, obs, num_moves):
+    if obs['current_player_offset'] != 0:
+      return None
+
+    with timings.phase('encode', agent=self.name):
+      observation_vector = self._parse_observation(obs)
+      observation_vector = observation_vector.reshape((1,658))
+    with timings.phase('forward', agent=self.name):
+      if self.memo is None:
+        action_raw = self._predict_one(observation_vector)
+      else:
+        action_raw = self.memo.predict(self.model_key, observation_vector,
+                                       self._predict_one)
+    with timings.phase('select', agent=self.name):
+      return self._select_action(action_raw, obs)
+
+  def act_batch(self, observations, mode='argmax', k=3, rng=None,
+                observation_vectors=None):
+    """Chooses the actions of several acting players in one forward pass.
+
+    Args:
+      observations: list of N observations of players whose turn it is.
+      mode, k, rng: see select_legal_actions().
+      observation_vectors: optional (N, 658) array holding the encoded
+        observations, e.g. ObservationBuffer rows, used instead of stacking
+        the 'vectorized' entries of the observations.
+    Returns:
+      list of N (action, action_idx) pairs, action_idx being the index of the
+      chosen legal action.
+    """
+    with timings.phase('encode', agent=self.name):
+      if observation_vectors is None:
+        observation_vectors = np.array(
+            [obs['vectorized'] for obs in observations], dtype=np.float32)
+    with timings.phase('forward', agent=self.name):
+      if self.memo is None:
+        action_raw = self._predict_batch(observation_vectors)
+      else:
+        action_raw = self.memo.predict(self.model_key, observation_vectors,
+                                       self._predict_batch)
+    with timings.phase('select', agent=self.name):
+      actions, action_indices = select_legal_actions(
+          action_raw, observations, mode=mode, k=k, rng=rng)
+    return list(zip(actions, action_indices))
+
+  async def act_async(self, obs, num_moves):
+    """Awaitable version of act(), batched through the broker if enabled."""
+    if obs['current_player_offset'] != 0:
+      return None
+
+    with timings.phase('encode', agent=self.name):
+      observation_vector = self._parse_observation(obs)
+    with timings.phase('forward', agent=self.name):
+      action_raw = None
+      if self.memo is not None:
+        action_raw = self.memo.get(self.model_key, observation_vector)
+      if action_raw is not None:
+        action_raw = action_raw[np.newaxis]
+      else:
+        action_raw = await self._predict_one_async(observation_vector)
+        if self.memo is not None:
+          self.memo.put(self.model_key, observation_vector, action_raw[0])
+    with timings.phase('select', agent=self.name):
+      return self._select_action(action_raw, obs)
@@ -1,56 +1,109 @@
-from hanabi_env import rl_env
-from experiments.cross_play.wrappers import agent_wrapper
-
-
-def one_hot_vectorized_action(agent, num_moves, obs):
-    action, action_idx = agent.act(obs,num_moves)
-    one_hot_action_vector = [0]*num_moves
-    one_hot_action_vector[action_idx] = 1
-
-    return one_hot_action_vector, action
+from hanabi_learning_environment import rl_env
+from cross_play_wrappers import agent_wrapper
+from cross_play_wrappers.encoding import (ObservationBuffer,
+                                          acting_observation, lean_reset,
+                                          lean_step)
+from game import game_config, game_seeds
+from dataset import ShardWriter
+from game_record import GameRecordWriter
 
 class DataCreator(object):
-    def __init__(self, num_games, path_model_0, path_model_1 ):
-        config = {'colors': 5,
-          'ranks': 5,
-          'players': 2,
-          'hand_size': 5,
-          'max_information_tokens': 8,
-          'max_life_tokens': 3,
-          'seed': 1,
-          'observation_type': 1,  # FIXME: NEEDS CONFIRMATION
-          'random_start_player': False}
+    def __init__(self, num_games, path_model_0, path_model_1, out_dir=None,
+                 shard_size=65536, seed=1, record_path=None, lean=True):
+        """ Generate imitation data by playing two imitators together.
+        Arguments:
+            - num_games: int
+                Number of games to play.
+            - path_model_0, path_model_1: str
+                Models of the two seats.
+            - out_dir: str, default None
+                Directory the (observation, legal mask, action, player,
+                game) records are streamed to, see dataset.ShardWriter. No
+                record is kept if None.
+            - shard_size: int, default 65536
+                Number of records per shard.
+            - seed: int, default 1
+                Deck seed of the first game, see game.game_seeds().
+            - record_path: str, default None
+                File the compact record of every game is appended to, see
+                game_record.GameRecordWriter.
+            - lean: bool, default True
+                Build and encode the observation of the acting player only,
+                instead of stepping the environment with the observations
+                of every player.
+        """
         self.num_players = 2
         self.num_games = num_games
-        self.environment = rl_env.HanabiEnv(config)
+        self.out_dir = out_dir
+        self.record_path = record_path
+        self.shard_size = shard_size
+        self.lean = lean
+        self.seeds = game_seeds(num_games, seed)
+        self.environment = None  # built by create_data(), one per game
         self.agent_object = []
         self.agent_object.append(agent_wrapper.Agent(path_model_0))
         self.agent_object.append(agent_wrapper.Agent(path_model_1))
 
+    def _play_full(self, writer, game_num):
+        observations = self.environment.reset()
+        game_done = False
+
+        while not game_done:
+            # Every player's observation is built, only the acting one moves
+            agent_id = observations['current_player']
+            observation = observations['player_observations'][agent_id]
+            action, _ = self.agent_object[agent_id].act(
+                    observation, self.environment.num_moves())
+            legal_idx = observation['legal_moves'].index(action)
+            move = observation['legal_moves_as_int'][legal_idx]
+            if writer is not None:
+                writer.add(observation['vectorized'],
+                           observation['legal_moves_as_int'],
+                           move, agent_id, game_num)
+            observations, _, game_done, _ = self.environment.step(action)
+
+    def _play_lean(self, writer, game_num):
+        buffer = ObservationBuffer(1, self.environment.observation_encoder)
+        lean_reset(self.environment)
+        game_done = False
+
+        while not game_done:
+            observation = acting_observation(self.environment, buffer)
+            agent_id = observation['current_player']
+            action, _ = self.agent_object[agent_id].act(
+                    observation, self.environment.num_moves())
+            legal_idx = observation['legal_moves'].index(action)
+            move = observation['legal_moves_as_int'][legal_idx]
+            if writer is not None:
+                writer.add(observation['vectorized'],
+                           observation['legal_moves_as_int'],
+                           move, agent_id, game_num)
+            game_done = lean_step(self.environment, move)
+
     def create_data(self):
-        raw_data = []
+        writer = None
+        if self.out_dir is not None:
+            writer = ShardWriter(self.out_dir, shard_size=self.shard_size)
+        records = None
+        if self.record_path is not None:
+            records = GameRecordWriter(self.record_path)
         scores = []
         for game_num in range(self.num_games):
-            raw_data.append([[],[]])
-            observations = self.environment.reset()
-            game_done = False
-
-            while not game_done:
-                for agent_id in range(self.num_players):
-                    observation = observations['player_observations'][agent_id]
-                    one_hot_action_vector, action = one_hot_vectorized_action(
-                            self.agent_object[agent_id],
-                            self.environment.num_moves(),
-                            observation)
-                    if observation['current_player'] == agent_id:
-                        assert action is not None
-                        current_player_action = action
-                    else:
-                        assert action is None
-
-                    observations, _, game_done, _ = self.environment.step(
-                            current_player_action)
-                    if game_done:
-                        scores.append(self.environment.state.score())
-                        break
+            self.environment = rl_env.HanabiEnv(
+                    game_config(self.num_players, self.seeds[game_num]))
+            if writer is not None:
+                writer.add_game(game_num, self.seeds[game_num])
+            if self.lean:
+                self._play_lean(writer, game_num)
+            else:
+                self._play_full(writer, game_num)
+            scores.append(self.environment.state.score())
+            if records is not None:
+                records.write_state(self.environment.state,
+                                    self.environment.game,
+                                    self.seeds[game_num])
+        if writer is not None:
+            writer.close()
+        if records is not None:
+            records.close()
         return scores
@@ -0,0 +1,122 @@
+import numpy as np
+from hanabi_learning_environment import pyhanabi
+
+_ZERO = ord('0')
+
+
+def encode_into(encoder, observation, out):
+    """ Write the canonical encoding of an observation into an array row.
+    The C library returns the encoding as a comma separated string of 0/1
+    digits, which is decoded with a strided view over its bytes instead of
+    going through a Python list of ints.
+    Arguments:
+        - encoder: pyhanabi.ObservationEncoder
+            Encoder of the environment, e.g. env.observation_encoder.
+        - observation: pyhanabi.HanabiObservation
+            Observation of one player.
+        - out: np.ndarray
+            1-D array of length encoder.shape()[0], any numeric dtype.
+    Returns:
+        - out
+    """
+    c_encoding_str = pyhanabi.lib.EncodeObservation(
+        encoder._encoder, observation.observation())
+    try:
+        raw = pyhanabi.ffi.string(c_encoding_str)
+    finally:
+        pyhanabi.lib.DeleteString(c_encoding_str)
+    digits = np.frombuffer(raw, dtype=np.uint8)[::2]
+    if len(raw) == 2 * len(out) - 1 and digits.max() <= _ZERO + 1:
+        np.subtract(digits, _ZERO, out=out, casting='unsafe')
+    else:
+        # Not a plain 0/1 encoding, parse it the slow way
+        out[:] = [int(x) for x in raw.split(b',')]
+    return out
+
+
+class ObservationBuffer(object):
+    def __init__(self, num_rows, encoder, dtype=np.float32):
+        """ Reusable block of encoded observations owned by a runner.
+        Each row holds the canonical encoding of one player's observation,
+        written in place by encode(). Rows (or the whole block) can be handed
+        to Agent.act and Agent.act_batch without further copies or casts.
+        Arguments:
+            - num_rows: int
+                Number of observations held at once, e.g. the number of
+                players or of parallel games.
+            - encoder: pyhanabi.ObservationEncoder
+                Encoder of the environment.
+            - dtype: numpy dtype, default np.float32
+                np.float32 is what the models consume, np.uint8 takes a
+                quarter of the memory.
+        """
+        self.encoder = encoder
+        self.size = encoder.shape()[0]
+        self.data = np.zeros((num_rows, self.size), dtype=dtype)
+
+    def encode(self, row, observation):
+        """ Encode a pyhanabi observation into @row and return the row. """
+        return encode_into(self.encoder, observation, self.data[row])
+
+    def encode_player(self, row, state, player):
+        """ Encode the observation of @player in @state into @row. """
+        return self.encode(row, state.observation(player))
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def lean_reset(env):
+    """ env.reset() without building the observations of the players. """
+    env.state = env.game.new_initial_state()
+    while env.state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+        env.state.deal_random_card()
+    return env.state
+
+
+def lean_step(env, action):
+    """ env.step() without building the observations of the players.
+    Arguments:
+        - env: rl_env.HanabiEnv
+        - action: dict, int or pyhanabi.HanabiMove
+            Move of the current player, as in env.step().
+    Returns:
+        - whether the game is over.
+    """
+    if isinstance(action, dict):
+        action = env._build_move(action)
+    elif isinstance(action, int):
+        action = env.game.get_move(action)
+    env.state.apply_move(action)
+    while env.state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+        env.state.deal_random_card()
+    return env.state.is_terminal()
+
+
+def acting_observation(env, buffer, row=0):
+    """ Observation of the current player only, encoded into a buffer row.
+    The dict has the keys of an rl_env player observation that the agents
+    and runners use: current_player, current_player_offset, fireworks,
+    legal_moves, legal_moves_as_int and vectorized, the latter being the
+    buffer row.
+    Arguments:
+        - env: rl_env.HanabiEnv
+        - buffer: ObservationBuffer
+            Buffer built with env.observation_encoder.
+        - row: int, default 0
+            Row of @buffer the encoding is written to.
+    """
+    player = env.state.cur_player()
+    observation = env.state.observation(player)
+    legal_moves = observation.legal_moves()
+    return {'current_player': player,
+            'current_player_offset': 0,
+            'fireworks': dict(zip(pyhanabi.COLOR_CHAR,
+                                  observation.fireworks())),
+            'legal_moves': [move.to_dict() for move in legal_moves],
+            'legal_moves_as_int': [env.game.get_move_uid(move)
+                                   for move in legal_moves],
+            'vectorized': buffer.encode(row, observation)}
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BrokerClosed(RuntimeError):
+    """ Raised when a vector is submitted to a closed InferenceBroker. """
+
+
+class InferenceBroker(object):
+    def __init__(self, predict_fn, input_size=658, max_batch_size=32,
+                 max_wait_us=500, dtype=np.float32):
+        """ Micro-batching front end of a model shared by many callers.
+        Observation vectors submitted from any session or seat are queued
+        and flushed as a single forward pass once @max_batch_size vectors
+        are waiting or the oldest one has waited @max_wait_us microseconds.
+        Each caller then receives its own row of the batched output.
+        Arguments:
+            - predict_fn: func
+                Batched forward pass, maps a (n, input_size) array to a
+                (n, num_actions) array.
+            - input_size: int, default 658
+                Length of an observation vector.
+            - max_batch_size: int, default 32
+                Flush as soon as this many vectors are queued.
+            - max_wait_us: int, default 500
+                Maximum time in microseconds a vector waits for others.
+            - dtype: numpy dtype, default np.float32
+                Dtype of the batch handed to @predict_fn.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_us / 1e6
+        self.batches = 0
+        self.requests = 0
+        self._buffer = np.zeros((max_batch_size, input_size), dtype=dtype)
+        self._queue = []  # (enqueue time, vector, future)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='inference-broker')
+        self._thread.start()
+
+    def submit(self, observation_vector):
+        """ Queue one observation vector.
+        Returns:
+            - concurrent.futures.Future resolving to the output row.
+        Raises:
+            - BrokerClosed once close() was called.
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise BrokerClosed('InferenceBroker is closed')
+            self._queue.append((time.monotonic(), observation_vector, future))
+            if len(self._queue) == 1 or \
+                    len(self._queue) >= self.max_batch_size:
+                self._cond.notify()
+        return future
+
+    def predict(self, observation_vector):
+        """ Blocking API: return the output row for one observation. """
+        return self.submit(observation_vector).result()
+
+    async def predict_async(self, observation_vector):
+        """ Awaitable API: return the output row for one observation. """
+        return await asyncio.wrap_future(self.submit(observation_vector))
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = self._queue[0][0] + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch_size]
+            del self._queue[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            n = len(batch)
+            for i, (_, vector, _) in enumerate(batch):
+                self._buffer[i] = vector
+            try:
+                output = np.asarray(self.predict_fn(self._buffer[:n]))
+            except Exception as err:
+                for _, _, future in batch:
+                    future.set_exception(err)
+                continue
+            self.batches += 1
+            self.requests += n
+            for i, (_, _, future) in enumerate(batch):
+                future.set_result(output[i].copy())
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """ Flush the pending vectors and stop the worker thread. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        return {'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch_size':
+                    self.requests / self.batches if self.batches else 0.}
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker(path, predict_fn, variant=None, **kwargs):
+    """ Return the process-wide broker of the model stored at @path.
+    Brokers are keyed like the model cache, by absolute path and file
+    modification time, so that callers using the same model from different
+    sessions end up in the same batches. As in the model cache, creating the
+    broker of a new version of a file closes and drops the brokers of its
+    older versions, so a retrained model does not leave a worker thread and
+    its batch buffer behind.
+    Arguments:
+        - path: str
+            Path to the saved model.
+        - predict_fn: func
+            Batched forward pass, only used when the broker is created.
+        - variant: hashable, default None
+            Distinguishes brokers of different backends of the same file.
+        - kwargs:
+            Forwarded to InferenceBroker().
+    """
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path), variant)
+    with _brokers_lock:
+        if key in _brokers:
+            return _brokers[key]
+        stale = [k for k in _brokers if k[0] == path and k[2] == variant]
+        for k in stale:
+            _brokers.pop(k).close()
+        _brokers[key] = InferenceBroker(predict_fn, **kwargs)
+        return _brokers[key]
+
+
+def close_brokers():
+    """ Close and drop every process-wide broker. """
+    with _brokers_lock:
+        for broker in _brokers.values():
+            broker.close()
+        _brokers.clear()
@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Default memory budget of the process-wide cache, overridable through the
+# environment so that GUI workers can be sized without touching the code.
+DEFAULT_MAX_BYTES = int(os.environ.get('HANABI_MODEL_CACHE_MB', 512)) * 2**20
+
+
+def model_nbytes(model):
+    """ Estimate the resident size of a loaded model from its weights.
+    Arguments:
+        - model: object
+            Either an Mlp (whose keras model is in `.model`), a keras model or
+            any object exposing `get_weights()`.
+    Returns:
+        - int, number of bytes held by the weight arrays.
+    """
+    if hasattr(model, 'nbytes'):
+        return int(model.nbytes)
+    if hasattr(model, 'model') and model.model is not None:
+        model = model.model
+    return int(sum(w.nbytes for w in model.get_weights()))
+
+
+class ModelCache(object):
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, size_fn=model_nbytes):
+        """ Thread-safe LRU cache of loaded models.
+        Entries are keyed by the absolute model path and its modification
+        time, so a retrained `best.h5` is reloaded on the next lookup while
+        every session and tournament shares one instance per imitator.
+        Models are loaded outside of the cache lock, so that a cold load
+        does not hold up the lookups of other models; concurrent misses on
+        the same model wait for a single load.
+        Arguments:
+            - max_bytes: int
+                Memory budget. Least recently used models are evicted until
+                the cached models fit in it. The most recently loaded model
+                is always kept, even if it alone exceeds the budget.
+            - size_fn: func, default model_nbytes
+                Function returning the size in bytes of a loaded model.
+        """
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (path, mtime) -> (model, nbytes)
+        self._loading = {}  # (path, mtime, variant) -> Future of the load
+        self._nbytes = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(path):
+        path = os.path.abspath(path)
+        return path, os.path.getmtime(path)
+
+    def get(self, path, loader, variant=None):
+        """ Return the model stored at @path, loading it on a miss.
+        Arguments:
+            - path: str
+                Path to the saved model.
+            - loader: func
+                Called as loader(path) to build the model on a cache miss.
+            - variant: hashable, default None
+                Distinguishes different loaded forms of the same file (e.g.
+                keras and numpy backends).
+        Returns:
+            - The cached model.
+        """
+        path, mtime = self._key(path)
+        key = (path, mtime, variant)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            future = self._loading.get(key)
+            if future is None:
+                self.misses += 1
+                future = self._loading[key] = Future()
+                loading = True
+            else:
+                # Another thread is loading the model
+                self.hits += 1
+                loading = False
+        if not loading:
+            return future.result()
+
+        try:
+            model = loader(path)
+            nbytes = self.size_fn(model)
+        except BaseException as err:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._loading[key]
+            versions = [k for k in self._entries
+                        if k[0] == path and k[2] == variant]
+            # A newer version loaded meanwhile is kept, this one is not
+            if all(k[1] < mtime for k in versions):
+                # Drop entries of older versions of the same file
+                for stale in versions:
+                    self._remove(stale)
+                self._entries[key] = (model, nbytes)
+                self._nbytes += nbytes
+                self._evict()
+        future.set_result(model)
+        return model
+
+    def _remove(self, key):
+        _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def resize(self, max_bytes):
+        """ Change the memory budget, evicting models if needed. """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def __contains__(self, path):
+        try:
+            path, mtime = self._key(path)
+        except OSError:
+            return False
+        with self._lock:
+            return any(k[:2] == (path, mtime) for k in self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """ Return the hit/miss/eviction counters and current usage. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.,
+                    'entries': len(self._entries),
+                    'nbytes': self._nbytes,
+                    'max_bytes': self.max_bytes}
+
+
+# Process-wide cache shared by every Agent
+model_cache = ModelCache()
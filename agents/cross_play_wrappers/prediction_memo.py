@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Default number of memoized predictions, about 250 bytes each
+DEFAULT_CAPACITY = int(os.environ.get('HANABI_PREDICTION_MEMO_SIZE', 1 << 16))
+
+
+class PredictionMemo(object):
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """ Thread-safe LRU memo of model outputs keyed by observation.
+        The canonical observation encoding is binary, so an observation is
+        keyed by its 658 bits packed into 83 bytes, which Python hashes and
+        compares far faster than the vector itself. Keys also hold the model
+        identity, so that one memo serves every agent of the process.
+        Arguments:
+            - capacity: int
+                Number of predictions kept; the least recently used ones
+                are evicted beyond it.
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (model, packed bits) -> prediction
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def observation_key(observation_vector):
+        """ Packed bits of a binary observation vector. """
+        return np.packbits(np.asarray(observation_vector) != 0).tobytes()
+
+    def get(self, model_key, observation_vector):
+        """ Memoized prediction of the model for the observation, or None.
+        """
+        key = (model_key, self.observation_key(observation_vector))
+        with self._lock:
+            prediction = self._entries.get(key)
+            if prediction is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return prediction
+
+    def put(self, model_key, observation_vector, prediction):
+        key = (model_key, self.observation_key(observation_vector))
+        prediction = np.array(prediction)
+        prediction.setflags(write=False)
+        with self._lock:
+            self._entries[key] = prediction
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def predict(self, model_key, observation_vectors, predict_fn):
+        """ Predictions of a batch, running @predict_fn on the misses only.
+        Arguments:
+            - model_key: hashable
+                Identity of the model, e.g. its path, mtime and backend.
+            - observation_vectors: np.ndarray
+                (N, 658) binary observation vectors.
+            - predict_fn: func
+                Forward pass of the model on a (M, 658) batch.
+        Returns:
+            - (N, num_actions) np.ndarray.
+        """
+        observation_vectors = np.asarray(observation_vectors)
+        keys = [(model_key, self.observation_key(v))
+                for v in observation_vectors]
+        with self._lock:
+            found = [self._entries.get(key) for key in keys]
+            for key, prediction in zip(keys, found):
+                if prediction is not None:
+                    self._entries.move_to_end(key)
+            misses = [i for i, prediction in enumerate(found)
+                      if prediction is None]
+            self.hits += len(keys) - len(misses)
+            self.misses += len(misses)
+        if not misses:
+            return np.stack(found)
+
+        predicted = np.asarray(predict_fn(observation_vectors[misses]))
+        with self._lock:
+            for i, prediction in zip(misses, predicted):
+                prediction = prediction.copy()
+                prediction.setflags(write=False)
+                self._entries[keys[i]] = found[i] = prediction
+            self._evict()
+        return np.stack(found)
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """ Return the hit/miss/eviction counters and current usage. """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.,
+                    'entries': len(self._entries),
+                    'capacity': self.capacity}
+
+
+# Process-wide memo shared by the agents created with memo=True
+prediction_memo = PredictionMemo()
@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+
+# name -> (dtype, shape of one record) of the fields stored in every shard
+FIELDS = {'obs': (np.uint8, (658, )),
+          'mask': (np.bool_, (20, )),
+          'action': (np.int16, ()),
+          'player': (np.int8, ()),
+          'game': (np.int64, ())}
+MANIFEST = 'manifest.json'
+
+
+def shard_path(directory, shard, field):
+    return os.path.join(directory, 'shard-%05d.%s.npy' % (shard, field))
+
+
+class ShardWriter(object):
+    def __init__(self, directory, shard_size=65536, fields=FIELDS):
+        """ Stream imitation records to disk in fixed-size shards.
+        Records are buffered in preallocated arrays of @shard_size rows and
+        every full buffer is written as one .npy file per field, so memory
+        stays constant whatever the number of games. close() writes the last,
+        partial shard and a manifest with the record counts and game seeds.
+        Game seeds are kept as ranges of consecutive games dealt with
+        consecutive seeds, a single range with game.game_seeds(), so that
+        they take constant memory too.
+        Arguments:
+            - directory: str
+                Output directory, created if needed.
+            - shard_size: int, default 65536
+                Number of records per shard.
+            - fields: dict, default FIELDS
+                Name -> (dtype, record shape) of the stored fields.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.fields = fields
+        self.buffers = {name: np.zeros((shard_size, ) + shape, dtype=dtype)
+                        for name, (dtype, shape) in fields.items()}
+        self.shards = []
+        # [first game, number of games, seed of the first game]
+        self.seed_ranges = []
+        self.num_games = 0
+        self.num_records = 0
+        self._fill = 0
+
+    def add(self, obs, legal_moves_as_int, action, player, game):
+        """ Append one record.
+        Arguments:
+            - obs: sequence
+                Encoded observation of the acting player.
+            - legal_moves_as_int: list
+                Legal move uids, stored as a boolean mask.
+            - action: int
+                Uid of the move played.
+            - player: int
+                Acting player.
+            - game: int
+                Game id, see add_game().
+        """
+        i = self._fill
+        self.buffers['obs'][i] = obs
+        mask = self.buffers['mask'][i]
+        mask[:] = False
+        mask[legal_moves_as_int] = True
+        self.buffers['action'][i] = action
+        self.buffers['player'][i] = player
+        self.buffers['game'][i] = game
+        self._fill += 1
+        if self._fill == self.shard_size:
+            self.flush()
+
+    def add_game(self, game, seed):
+        """ Record the deck seed of a game. """
+        self.num_games += 1
+        if self.seed_ranges:
+            first_game, count, first_seed = self.seed_ranges[-1]
+            if game == first_game + count and seed == first_seed + count:
+                self.seed_ranges[-1][1] += 1
+                return
+        self.seed_ranges.append([game, 1, seed])
+
+    def flush(self):
+        """ Write the buffered records as a new shard. """
+        if self._fill == 0:
+            return
+        shard = len(self.shards)
+        for name, buffer in self.buffers.items():
+            np.save(shard_path(self.directory, shard, name),
+                    buffer[:self._fill])
+        self.shards.append({'shard': shard, 'records': self._fill})
+        self.num_records += self._fill
+        self._fill = 0
+
+    def close(self):
+        """ Flush the last shard and write the manifest. """
+        self.flush()
+        manifest = {'num_records': self.num_records,
+                    'shard_size': self.shard_size,
+                    'shards': self.shards,
+                    'fields': {name: [np.dtype(dtype).str, list(shape)]
+                               for name, (dtype, shape)
+                               in self.fields.items()},
+                    'num_games': self.num_games,
+                    'seed_ranges': [{'first_game': g, 'num_games': n,
+                                     'first_seed': seed}
+                                    for g, n, seed in self.seed_ranges]}
+        tmp_path = os.path.join(self.directory, MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as out:
+            json.dump(manifest, out, indent=1)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST))
+        return manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as manifest:
+        return json.load(manifest)
+
+
+def game_seed(manifest, game):
+    """ Deck seed of a game of a dataset, from its manifest. """
+    for r in manifest['seed_ranges']:
+        if r['first_game'] <= game < r['first_game'] + r['num_games']:
+            return r['first_seed'] + game - r['first_game']
+    raise KeyError('Game %d is not in the dataset' % game)
+
+
+def read_records(directory, fields=('obs', 'mask'), max_records=None):
+    """ Load the first @max_records records of a dataset, all if None.
+    Returns:
+        - dict field -> array of the records.
+    """
+    arrays = {field: [] for field in fields}
+    count = 0
+    for shard in read_manifest(directory)['shards']:
+        if max_records is not None and count >= max_records:
+            break
+        n = shard['records'] if max_records is None \
+            else min(shard['records'], max_records - count)
+        for field in fields:
+            arrays[field].append(np.load(
+                shard_path(directory, shard['shard'], field),
+                mmap_mode='r')[:n])
+        count += n
+    return {field: np.concatenate(a) for field, a in arrays.items()}
@@ -0,0 +1,345 @@
+""" Distill an imitator into smaller, faster student MLPs.
+
+Observations are generated by teacher self-play (or read from a dataset
+written by dataset.ShardWriter) and labelled with the teacher's action
+probabilities. One student Mlp per requested hidden layer sizes is trained on
+these soft targets and saved as <output-dir>/<teacher>-<sizes>.save/best.h5,
+with its architecture.json and its flat weight export, so that
+agent_wrapper.Agent loads it with any backend like any other model. Each
+student, and the teacher as a reference, is then measured on the held-out
+observations and in self-play, and a Pareto report of action agreement with
+the teacher, mean game score and per-move latency is written to
+<output-dir>/pareto.json.
+
+    python agents/distill.py agents/imitator_models/iggi.save/best.h5 \
+        --sizes 256,128 128,64 64
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.utils import Sequence
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, AGENTS_DIR)
+from dataset import read_records
+from numpy_mlp import NumpyMlp, flat_path
+from cross_play_wrappers.agent_wrapper import (ARCHITECTURE_FILE, Agent,
+                                               legal_moves_mask,
+                                               load_numpy_imitator,
+                                               select_legal_actions)
+from evaluation import mean_interval
+from runtime import model_name
+
+DEFAULT_SIZES = ('512,256', '256,128', '128,64', '64')
+
+
+class SoftTargetSequence(Sequence):
+    def __init__(self, obs, targets, batch_size=256, shuffle=True, seed=0):
+        """ Batches of observations and teacher probabilities.
+        The observations are kept as uint8 and only the batch is converted
+        to float32.
+        Arguments:
+            - obs: np.ndarray
+                (n, 658) binary observation vectors.
+            - targets: np.ndarray
+                (n, 20) teacher action probabilities.
+            - batch_size: int, default 256
+                Number of records per batch.
+            - shuffle: bool, default True
+                Draw a new permutation of the records at every epoch.
+            - seed: int, default 0
+                Seed of the permutations.
+        """
+        self.obs = obs
+        self.targets = targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.index = np.arange(len(obs))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.index) / self.batch_size))
+
+    def __getitem__(self, idx):
+        batch = np.sort(self.index[idx * self.batch_size:
+                                   (idx + 1) * self.batch_size])
+        return (self.obs[batch].astype(np.float32),
+                self.targets[batch])
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.index)
+
+
+def generate_observations(teacher, num_games, seed=1, num_envs=64,
+                          mode='sample', players=2):
+    """ Observations of the acting players in teacher self-play games.
+    Arguments:
+        - teacher: NumpyMlp
+            Policy playing every seat.
+        - num_games: int
+            Number of games played.
+        - seed: int, default 1
+            Deck seed of the first game, see game.game_seeds().
+        - num_envs: int, default 64
+            Games played in lockstep, batching their forward passes.
+        - mode: str, default 'sample'
+            Action selection, see agent_wrapper.select_legal_actions;
+            sampling visits more varied positions than argmax.
+        - players: int, default 2
+            Number of players.
+    Returns:
+        - obs (n, 658) uint8 and mask (n, 20) bool arrays.
+    """
+    from game import game_seeds
+    from vector_runner import LockstepGames
+
+    rng = np.random.default_rng(seed)
+    games = LockstepGames(num_envs, players, game_seeds(num_games, seed))
+    obs, masks = [], []
+    while not games.done:
+        observations = [g['observation'] for g in games.observe()]
+        vectors = games.vectors()
+        mask = legal_moves_mask(observations, teacher.io_sizes[1])
+        _, action_indices = select_legal_actions(
+            teacher.predict(vectors), observations, mode=mode, rng=rng,
+            mask=mask)
+        obs.append(vectors.astype(np.uint8))
+        masks.append(mask[0])
+        games.step([int(action) for action in action_indices])
+    return np.concatenate(obs), np.concatenate(masks)
+
+
+def soft_targets(teacher, obs, temperature=1., batch_size=4096):
+    """ Teacher probabilities of every observation.
+    A @temperature above 1 flattens them, which is softmax(logits / T):
+    the probabilities are raised to 1 / T and renormalized.
+    """
+    targets = np.empty((len(obs), teacher.io_sizes[1]), dtype=np.float32)
+    for start in range(0, len(obs), batch_size):
+        targets[start:start + batch_size] = teacher.predict(
+            obs[start:start + batch_size].astype(np.float32))
+    if temperature != 1.:
+        np.power(targets, 1. / temperature, out=targets)
+        targets /= targets.sum(axis=1, keepdims=True)
+    return targets
+
+
+def build_student(hl_sizes, lr=0.001, batch_size=256, bNorm=False,
+                  dropout=False):
+    """ Student Mlp with ReLU hidden layers of sizes @hl_sizes. """
+    from keras.layers import ReLU, Softmax
+    from mlp import Mlp
+
+    student = Mlp(io_sizes=(658, 20), out_activation=Softmax,
+                  loss='categorical_crossentropy', metrics=['accuracy'],
+                  lr=lr, batch_size=batch_size,
+                  hl_activations=[ReLU] * len(hl_sizes), hl_sizes=hl_sizes,
+                  decay=0., bNorm=bNorm, dropout=dropout, verbose=2)
+    student.construct_model()
+    return student
+
+
+def save_student(student, path):
+    """ Write best.h5, architecture.json and the flat weight export. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(os.path.join(os.path.dirname(path), ARCHITECTURE_FILE),
+              'w') as architecture:
+        json.dump({'hl_sizes': list(student.hl_sizes),
+                   'bNorm': student.bNorm,
+                   'dropout': student.dropout}, architecture, indent=1)
+    student.model.save_weights(path)
+    NumpyMlp.from_mlp(student).save_flat(flat_path(path))
+
+
+def agreement(teacher, network, obs, mask, batch_size=4096):
+    """ Fraction of the observations on which @network picks the teacher's
+    legal action.
+    """
+    same = 0
+    for start in range(0, len(obs), batch_size):
+        x = obs[start:start + batch_size].astype(np.float32)
+        legal = mask[start:start + batch_size]
+        expected = np.where(legal, teacher.predict(x), -np.inf).argmax(1)
+        actual = np.where(legal, network.predict(x), -np.inf).argmax(1)
+        same += int((expected == actual).sum())
+    return same / len(obs)
+
+
+def move_latency(path, obs, mask, backend='numpy', warmup=100):
+    """ Latency of Agent.act, i.e. of one move of an interactive game.
+    Returns:
+        - dict of the mean, median and 99th percentile in microseconds.
+    """
+    agent = Agent(path, backend=backend)
+    observations = []
+    for vector, legal in zip(obs, mask):
+        moves = np.flatnonzero(legal).tolist()
+        observations.append({'current_player_offset': 0,
+                             'vectorized': vector.astype(np.float32),
+                             'legal_moves': moves,
+                             'legal_moves_as_int': moves})
+    num_moves = mask.shape[1]
+    for observation in observations[:warmup]:
+        agent.act(observation, num_moves)
+    latencies = np.empty(len(observations))
+    for i, observation in enumerate(observations):
+        start = time.perf_counter()
+        agent.act(observation, num_moves)
+        latencies[i] = time.perf_counter() - start
+    latencies *= 1e6
+    return {'latency_mean_us': float(latencies.mean()),
+            'latency_p50_us': float(np.percentile(latencies, 50)),
+            'latency_p99_us': float(np.percentile(latencies, 99))}
+
+
+def self_play_score(path, num_games, seed, backend='numpy'):
+    """ Mean self-play score and its 95% confidence interval. """
+    from vector_runner import VectorRunner
+
+    scores = VectorRunner(num_games, [path, path], seed=seed,
+                          backend=backend).runGame()
+    mean, low, high = mean_interval(scores)
+    return {'mean_score': mean, 'score_low': low, 'score_high': high}
+
+
+def pareto_front(entries, objectives=(('agreement', 1),
+                                      ('mean_score', 1),
+                                      ('latency_p50_us', -1))):
+    """ Mark the entries no other entry dominates.
+    Arguments:
+        - entries: list
+            Dicts holding the objective values.
+        - objectives: tuple
+            (key, sign) pairs, sign 1 to maximize and -1 to minimize.
+    """
+    def values(entry):
+        return [sign * entry[key] for key, sign in objectives]
+
+    for entry in entries:
+        mine = values(entry)
+        entry['pareto'] = not any(
+            all(o >= m for o, m in zip(values(other), mine)) and
+            values(other) != mine
+            for other in entries if other is not entry)
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('teacher', help='best.h5 of the teacher imitator')
+    parser.add_argument('--sizes', nargs='+', default=list(DEFAULT_SIZES),
+                        help='hidden layer sizes of each student, comma '
+                             'separated')
+    parser.add_argument('--output-dir',
+                        default=os.path.join(AGENTS_DIR, 'student_models'))
+    parser.add_argument('--dataset', default=None,
+                        help='directory written by dataset.ShardWriter, '
+                             'teacher self-play observations if omitted')
+    parser.add_argument('--num-games', type=int, default=5000,
+                        help='self-play games generating the observations')
+    parser.add_argument('--max-records', type=int, default=None)
+    parser.add_argument('--mode', default='sample',
+                        choices=['argmax', 'sample', 'top_k'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--temperature', type=float, default=1.)
+    parser.add_argument('--validation-fraction', type=float, default=0.1)
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--patience', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('--batch-norm', action='store_true')
+    parser.add_argument('--backend', default='numpy',
+                        choices=['keras', 'numpy', 'float16', 'int8'],
+                        help='backend the latency and games are measured '
+                             'with')
+    parser.add_argument('--eval-games', type=int, default=1000)
+    parser.add_argument('--eval-seed', type=int, default=1000000)
+    parser.add_argument('--latency-samples', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    teacher = load_numpy_imitator(args.teacher)
+    if args.dataset:
+        records = read_records(args.dataset, ('obs', 'mask'),
+                               args.max_records)
+        obs, mask = records['obs'], records['mask']
+    else:
+        obs, mask = generate_observations(teacher, args.num_games,
+                                          seed=args.seed, mode=args.mode)
+        obs, mask = obs[:args.max_records], mask[:args.max_records]
+    targets = soft_targets(teacher, obs, args.temperature)
+    # The last records, i.e. the last games, are held out
+    split = int(round(len(obs) * (1 - args.validation_fraction)))
+    gen_tr = SoftTargetSequence(obs[:split], targets[:split],
+                                args.batch_size, seed=args.seed)
+    gen_va = SoftTargetSequence(obs[split:], targets[split:],
+                                args.batch_size, shuffle=False)
+    held_obs, held_mask = obs[split:], mask[split:]
+    latency_obs = held_obs[:args.latency_samples]
+    latency_mask = held_mask[:args.latency_samples]
+
+    teacher_name = model_name(args.teacher)
+    entries = [dict({'name': teacher_name, 'path': args.teacher,
+                     'hl_sizes': None, 'parameters': teacher.nbytes // 4,
+                     'agreement': 1.},
+                    **move_latency(args.teacher, latency_obs, latency_mask,
+                                   args.backend),
+                    **self_play_score(args.teacher, args.eval_games,
+                                      args.eval_seed, args.backend))]
+    for sizes in args.sizes:
+        hl_sizes = [int(n) for n in sizes.split(',')]
+        name = '%s-%s' % (teacher_name, 'x'.join(map(str, hl_sizes)))
+        path = os.path.join(args.output_dir, name + '.save', 'best.h5')
+        student = build_student(hl_sizes, lr=args.lr,
+                                batch_size=args.batch_size,
+                                bNorm=args.batch_norm)
+        start = time.time()
+        student.train_model(gen_tr, gen_va, n_epoch=args.epochs,
+                            callbacks=[EarlyStopping(
+                                patience=args.patience,
+                                restore_best_weights=True)])
+        train_seconds = time.time() - start
+        save_student(student, path)
+        engine = NumpyMlp.from_mlp(student)
+        entry = {'name': name, 'path': path, 'hl_sizes': hl_sizes,
+                 'parameters': engine.nbytes // 4,
+                 'train_seconds': train_seconds,
+                 'val_loss': min(student.hist.history['val_loss']),
+                 'agreement': agreement(teacher, engine, held_obs,
+                                        held_mask)}
+        entry.update(move_latency(path, latency_obs, latency_mask,
+                                  args.backend))
+        entry.update(self_play_score(path, args.eval_games, args.eval_seed,
+                                     args.backend))
+        entries.append(entry)
+        print(json.dumps(entry), flush=True)
+
+    report = {'teacher': args.teacher,
+              'observations': len(obs),
+              'held_out': len(held_obs),
+              'temperature': args.temperature,
+              'backend': args.backend,
+              'eval_games': args.eval_games,
+              'models': pareto_front(entries)}
+    report_path = os.path.join(args.output_dir, 'pareto.json')
+    with open(report_path + '.tmp', 'w') as out:
+        json.dump(report, out, indent=2)
+    os.replace(report_path + '.tmp', report_path)
+
+    print('%-40s %10s %10s %12s %8s' % ('model', 'agreement', 'score',
+                                        'p50 (us)', 'pareto'))
+    for entry in entries:
+        print('%-40s %10.4f %10.2f %12.1f %8s' % (
+            entry['name'], entry['agreement'], entry['mean_score'],
+            entry['latency_p50_us'], '*' if entry['pareto'] else ''))
+
+
+if __name__ == '__main__':
+    main()
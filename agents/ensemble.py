@@ -0,0 +1,207 @@
+""" Evaluate all the imitators on the same observations in one pass.
+
+The imitators share the Agent architecture, so the folded weights of every
+layer are stacked into (models, n_in, n_out) arrays and the whole ensemble
+runs as one batched matmul chain producing (models, observations, 20)
+probabilities. The command line prints the pairwise action agreement of the
+models over a dataset written by dataset.ShardWriter.
+
+    python agents/ensemble.py --dataset imitation_data
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+from cross_play_wrappers.agent_wrapper import LOADERS, legal_moves_mask
+from cross_play_wrappers.model_cache import model_cache
+from runtime import model_name
+
+
+class Ensemble(object):
+    def __init__(self, models, names=None, dtype=np.float32):
+        """ Stack networks of identical architecture.
+        Arguments:
+            - models: list
+                NumpyMlp networks, float16 and int8 ones are dequantized.
+            - names: list, default None
+                Name of each model, its index if None.
+            - dtype: numpy dtype, default np.float32
+                Dtype of the stacked weights and of the computation.
+        """
+        if not models:
+            raise ValueError('Empty ensemble')
+        shapes = [([W.shape for W in m.weights], m.activations)
+                  for m in models]
+        if any(s != shapes[0] for s in shapes):
+            raise ValueError('The models do not share one architecture')
+        self.names = list(names) if names is not None \
+            else [str(i) for i in range(len(models))]
+        self.dtype = np.dtype(dtype)
+        self.activations = list(models[0].activations)
+        self.weights, self.biases = [], []
+        for layer in range(len(self.activations)):
+            kernels = []
+            for m in models:
+                W = m.weights[layer].astype(self.dtype)
+                if m.scales[layer] is not None:
+                    W = W * m.scales[layer]
+                kernels.append(W)
+            self.weights.append(np.stack(kernels))
+            # (models, 1, n_out), broadcast over the observations
+            self.biases.append(np.stack(
+                [m.biases[layer] for m in models]).astype(self.dtype)
+                [:, np.newaxis])
+        self.io_sizes = models[0].io_sizes
+
+    @classmethod
+    def from_paths(cls, paths, backend='numpy'):
+        """ Load the models through the model cache, named after their
+        *.save directory.
+        """
+        models = [model_cache.get(p, LOADERS[backend], variant=backend)
+                  for p in paths]
+        names = [model_name(p) for p in paths]
+        return cls(models, names)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def nbytes(self):
+        return sum(W.nbytes + b.nbytes
+                   for W, b in zip(self.weights, self.biases))
+
+    def predict(self, x):
+        """ Forward pass of every model.
+        Arguments:
+            - x: np.ndarray
+                Observation vectors, shape (n, io_sizes[0]).
+        Returns:
+            - np.ndarray of shape (models, n, io_sizes[1]).
+        """
+        h = np.asarray(x, dtype=self.dtype)
+        if h.ndim == 1:
+            h = h[np.newaxis]
+        for W, b, a in zip(self.weights, self.biases, self.activations):
+            # (n, in) @ (models, in, out) and then (models, n, in) @ ...
+            h = np.matmul(h, W)
+            h += b
+            if a == 'relu':
+                np.maximum(h, 0, out=h)
+            elif a == 'softmax':
+                h -= h.max(axis=2, keepdims=True)
+                np.exp(h, out=h)
+                h /= h.sum(axis=2, keepdims=True)
+        return h
+
+    def act(self, observations, observation_vectors=None, legal=None,
+            batch_size=4096):
+        """ Legal action and action probabilities of every model.
+        Arguments:
+            - observations: list
+                Player observations, as given to Agent.act_batch; may be
+                None when @observation_vectors and @legal are given.
+            - observation_vectors: np.ndarray, default None
+                (n, 658) encodings, stacked from the observations if None.
+            - legal: np.ndarray, default None
+                (n, 20) legal move mask, built from the observations if None.
+            - batch_size: int, default 4096
+                Observations per forward pass, bounds the memory of the
+                (models, batch, hidden) activations.
+        Returns:
+            - dict with
+                probabilities: (models, n, 20) policy of each model,
+                legal_probabilities: the same restricted to the legal moves
+                    and renormalized,
+                action_indices: (models, n) move uid chosen by each model,
+                actions: per model, the chosen entries of 'legal_moves' if
+                    the observations were given.
+        """
+        positions = None
+        if legal is None:
+            legal, positions = legal_moves_mask(observations,
+                                                self.io_sizes[1])
+        if observation_vectors is None:
+            observation_vectors = np.array(
+                [obs['vectorized'] for obs in observations], dtype=self.dtype)
+        n = len(observation_vectors)
+        probabilities = np.empty((len(self), n, self.io_sizes[1]),
+                                 dtype=self.dtype)
+        for start in range(0, n, batch_size):
+            probabilities[:, start:start + batch_size] = self.predict(
+                observation_vectors[start:start + batch_size])
+
+        legal_probabilities = np.where(legal, probabilities, 0.)
+        totals = legal_probabilities.sum(axis=2, keepdims=True)
+        np.divide(legal_probabilities, totals, out=legal_probabilities,
+                  where=totals > 0)
+        action_indices = np.where(legal, probabilities,
+                                  -np.inf).argmax(axis=2)
+        result = {'probabilities': probabilities,
+                  'legal_probabilities': legal_probabilities,
+                  'action_indices': action_indices}
+        if observations is not None and positions is not None:
+            rows = np.arange(n)
+            result['actions'] = [
+                [obs['legal_moves'][i] for obs, i in
+                 zip(observations, positions[rows, model_indices])]
+                for model_indices in action_indices]
+        return result
+
+
+def agreement_matrix(action_indices):
+    """ Fraction of the observations on which each pair of models picks the
+    same action.
+    Arguments:
+        - action_indices: np.ndarray
+            (models, n) chosen actions, see Ensemble.act().
+    Returns:
+        - (models, models) np.ndarray.
+    """
+    same = action_indices[:, np.newaxis, :] == action_indices[np.newaxis]
+    return same.mean(axis=2)
+
+
+def main(argv=None):
+    from dataset import read_manifest, shard_path
+    from tournament import find_models
+
+    agents_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dataset', required=True,
+                        help='directory written by dataset.ShardWriter')
+    parser.add_argument('--model-dir',
+                        default=os.path.join(agents_dir, 'imitator_models'))
+    parser.add_argument('--backend', default='numpy',
+                        choices=['numpy', 'float16', 'int8'])
+    parser.add_argument('--batch-size', type=int, default=4096)
+    args = parser.parse_args(argv)
+
+    ensemble = Ensemble.from_paths(list(find_models(args.model_dir).values()),
+                                   backend=args.backend)
+    same = np.zeros((len(ensemble), len(ensemble)))
+    count = 0
+    for shard in read_manifest(args.dataset)['shards']:
+        obs = np.load(shard_path(args.dataset, shard['shard'], 'obs'),
+                      mmap_mode='r')
+        mask = np.load(shard_path(args.dataset, shard['shard'], 'mask'),
+                       mmap_mode='r')
+        for start in range(0, len(obs), args.batch_size):
+            result = ensemble.act(None, obs[start:start + args.batch_size],
+                                  mask[start:start + args.batch_size],
+                                  batch_size=args.batch_size)
+            indices = result['action_indices']
+            same += agreement_matrix(indices) * indices.shape[1]
+            count += indices.shape[1]
+    print(json.dumps({'observations': count,
+                      'models': ensemble.names,
+                      'agreement': (same / max(count, 1)).tolist()},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+""" Statistics of cross-play evaluations. """
+import math
+from statistics import NormalDist
+
+
+def mean_interval(scores, alpha=0.05):
+    """ Normal-approximation confidence interval of a mean score.
+    Arguments:
+        - scores: list
+            Per-game scores.
+        - alpha: float, default 0.05
+            The interval covers the mean with probability 1 - @alpha.
+    Returns:
+        - (mean, low, high), with an infinite interval below two games.
+    """
+    n = len(scores)
+    if n == 0:
+        return float('nan'), -math.inf, math.inf
+    mean = sum(scores) / n
+    if n < 2:
+        return mean, -math.inf, math.inf
+    var = sum((s - mean) ** 2 for s in scores) / (n - 1)
+    half = NormalDist().inv_cdf(1 - alpha / 2) * math.sqrt(var / n)
+    return mean, mean - half, mean + half
+
+
+def difference_interval(scores, reference_scores, alpha=0.05):
+    """ Welch confidence interval of mean(scores) - mean(reference_scores).
+    """
+    n, m = len(scores), len(reference_scores)
+    if n < 2 or m < 2:
+        return float('nan'), -math.inf, math.inf
+    mean_a, mean_b = sum(scores) / n, sum(reference_scores) / m
+    var_a = sum((s - mean_a) ** 2 for s in scores) / (n - 1)
+    var_b = sum((s - mean_b) ** 2 for s in reference_scores) / (m - 1)
+    half = NormalDist().inv_cdf(1 - alpha / 2) * math.sqrt(var_a / n +
+                                                           var_b / m)
+    diff = mean_a - mean_b
+    return diff, diff - half, diff + half
+
+
+def paired_difference_interval(scores, reference_scores, alpha=0.05):
+    """ Confidence interval of the mean paired difference between two
+    pairings that played the same deals.
+    Arguments:
+        - scores, reference_scores: dict
+            Game number -> score; only the games played by both pairings
+            are compared.
+        - alpha: float, default 0.05
+            The interval covers the difference with probability 1 - @alpha.
+    Returns:
+        - (diff, low, high).
+    """
+    games = sorted(scores.keys() & reference_scores.keys())
+    return mean_interval([scores[g] - reference_scores[g] for g in games],
+                         alpha)
+
+
+def summarize(scores, reference_scores=None, alpha=0.05, paired=False):
+    """ Games played, mean and interval bounds of a pairing.
+    Arguments:
+        - scores: list or dict
+            Scores of the pairing, or game number -> score.
+        - reference_scores: list or dict, default None
+            Scores of a reference pairing, adds the difference with it.
+        - alpha: float, default 0.05
+            Error rate of the intervals.
+        - paired: bool, default False
+            Compare the scores game by game, both must then be dicts.
+            Otherwise the difference interval is Welch's.
+    Returns:
+        - dict with games, mean, low, high, and diff, diff_low, diff_high
+          when @reference_scores is given.
+    """
+    values = list(scores.values()) if isinstance(scores, dict) else scores
+    mean, low, high = mean_interval(values, alpha)
+    summary = {'games': len(values), 'mean': mean, 'low': low, 'high': high}
+    if reference_scores is not None:
+        if paired:
+            diff, low, high = paired_difference_interval(
+                scores, reference_scores, alpha)
+        else:
+            if isinstance(reference_scores, dict):
+                reference_scores = list(reference_scores.values())
+            diff, low, high = difference_interval(values, reference_scores,
+                                                  alpha)
+        summary.update({'diff': diff, 'diff_low': low, 'diff_high': high})
+    return summary
+
+
+class StoppingRule(object):
+    def __init__(self, target_width, max_games, confidence=0.95,
+                 min_games=30, look_every=50, paired=False):
+        """ Sequential test deciding when a pairing has played enough games.
+        A pairing stops once the confidence interval of its mean score is
+        narrower than @target_width, or, when reference scores are given,
+        once the interval of its difference with the reference excludes 0,
+        i.e. its ranking against the reference is settled. decide() is
+        meant to be called once every @look_every games, and the confidence
+        of each look is Bonferroni-corrected for the number of looks
+        possible before @max_games, so that repeatedly peeking keeps the
+        overall error rate below 1 - @confidence.
+        Arguments:
+            - target_width: float
+                Width of the mean score interval at which to stop.
+            - max_games: int
+                Number of games after which a pairing stops in any case.
+            - confidence: float, default 0.95
+                Overall confidence level of the intervals.
+            - min_games: int, default 30
+                Number of games before the first look.
+            - look_every: int, default 50
+                Number of games between two calls to decide(), e.g. the
+                number of games of a tournament chunk.
+            - paired: bool, default False
+                Rank against the reference with paired differences, for
+                pairings that play the same deals. See summarize().
+        """
+        self.target_width = target_width
+        self.max_games = max_games
+        self.min_games = min_games
+        self.look_every = look_every
+        self.paired = paired
+        looks = max(1, math.ceil((max_games - min_games) / look_every) + 1)
+        self.alpha = (1 - confidence) / looks
+
+    def summary(self, scores, reference_scores=None):
+        """ summarize() at the corrected confidence level of the rule. """
+        return summarize(scores, reference_scores, self.alpha, self.paired)
+
+    def decide(self, scores, reference_scores=None):
+        """ Return why the pairing stops, or None to keep playing.
+        Arguments:
+            - scores: list or dict
+                Scores of the pairing so far, see summarize().
+            - reference_scores: list or dict, default None
+                Scores of the reference pairing so far, None for the
+                reference pairing itself.
+        Returns:
+            - None, 'width', 'settled' or 'max_games'.
+        """
+        n = len(scores)
+        if n >= self.max_games:
+            return 'max_games'
+        if n < self.min_games:
+            return None
+        summary = self.summary(scores, reference_scores)
+        if summary['high'] - summary['low'] <= self.target_width:
+            return 'width'
+        if reference_scores is not None and \
+                (summary['diff_low'] > 0 or summary['diff_high'] < 0):
+            return 'settled'
+        return None
@@ -0,0 +1,98 @@
+""" Export imitator checkpoints to the flat weight format.
+
+Every best.h5 is converted to best.hnw next to it (and best.<mode>.hnw for
+the quantized variants asked for), a flat, aligned and versioned file that
+Agent(backend='numpy') memory-maps instead of building the keras graph and
+parsing HDF5. Each export is validated before being kept: the memory-mapped
+network must give bit-identical outputs to the one it was written from, and
+the float32 export must agree with the keras model loaded from HDF5. The load
+times of both paths are reported.
+
+    python agents/export_weights.py [agents/imitator_models/*.save/best.h5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, AGENTS_DIR)
+from numpy_mlp import (QUANTIZATIONS, NumpyMlp, check_equivalence, flat_path,
+                       random_observations)
+from cross_play_wrappers.agent_wrapper import load_imitator
+
+
+def export(path, quantizations=(), num_samples=4096, atol=1e-4):
+    """ Export and validate one checkpoint.
+    Arguments:
+        - path: str
+            best.h5 file.
+        - quantizations: list, default ()
+            Quantized variants to export next to the float32 one.
+        - num_samples: int, default 4096
+            Number of random observations the exports are checked on.
+        - atol: float, default 1e-4
+            Tolerance on the probabilities against keras.
+    Returns:
+        - dict with the load times, the checks and whether every export was
+          valid; invalid exports are removed.
+    """
+    start = time.perf_counter()
+    mlp = load_imitator(path)
+    report = {'hdf5_load_seconds': time.perf_counter() - start}
+    engine = NumpyMlp.from_mlp(mlp)
+    observations = random_observations(num_samples,
+                                       size=engine.io_sizes[0])
+    report['valid'] = True
+    for mode in (None, ) + tuple(quantizations):
+        network = engine if mode is None else engine.quantize(mode)
+        out_path = flat_path(path, mode)
+        network.save_flat(out_path)
+        start = time.perf_counter()
+        flat = NumpyMlp.load_flat(out_path)
+        load_seconds = time.perf_counter() - start
+        check = {'path': out_path,
+                 'load_seconds': load_seconds,
+                 'nbytes': os.path.getsize(out_path),
+                 'identical': bool(np.array_equal(
+                     network.predict(observations),
+                     flat.predict(observations)))}
+        valid = check['identical']
+        if mode is None:
+            check['keras'] = check_equivalence(mlp.model, flat, observations,
+                                               atol=atol)
+            valid = valid and check['keras']['equivalent']
+        if not valid:
+            os.remove(out_path)
+            report['valid'] = False
+        report[mode or 'float32'] = check
+    return report
+
+
+def main(argv=None):
+    default_models = sorted(
+        os.path.join(AGENTS_DIR, 'imitator_models', d, 'best.h5')
+        for d in os.listdir(os.path.join(AGENTS_DIR, 'imitator_models'))
+        if d.endswith('.save'))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('models', nargs='*', default=default_models,
+                        help='paths to best.h5 files, every imitator by '
+                             'default')
+    parser.add_argument('--quantizations', nargs='*', default=[],
+                        choices=QUANTIZATIONS)
+    parser.add_argument('--num-samples', type=int, default=4096)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    args = parser.parse_args(argv)
+
+    reports = {path: export(path, args.quantizations, args.num_samples,
+                            args.atol)
+               for path in args.models}
+    print(json.dumps(reports, indent=2))
+    sys.exit(0 if all(r['valid'] for r in reports.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
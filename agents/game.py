@@ -1,59 +1,105 @@
 from hanabi_learning_environment import rl_env
 from cross_play_wrappers import agent_wrapper
+from cross_play_wrappers.encoding import (ObservationBuffer,
+                                          acting_observation, lean_reset,
+                                          lean_step)
+from game_record import GameRecordWriter
+from timings import instrument_env, timings
 
 
-def one_hot_vectorized_action(agent, num_moves, obs):
-    action, action_idx = agent.act(obs,num_moves)
-    one_hot_action_vector = [0]*num_moves
-    one_hot_action_vector[action_idx] = 1
+def game_config(players=2, seed=1):
+    """ Configuration of the cross-play games. """
+    return {'colors': 5,
+            'ranks': 5,
+            'players': players,
+            'hand_size': 5,
+            'max_information_tokens': 8,
+            'max_life_tokens': 3,
+            'seed': seed,
+            'observation_type': 1,  # FIXME: NEEDS CONFIRMATION
+            'random_start_player': False}
 
-    return one_hot_action_vector, action
+
+def game_seeds(num_games, seed=1):
+    """ Deck seed of each game, so that game i is the same deal whichever
+    runner plays it and however many games were played before it.
+    """
+    return [seed + game_num for game_num in range(num_games)]
+
+
+def duplicate_deals(num_games, seed=1, players=2):
+    """ Deck seed and start player of each game of a duplicate evaluation.
+    Every deck is played once from each start player, so that within a
+    pairing each seat gets every hand, and every pairing plays the same list.
+    Games 0 to @players - 1 share the deck @seed, and so on.
+    Returns:
+        - list of (seed, start_player).
+    """
+    return [(seed + game_num // players, game_num % players)
+            for game_num in range(num_games)]
 
 
 class game(object):
-    def __init__(self, num_games, path_model_0, path_model_1 ):
-        config = {'colors': 5,
-          'ranks': 5,
-          'players': 2,
-          'hand_size': 5,
-          'max_information_tokens': 8,
-          'max_life_tokens': 3,
-          'seed': 1,
-          'observation_type': 1,  # FIXME: NEEDS CONFIRMATION
-          'random_start_player': False}
+    def __init__(self, num_games, path_model_0, path_model_1, seed=1,
+                 record_path=None, lean=True):
         self.num_players = 2
         self.num_games = num_games
-        self.environment = rl_env.HanabiEnv(config)
+        self.record_path = record_path  # game records are appended here
+        # lean: only the acting player's observation is built and encoded
+        self.lean = lean
+        self.seeds = game_seeds(num_games, seed)
+        self.environment = None  # built by runGame(), one per game
         self.agent_object = []
         self.agent_object.append(agent_wrapper.Agent(path_model_0))
         self.agent_object.append(agent_wrapper.Agent(path_model_1))
 
+    def _play_full(self):
+        observations = self.environment.reset()
+        game_done = False
+
+        while not game_done:
+            # Every player's observation is built, only the acting one moves
+            agent_id = observations['current_player']
+            observation = observations['player_observations'][agent_id]
+            print(observation['fireworks'])
+            action, _ = self.agent_object[agent_id].act(
+                    observation, self.environment.num_moves())
+            with timings.phase('env_step'):
+                observations, _, game_done, _ = self.environment.step(action)
+            print(action)
+
+    def _play_lean(self):
+        buffer = ObservationBuffer(1, self.environment.observation_encoder)
+        lean_reset(self.environment)
+        game_done = False
+
+        while not game_done:
+            with timings.phase('observation'):
+                observation = acting_observation(self.environment, buffer)
+            print(observation['fireworks'])
+            action, _ = self.agent_object[observation['current_player']].act(
+                    observation, self.environment.num_moves())
+            with timings.phase('env_step'):
+                game_done = lean_step(self.environment, action)
+            print(action)
+
     def runGame(self):
-        raw_data = []
         scores = []
+        records = None
+        if self.record_path is not None:
+            records = GameRecordWriter(self.record_path)
         for game_num in range(self.num_games):
-            raw_data.append([[],[]])
-            observations = self.environment.reset()
-            game_done = False
-
-            while not game_done:
-                for agent_id in range(self.num_players):
-                    observation = observations['player_observations'][agent_id]
-                    print(observation['fireworks'])
-                    one_hot_action_vector, action = one_hot_vectorized_action(
-                            self.agent_object[agent_id],
-                            self.environment.num_moves(),
-                            observation)
-                    if observation['current_player'] == agent_id:
-                        assert action is not None
-                        current_player_action = action
-                    else:
-                        assert action is None
-
-                    observations, _, game_done, _ = self.environment.step(
-                            current_player_action)
-                    print(current_player_action)
-                    if game_done:
-                        scores.append(self.environment.state.score())
-                        break
+            self.environment = instrument_env(rl_env.HanabiEnv(
+                    game_config(self.num_players, self.seeds[game_num])))
+            if self.lean:
+                self._play_lean()
+            else:
+                self._play_full()
+            scores.append(self.environment.state.score())
+            if records is not None:
+                records.write_state(self.environment.state,
+                                    self.environment.game,
+                                    self.seeds[game_num])
+        if records is not None:
+            records.close()
         return scores
@@ -0,0 +1,251 @@
+""" Compact binary game records.
+
+A record holds the game configuration and seed, the order in which the deck
+was dealt and the uids of the moves played, which is enough to rebuild any
+intermediate state. A 5-player game takes about 150 bytes.
+
+Layout (little endian), each record prefixed by its uint16 length:
+    header    magic 'HG', version, players, colors, ranks, hand size,
+              max information tokens, max life tokens, int32 seed,
+              flags (bit 0: random start player), start player, score
+    deals     uint8 count, then one byte per card: color * ranks + rank
+    moves     uint16 count, then one byte per move uid
+"""
+import struct
+import threading
+
+from hanabi_learning_environment import pyhanabi
+
+MAGIC = b'HG'
+VERSION = 1
+HEADER = struct.Struct('<2sBBBBBBBiBBB')
+LENGTH = struct.Struct('<H')
+MOVE_COUNT = struct.Struct('<H')
+RANDOM_START_PLAYER = 1
+
+
+class GameRecord(object):
+    def __init__(self, config, deals, moves, start_player=0, score=0):
+        """ Seed-plus-moves record of one game.
+        Arguments:
+            - config: dict
+                Game parameters: players, colors, ranks, hand_size,
+                max_information_tokens, max_life_tokens, seed and
+                random_start_player.
+            - deals: bytes
+                Cards in the order they were dealt, color * ranks + rank.
+            - moves: bytes
+                Uids of the moves of the players, in order.
+            - start_player: int, default 0
+                Player who moved first.
+            - score: int, default 0
+                Score of the game at the end of the record.
+        """
+        self.config = config
+        self.deals = bytes(deals)
+        self.moves = bytes(moves)
+        self.start_player = start_player
+        self.score = score
+
+    @classmethod
+    def from_state(cls, state, game, seed, random_start_player=False):
+        """ Record the game played so far in a pyhanabi state.
+        Arguments:
+            - state: pyhanabi.HanabiState
+                State of the game, finished or not.
+            - game: pyhanabi.HanabiGame
+                Game the state was created from.
+            - seed: int
+                Seed of @game, -1 if it was not seeded.
+            - random_start_player: bool, default False
+                Whether @game draws its start player.
+        """
+        config = {'players': game.num_players(),
+                  'colors': game.num_colors(),
+                  'ranks': game.num_ranks(),
+                  'hand_size': game.hand_size(),
+                  'max_information_tokens': game.max_information_tokens(),
+                  'max_life_tokens': game.max_life_tokens(),
+                  'seed': seed,
+                  'random_start_player': random_start_player}
+        deals, moves = [], []
+        start_player = None
+        for item in state.move_history():
+            move = item.move()
+            if move.type() == pyhanabi.HanabiMoveType.DEAL:
+                deals.append(move.color() * config['ranks'] + move.rank())
+            else:
+                if start_player is None:
+                    start_player = item.player()
+                moves.append(game.get_move_uid(move))
+        if start_player is None:
+            start_player = max(state.cur_player(), 0)
+        return cls(config, deals, moves, start_player, state.score())
+
+    def to_bytes(self):
+        c = self.config
+        flags = RANDOM_START_PLAYER if c['random_start_player'] else 0
+        return b''.join([
+            HEADER.pack(MAGIC, VERSION, c['players'], c['colors'], c['ranks'],
+                        c['hand_size'], c['max_information_tokens'],
+                        c['max_life_tokens'], c['seed'], flags,
+                        self.start_player, self.score),
+            bytes([len(self.deals)]), self.deals,
+            MOVE_COUNT.pack(len(self.moves)), self.moves])
+
+    @classmethod
+    def from_bytes(cls, data):
+        (magic, version, players, colors, ranks, hand_size, max_info,
+         max_life, seed, flags, start_player, score) = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version %d game record' % VERSION)
+        offset = HEADER.size
+        num_deals = data[offset]
+        deals = data[offset + 1:offset + 1 + num_deals]
+        offset += 1 + num_deals
+        num_moves, = MOVE_COUNT.unpack_from(data, offset)
+        offset += MOVE_COUNT.size
+        moves = data[offset:offset + num_moves]
+        config = {'players': players, 'colors': colors, 'ranks': ranks,
+                  'hand_size': hand_size,
+                  'max_information_tokens': max_info,
+                  'max_life_tokens': max_life, 'seed': seed,
+                  'random_start_player':
+                      bool(flags & RANDOM_START_PLAYER)}
+        return cls(config, deals, moves, start_player, score)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def states(self, num_moves=None):
+        """ Replay the game, yielding the state after the initial deal and
+        after each of the first @num_moves moves.
+        With a recorded seed the deck is dealt again by the seeded game and
+        checked against the recorded deal order; without one the recorded
+        cards are dealt explicitly. A game stopped right after a play or
+        discard ends on the state waiting for its next deal. The same state
+        object is advanced and yielded every time, copy() it to keep it.
+        Arguments:
+            - num_moves: int, default None
+                Number of player moves to apply, all of them if None.
+        """
+        game = pyhanabi.HanabiGame(dict(self.config))
+        state = game.new_initial_state()
+        deals = iter(self.deals)
+        moves = self.moves if num_moves is None else self.moves[:num_moves]
+        ranks = self.config['ranks']
+        seeded = self.config['seed'] >= 0
+
+        def deal():
+            # False if the record stops before the cards still to deal
+            while state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+                card = next(deals, None)
+                if card is None:
+                    return False
+                if seeded:
+                    state.deal_random_card()
+                    dealt = state.move_history()[-1].move()
+                    if dealt.color() * ranks + dealt.rank() != card:
+                        raise ValueError('Deal does not match the record')
+                else:
+                    self._deal_specific(state, card // ranks, card % ranks)
+            return True
+
+        dealt = deal()
+        if dealt and not seeded and state.cur_player() != self.start_player:
+            raise ValueError('Cannot replay the random start player of an '
+                             'unseeded game')
+        yield state
+        for uid in moves:
+            if not dealt:
+                raise ValueError('The record has moves after its last deal')
+            state.apply_move(game.get_move(uid))
+            dealt = deal()
+            yield state
+
+    def replay(self, num_moves=None):
+        """ Rebuild the state after the first @num_moves moves.
+        Arguments:
+            - num_moves: int, default None
+                Number of player moves to apply, all of them if None.
+        Returns:
+            - pyhanabi.HanabiState
+        """
+        for state in self.states(num_moves):
+            pass
+        return state
+
+    def _deal_specific(self, state, color, rank):
+        # The card goes to the end of the first hand that is not full
+        hands = state.player_hands()
+        hand_size = self.config['hand_size']
+        player = next(p for p, hand in enumerate(hands)
+                      if len(hand) < hand_size)
+        state.apply_move(pyhanabi.HanabiMove.get_deal_specific_move(
+            len(hands[player]), player, color, rank))
+
+
+class GameRecordWriter(object):
+    def __init__(self, path, mode='ab'):
+        """ Append length-prefixed game records to a file.
+        Thread-safe, so that GUI sessions can share one writer.
+        """
+        self.file = open(path, mode)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        data = record.to_bytes()
+        with self.lock:
+            self.file.write(LENGTH.pack(len(data)))
+            self.file.write(data)
+            self.count += 1
+
+    def write_state(self, state, game, seed, random_start_player=False):
+        self.write(GameRecord.from_state(state, game, seed,
+                                         random_start_player))
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_records(path, buffer_size=1 << 20, decode=True):
+    """ Stream the records of a file written by GameRecordWriter.
+    Arguments:
+        - path: str
+            Record file.
+        - buffer_size: int, default 1 MiB
+            Size of the reads.
+        - decode: bool, default True
+            Yield GameRecord objects, or the raw bytes of each record if
+            False.
+    """
+    with open(path, 'rb', buffering=0) as f:
+        buffer = b''
+        offset = 0
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                break
+            buffer = buffer[offset:] + chunk
+            offset = 0
+            while offset + LENGTH.size <= len(buffer):
+                length, = LENGTH.unpack_from(buffer, offset)
+                end = offset + LENGTH.size + length
+                if end > len(buffer):
+                    break
+                data = buffer[offset + LENGTH.size:end]
+                yield GameRecord.from_bytes(data) if decode else data
+                offset = end
@@ -1,22 +1,57 @@
 import os
-import sys
+import argparse
 
+import tournament
+from evaluation import StoppingRule
 
-import game
-import glob
+default_model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'imitator_models')
 
-num_games = 1
-model_paths = '/home/olof/Desktop/hanabi-hcai/agents/imitator_models/rainbow.save/best.h5'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=tournament.__doc__)
+    parser.add_argument('--model-dir', default=default_model_dir,
+                        help='directory containing the *.save/best.h5 models')
+    parser.add_argument('--games-per-pair', type=int, default=1)
+    parser.add_argument('--results', default='tournament_results',
+                        help='directory of games.jsonl, matrix.csv and pairs.csv')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes, all cores by default')
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--num-envs', type=int, default=64)
+    parser.add_argument('--backend', default='keras',
+                        choices=['keras', 'numpy', 'float16', 'int8'])
+    parser.add_argument('--target-width', type=float, default=None,
+                        help='adaptive mode: stop a pairing once its mean '
+                             'score interval is this narrow, '
+                             '--games-per-pair being the maximum')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--min-games', type=int, default=30,
+                        help='games of a pairing before the first look')
+    parser.add_argument('--reference', default=None,
+                        help='agent0,agent1 baseline pairing: pairs.csv '
+                             'reports paired score differences against it, '
+                             'and in adaptive mode the other pairings also '
+                             'stop once their ranking against it is settled')
+    parser.add_argument('--duplicate', action='store_true',
+                        help='play every deck once from each start player')
+    parser.add_argument('--memo', action='store_true',
+                        help='memoize predictions of repeated positions')
+    args = parser.parse_args()
 
-print('in main')
+    reference = None
+    if args.reference is not None:
+        reference = tuple(args.reference.split(','))
+    rule = None
+    if args.target_width is not None:
+        rule = StoppingRule(args.target_width, args.games_per_pair,
+                            confidence=args.confidence,
+                            min_games=args.min_games,
+                            look_every=args.chunk_size, paired=True)
 
-agents = glob.glob(model_paths)
-print(agents)
-
-for agent0 in agents:
-    print('in first for')
-    print(agent0)
-    for agent1 in agents:
-        print('in second for')
-        print(agent1)
-        game.game(num_games, agent0, agent1).runGame()
\ No newline at end of file
+    tournament.run_tournament(args.model_dir, args.games_per_pair,
+                              args.results, workers=args.workers,
+                              chunk_size=args.chunk_size, seed=args.seed,
+                              num_envs=args.num_envs, backend=args.backend,
+                              rule=rule, reference=reference,
+                              duplicate=args.duplicate, memo=args.memo)
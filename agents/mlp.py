@@ -1,8 +1,11 @@
 import os
+import time
 import numpy as np
 import pickle
 import logging
 import tensorflow.keras.backend as K
+from tensorflow.keras import mixed_precision
+from tensorflow.keras.callbacks import Callback
 from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.layers import Dense, Embedding, Input, Flatten, Dropout
 from tensorflow.keras.layers import BatchNormalization, LeakyReLU, ELU, Softmax
@@ -15,10 +18,46 @@ from tensorflow.keras.regularizers import l2
 logging.getLogger("tensorflow").setLevel(logging.ERROR)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+
+class SamplesPerSec(Callback):
+    def __init__(self, batch_size, num_samples):
+        """ Add the training throughput of each epoch to the epoch logs,
+        so that it shows up as a samples_per_sec column next to the other
+        metrics, e.g. in the training.log written by CSVLogger.
+        The clock stops at the end of the last training batch, so that the
+        validation pass is not counted. Keras does not log the size of a
+        batch, so the samples are counted from the batch size of the
+        training pipeline, all batches but the last of an epoch being full.
+        Arguments:
+            - batch_size: int
+                Size of the batches emitted by the training pipeline.
+            - num_samples: int
+                Number of training records of an epoch.
+        """
+        super().__init__()
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.monotonic()
+        self.end = None
+        self.steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.end = time.monotonic()
+        self.steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None and self.end is not None:
+            samples = min(self.steps * self.batch_size, self.num_samples)
+            logs['samples_per_sec'] = samples / (self.end - self.start)
+
+
 class Mlp(object):
     def __init__(self, io_sizes, out_activation, loss,
                  metrics, lr, batch_size, hl_activations, hl_sizes, decay,
-                 bNorm=False, dropout=False, regularizer=None, verbose=1):
+                 bNorm=False, dropout=False, regularizer=None, verbose=1,
+                 precision=None):
         """ Initialize parameters required for training & testing the network.
             Structure:
                           [Input Layer]
@@ -63,6 +102,10 @@ class Mlp(object):
                 Regularizer to use.
             - verbose: int, default 1
                 Value for `verbose` in keras fit() function.
+            - precision: str, default None
+                Keras mixed precision policy of the model, e.g.
+                'mixed_bfloat16' for bfloat16 computations on CPU. The
+                output activation always runs in float32.
         Returns:
             - None
         """
@@ -82,6 +125,7 @@ class Mlp(object):
         self.loss = loss
         self.metrics = metrics
         self.verbose = verbose
+        self.precision = precision
         self.model = None # Model will be stored here after construct_model()
         self.hist = None  # History will be stored here after train_model()
 
@@ -101,6 +145,25 @@ class Mlp(object):
             self.model = load_model(path_saved_model)
             return
 
+        if self.precision:
+            previous_policy = mixed_precision.global_policy()
+            mixed_precision.set_global_policy(self.precision)
+            try:
+                self._build_graph()
+            finally:
+                # Even if the build fails, the policy is process-wide
+                mixed_precision.set_global_policy(previous_policy)
+        else:
+            self._build_graph()
+        # Load saved weights
+        if path_saved_model:
+            self.model.load_weights(path_saved_model)
+
+        self.model.compile(optimizer=Adam(lr=self.lr, decay=self.decay),
+                           loss=self.loss, metrics=self.metrics)
+
+    def _build_graph(self):
+        """ Build self.model under the current mixed precision policy. """
         input = Input(shape=(self.io_sizes[0], ), name='input')
 
         layer = input
@@ -123,15 +186,12 @@ class Mlp(object):
             layer = z
 
         out = Dense(self.io_sizes[-1], name='output')(layer)
-        out = self.out_activation()(out)
+        if self.precision:
+            out = self.out_activation(dtype='float32')(out)
+        else:
+            out = self.out_activation()(out)
 
         self.model =  Model(inputs=input, outputs=out)
-        # Load saved weights
-        if path_saved_model:
-            self.model.load_weights(path_saved_model)
-
-        self.model.compile(optimizer=Adam(lr=self.lr, decay=self.decay),
-                           loss=self.loss, metrics=self.metrics)
 
     def train_model(self, gen_tr, gen_va, n_epoch=100, callbacks=None,
                     verbose=False, workers=1, use_mp=False, max_q_size=4,
@@ -175,3 +235,51 @@ class Mlp(object):
                                              callbacks=callbacks,
                                              max_queue_size=max_q_size,
                                              initial_epoch=initial_epoch)
+
+    def train_model_dataset(self, ds_tr, ds_va, batch_size, num_samples,
+                            n_epoch=100, callbacks=None, verbose=False,
+                            initial_epoch=0):
+        """
+        Train self.model with fit() on tf.data pipelines, see
+        shard_sequence.shard_dataset(). Mixed precision is chosen with the
+        `precision` attribute before construct_model().
+        Arguments:
+            - ds_tr: tf.data.Dataset
+                Batched training dataset of (observations, one-hot actions).
+            - ds_va: tf.data.Dataset
+                Batched validation dataset.
+            - batch_size: int
+                Batch size of @ds_tr, which sets the batches of the
+                pipeline instead of self.batch_size.
+            - num_samples: int
+                Number of training records per epoch, see
+                shard_sequence.train_validation_datasets().
+            - n_epoch: int, default 100
+                Number of epochs to train.
+            - callbacks: list, default None
+                List of keras.callbacks.Callback objects to run. The
+                per-epoch samples/sec is added to the epoch logs before
+                they run.
+            - verbose: boolean, default False
+                If true, model info will be displayed.
+            - initial_epoch: int, default 0
+                Epoch at which to start training.
+        """
+        if verbose:
+            print("Learning Rate:\t", self.lr)
+            print("LR Decay:\t", self.decay)
+            print("Batch Size:\t", batch_size)
+            print("Precision:\t", self.precision or 'float32')
+            print("Loss function:\t", self.loss)
+            print("Callbacks:\t", callbacks)
+            self.model.summary()
+            print()
+
+        callbacks = [SamplesPerSec(batch_size, num_samples)] + \
+            list(callbacks or [])
+        self.hist = self.model.fit(ds_tr,
+                                   validation_data=ds_va,
+                                   epochs=n_epoch,
+                                   verbose=self.verbose,
+                                   callbacks=callbacks,
+                                   initial_epoch=initial_epoch)
@@ -0,0 +1,451 @@
+import os
+import struct
+import sys
+import threading
+import numpy as np
+
+ACTIVATIONS = ('relu', 'softmax', None)
+# Kernels stored in these dtypes are kept as is, see NumpyMlp.predict()
+STORAGE_DTYPES = (np.dtype(np.float16), np.dtype(np.int8))
+QUANTIZATIONS = ('float16', 'int8')
+
+# Flat weight format, see NumpyMlp.save_flat()
+FLAT_MAGIC = b'HNWF'
+FLAT_VERSION = 1
+FLAT_ALIGN = 64
+# magic, version, number of layers, file size
+FLAT_HEADER = struct.Struct('<4sHHQ')
+# activation, kernel dtype, has scale, n_in, n_out, kernel, bias and scale
+# offsets; indices into ACTIVATIONS and FLAT_DTYPES
+FLAT_LAYER = struct.Struct('<BB?xIIQQQ')
+FLAT_DTYPES = (np.dtype(np.float32), np.dtype(np.float16), np.dtype(np.int8))
+
+
+def _align(offset):
+    return -(-offset // FLAT_ALIGN) * FLAT_ALIGN
+
+
+# Per-thread scratch buffers quantized kernels are dequantized into, shared
+# by every NumpyMlp of the process
+_scratch = threading.local()
+
+
+def _scratch_kernel(shape, dtype):
+    """ View of the calling thread's scratch buffer of @dtype, reshaped to
+    @shape. The buffer grows to the largest kernel it is asked for.
+    """
+    buffers = getattr(_scratch, 'buffers', None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    size = shape[0] * shape[1]
+    buf = buffers.get(dtype)
+    if buf is None or buf.size < size:
+        buf = buffers[dtype] = np.empty(size, dtype=dtype)
+    return buf[:size].reshape(shape)
+
+
+def _fold_batchnorm(ops):
+    """ Fold the affine transforms of inference-time BatchNormalization into
+    the neighbouring Dense layers.
+    In Mlp the normalization sits after the hidden activation, so it is
+    folded forward into the input side of the next Dense:
+        W (s * h + t) + b = (s[:, None] * W) h + (t W + b)
+    A normalization directly following a Dense layer is folded backward
+    into that layer instead.
+    """
+    folded = []
+    pending = None  # (scale, shift) waiting for the next Dense
+    for op in ops:
+        kind = op[0]
+        if kind == 'affine':
+            _, scale, shift = op
+            if folded and folded[-1][0] == 'dense':
+                _, W, b = folded[-1]
+                folded[-1] = ('dense', W * scale, b * scale + shift)
+            elif pending is not None:
+                pending = (pending[0] * scale, pending[1] * scale + shift)
+            else:
+                pending = (scale, shift)
+        elif kind == 'dense':
+            _, W, b = op
+            if pending is not None:
+                scale, shift = pending
+                W, b = scale[:, np.newaxis] * W, shift @ W + b
+                pending = None
+            folded.append(('dense', W, b))
+        else:
+            folded.append(op)
+    if pending is not None:
+        raise ValueError('BatchNormalization after the output layer')
+    return folded
+
+
+class NumpyMlp(object):
+    def __init__(self, weights, biases, activations, scales=None,
+                 dtype=np.float32):
+        """ Inference-only forward pass of an Mlp in plain NumPy.
+        Dropout is the identity at inference time and BatchNormalization
+        is folded into the Dense layers, so the network reduces to a chain
+        of matmuls computed in preallocated, per-thread buffers.
+        Arguments:
+            - weights: list
+                Kernel of each Dense layer, shape (n_in, n_out).
+            - biases: list
+                Bias of each Dense layer, shape (n_out, ).
+            - activations: list
+                Activation applied after each Dense layer, one of
+                'relu', 'softmax' or None.
+            - scales: list, default None
+                Per-output-channel scale of each int8 kernel, None for the
+                floating point kernels. See quantize().
+            - dtype: numpy dtype, default np.float32
+                Dtype of the computation. float16 and int8 kernels are
+                kept as they are, which is all the network holds: predict()
+                upcasts them one layer at a time into a per-thread scratch
+                buffer shared by every network, since NumPy has no int8 or
+                fast float16 matmul.
+        """
+        assert len(weights) == len(biases) == len(activations)
+        assert all(a in ACTIVATIONS for a in activations)
+        self.dtype = np.dtype(dtype)
+        self.weights = [np.ascontiguousarray(W) if W.dtype in STORAGE_DTYPES
+                        else np.ascontiguousarray(W, dtype=self.dtype)
+                        for W in weights]
+        self.biases = [np.ascontiguousarray(b, dtype=self.dtype)
+                       for b in biases]
+        if scales is None:
+            scales = [None] * len(weights)
+        self.scales = [s if s is None else np.asarray(s, dtype=self.dtype)
+                       for s in scales]
+        self.activations = list(activations)
+        self.io_sizes = (self.weights[0].shape[0], self.weights[-1].shape[1])
+        self._local = threading.local()
+
+    @classmethod
+    def from_keras(cls, model, dtype=np.float32):
+        """ Export the weights of a keras model built by Mlp.construct_model.
+        """
+        ops = []
+        for layer in model.layers:
+            name = type(layer).__name__
+            params = layer.get_weights()
+            if name in ('InputLayer', 'Dropout'):
+                continue
+            elif name == 'Dense':
+                ops.append(('dense', params[0].astype(np.float64),
+                            params[1].astype(np.float64)))
+                activation = layer.get_config().get('activation', 'linear')
+                if activation != 'linear':
+                    ops.append(('activation', activation))
+            elif name == 'BatchNormalization':
+                config = layer.get_config()
+                params = list(params)
+                gamma = params.pop(0) if config.get('scale', True) else 1.
+                beta = params.pop(0) if config.get('center', True) else 0.
+                mean, var = params
+                scale = gamma / np.sqrt(var.astype(np.float64) +
+                                        layer.epsilon)
+                shift = beta - mean * scale
+                ops.append(('affine', scale, shift))
+            elif name == 'ReLU':
+                config = layer.get_config()
+                if config.get('max_value') is not None or \
+                        config.get('negative_slope', 0.) != 0. or \
+                        config.get('threshold', 0.) != 0.:
+                    raise ValueError('Only the plain ReLU is supported')
+                ops.append(('activation', 'relu'))
+            elif name == 'Softmax':
+                ops.append(('activation', 'softmax'))
+            else:
+                raise ValueError('Unsupported layer: %s' % name)
+
+        weights, biases, activations = [], [], []
+        for op in _fold_batchnorm(ops):
+            if op[0] == 'dense':
+                weights.append(op[1])
+                biases.append(op[2])
+                activations.append(None)
+            else:
+                if not activations or activations[-1] is not None:
+                    raise ValueError('Activation %s does not follow a Dense '
+                                     'layer' % op[1])
+                activations[-1] = op[1]
+        return cls(weights, biases, activations, dtype=dtype)
+
+    @classmethod
+    def from_mlp(cls, mlp, dtype=np.float32):
+        return cls.from_keras(mlp.model, dtype=dtype)
+
+    def quantize(self, mode):
+        """ Return a copy of the network with compressed kernels.
+        Arguments:
+            - mode: str
+                'float16' halves the stored kernels, 'int8' stores them as
+                int8 with a symmetric scale per output channel.
+        Returns:
+            - NumpyMlp, biases and computation stay in self.dtype.
+        """
+        if mode == 'float16':
+            weights = [W.astype(np.float16) for W in self.weights]
+            scales = None
+        elif mode == 'int8':
+            weights, scales = [], []
+            for W in self.weights:
+                W = W.astype(np.float32)
+                scale = np.abs(W).max(axis=0) / 127.
+                scale[scale == 0] = 1.
+                weights.append(np.clip(np.rint(W / scale), -127, 127)
+                               .astype(np.int8))
+                scales.append(scale)
+        else:
+            raise ValueError('Unknown quantization: %s' % mode)
+        return NumpyMlp(weights, self.biases, self.activations,
+                        scales=scales, dtype=self.dtype)
+
+    def save(self, path):
+        """ Save the folded weights in .npz format. """
+        arrays = {}
+        for i, (W, b, s) in enumerate(zip(self.weights, self.biases,
+                                          self.scales)):
+            arrays['W%d' % i] = W
+            arrays['b%d' % i] = b
+            if s is not None:
+                arrays['s%d' % i] = s
+        arrays['activations'] = np.array(
+            [a if a is not None else '' for a in self.activations])
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, dtype=np.float32):
+        """ Load weights saved by save(), no TensorFlow involved. """
+        with np.load(path) as data:
+            activations = [str(a) if a else None
+                           for a in data['activations']]
+            n = len(activations)
+            weights = [data['W%d' % i] for i in range(n)]
+            biases = [data['b%d' % i] for i in range(n)]
+            scales = [data['s%d' % i] if 's%d' % i in data else None
+                      for i in range(n)]
+        return cls(weights, biases, activations, scales=scales, dtype=dtype)
+
+    def save_flat(self, path):
+        """ Save the folded weights in the flat weight format, which
+        load_flat() memory-maps without parsing or copying.
+        The file starts with a header and one entry per layer (activation,
+        kernel dtype, shapes and offsets), followed by the raw arrays, each
+        aligned on FLAT_ALIGN bytes. See FLAT_HEADER and FLAT_LAYER.
+        """
+        entries, chunks = [], []
+        offset = _align(FLAT_HEADER.size + FLAT_LAYER.size * len(self.weights))
+
+        def place(a):
+            nonlocal offset
+            a = np.ascontiguousarray(a)
+            start = offset
+            chunks.append((start, a.tobytes()))
+            offset = _align(start + a.nbytes)
+            return start
+
+        for W, b, s, act in zip(self.weights, self.biases, self.scales,
+                                self.activations):
+            W_offset = place(W)
+            b_offset = place(b.astype(np.float32))
+            s_offset = 0 if s is None else place(s.astype(np.float32))
+            entries.append(FLAT_LAYER.pack(
+                ACTIVATIONS.index(act), FLAT_DTYPES.index(W.dtype),
+                s is not None, W.shape[0], W.shape[1],
+                W_offset, b_offset, s_offset))
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(FLAT_HEADER.pack(FLAT_MAGIC, FLAT_VERSION,
+                                       len(entries), offset))
+            out.write(b''.join(entries))
+            for start, data in chunks:
+                out.write(b'\0' * (start - out.tell()))
+                out.write(data)
+            out.write(b'\0' * (offset - out.tell()))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_flat(cls, path, dtype=np.float32):
+        """ Memory-map a file written by save_flat().
+        The weight arrays are read-only views of the mapping: loading costs
+        a header parse, the pages are read on first use and shared by every
+        process mapping the same file. A truncated or malformed file raises
+        ValueError.
+        """
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(data) < FLAT_HEADER.size:
+            raise ValueError('%s is truncated' % path)
+        magic, version, num_layers, size = FLAT_HEADER.unpack_from(data)
+        if magic != FLAT_MAGIC or version != FLAT_VERSION:
+            raise ValueError('%s is not a version %d flat weight file'
+                             % (path, FLAT_VERSION))
+        if size != len(data):
+            raise ValueError('%s is truncated' % path)
+        if num_layers == 0 or \
+                FLAT_HEADER.size + num_layers * FLAT_LAYER.size > size:
+            raise ValueError('%s has a malformed layer table' % path)
+
+        def view(shape, dt, offset):
+            end = offset + np.dtype(dt).itemsize * shape[0] * \
+                (shape[1] if len(shape) > 1 else 1)
+            if offset % FLAT_ALIGN or end > size:
+                raise ValueError('%s has an array outside of the file'
+                                 % path)
+            return np.ndarray(shape, dtype=dt, buffer=data, offset=offset)
+
+        weights, biases, scales, activations = [], [], [], []
+        for i in range(num_layers):
+            (act, W_dtype, has_scale, n_in, n_out, W_offset, b_offset,
+             s_offset) = FLAT_LAYER.unpack_from(
+                 data, FLAT_HEADER.size + i * FLAT_LAYER.size)
+            if act >= len(ACTIVATIONS) or W_dtype >= len(FLAT_DTYPES) or \
+                    (weights and weights[-1].shape[1] != n_in):
+                raise ValueError('%s has a malformed layer %d' % (path, i))
+            weights.append(view((n_in, n_out), FLAT_DTYPES[W_dtype],
+                                W_offset))
+            biases.append(view((n_out, ), np.float32, b_offset))
+            scales.append(view((n_out, ), np.float32, s_offset)
+                          if has_scale else None)
+            activations.append(ACTIVATIONS[act])
+        return cls(weights, biases, activations, scales=scales, dtype=dtype)
+
+    def freeze(self):
+        """ Make the weight arrays read-only, so that processes forked after
+        loading keep sharing their pages. Returns self.
+        """
+        for arrays in (self.weights, self.biases, self.scales):
+            for a in arrays:
+                if a is not None and a.flags.writeable:
+                    a.setflags(write=False)
+        return self
+
+    @property
+    def nbytes(self):
+        """ Resident size of the weights, see quantize(). The float32 copy
+        of a quantized kernel only lives in the scratch buffer of the
+        predicting thread, shared by every network.
+        """
+        return sum(W.nbytes + b.nbytes + (0 if s is None else s.nbytes)
+                   for W, b, s in zip(self.weights, self.biases, self.scales))
+
+    def _buffers(self, n):
+        local = self._local
+        if getattr(local, 'capacity', 0) < n:
+            local.capacity = max(n, 2 * getattr(local, 'capacity', 0))
+            local.buffers = [np.empty((local.capacity, W.shape[1]),
+                                      dtype=self.dtype)
+                             for W in self.weights]
+        return [buf[:n] for buf in local.buffers]
+
+    def predict(self, x):
+        """ Forward pass.
+        A quantized kernel is upcast into the scratch buffer of the calling
+        thread before its matmul, the int8 scales being applied to the
+        output channels afterwards.
+        Arguments:
+            - x: np.ndarray
+                Batch of observation vectors, shape (n, io_sizes[0]), or a
+                single vector.
+        Returns:
+            - np.ndarray of shape (n, io_sizes[1]).
+        """
+        x = np.asarray(x)
+        if x.ndim == 1:
+            x = x[np.newaxis]
+        if x.dtype != self.dtype:
+            x = x.astype(self.dtype)
+        h = x
+        for W, b, s, a, out in zip(self.weights, self.biases, self.scales,
+                                   self.activations, self._buffers(len(x))):
+            if W.dtype != self.dtype:
+                K = _scratch_kernel(W.shape, self.dtype)
+                np.copyto(K, W, casting='unsafe')
+                W = K
+            np.matmul(h, W, out=out)
+            if s is not None:
+                out *= s
+            out += b
+            if a == 'relu':
+                np.maximum(out, 0, out=out)
+            elif a == 'softmax':
+                out -= out.max(axis=1, keepdims=True)
+                np.exp(out, out=out)
+                out /= out.sum(axis=1, keepdims=True)
+            h = out
+        return h.copy()
+
+    __call__ = predict
+
+
+def random_observations(n, size=658, density=0.1, seed=0):
+    """ Sample binary vectors shaped like the canonical observation encoding.
+    """
+    rng = np.random.default_rng(seed)
+    return (rng.random((n, size)) < density).astype(np.float32)
+
+
+def check_equivalence(keras_model, engine, observations=None, atol=1e-4):
+    """ Compare the engine against the keras model it was exported from.
+    Arguments:
+        - keras_model: keras.Model
+            Reference model.
+        - engine: NumpyMlp
+            Exported engine.
+        - observations: np.ndarray, default None
+            Inputs to compare on, random binary vectors if None.
+        - atol: float, default 1e-4
+            Tolerance on the output probabilities.
+    Returns:
+        - dict with the maximum absolute difference, the argmax agreement
+          rate and whether both are within tolerance.
+    """
+    if observations is None:
+        observations = random_observations(512, size=engine.io_sizes[0])
+    expected = keras_model.predict_on_batch(observations)
+    actual = engine.predict(observations)
+    max_abs_diff = float(np.abs(expected - actual).max())
+    agreement = float(np.mean(expected.argmax(1) == actual.argmax(1)))
+    return {'max_abs_diff': max_abs_diff,
+            'argmax_agreement': agreement,
+            'equivalent': max_abs_diff <= atol and agreement == 1.}
+
+
+def numpy_path(path_to_model, quantization=None, extension='.npz'):
+    """ Path of the NumPy export that sits next to a best.h5 file, e.g.
+    best.npz, or best.int8.npz for a quantized variant.
+    """
+    stem = os.path.splitext(path_to_model)[0]
+    if quantization is not None:
+        stem += '.' + quantization
+    return stem + extension
+
+
+def flat_path(path_to_model, quantization=None):
+    """ Path of the flat weight file next to a best.h5 file, e.g. best.hnw.
+    """
+    return numpy_path(path_to_model, quantization, extension='.hnw')
+
+
+if __name__ == '__main__':
+    # Export every model given on the command line next to its .h5 file and
+    # check it against keras, e.g.
+    #   python agents/numpy_mlp.py agents/imitator_models/*.save/best.h5
+    sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+    from cross_play_wrappers.agent_wrapper import load_imitator
+
+    if len(sys.argv) < 2:
+        sys.exit('usage: numpy_mlp.py best.h5 [best.h5 ...]')
+    failed = False
+    for path in sys.argv[1:]:
+        mlp = load_imitator(path)
+        engine = NumpyMlp.from_mlp(mlp)
+        report = check_equivalence(mlp.model, engine)
+        print(path, report)
+        if report['equivalent']:
+            engine.save(numpy_path(path))
+        else:
+            failed = True
+    sys.exit(1 if failed else 0)
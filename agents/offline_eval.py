@@ -0,0 +1,247 @@
+""" Score saved models on a held-out imitation dataset.
+
+The records of a dataset written by dataset.ShardWriter are streamed from
+the memory-mapped shards in batches, so memory is bounded by the batch size
+whatever the size of the dataset. Every model is evaluated in the same pass:
+models sharing an architecture run as one Ensemble forward pass. For each
+model the report gives the top-1 and top-3 accuracy, the same restricted to
+the legal moves, the rate of illegal argmax moves, the confusion between
+move types (play, discard, reveal color, reveal rank) and the throughput.
+
+    python agents/offline_eval.py --dataset imitation_data \
+        --validation-fraction 0.1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, AGENTS_DIR)
+from cross_play_wrappers.agent_wrapper import LOADERS
+from cross_play_wrappers.model_cache import model_cache
+from dataset import read_manifest, shard_path
+from ensemble import Ensemble
+from runtime import model_name
+
+MOVE_TYPES = ('play', 'discard', 'reveal_color', 'reveal_rank')
+
+
+def move_types(players=2, hand_size=5, colors=5, ranks=5):
+    """ Index in MOVE_TYPES of every move uid.
+    The environment numbers the moves as the discards of each card of the
+    hand, then its plays, then the color and the rank reveals to each other
+    player.
+    Returns:
+        - np.ndarray of shape (num_moves, ).
+    """
+    counts = (('discard', hand_size), ('play', hand_size),
+              ('reveal_color', (players - 1) * colors),
+              ('reveal_rank', (players - 1) * ranks))
+    return np.concatenate([np.full(n, MOVE_TYPES.index(t))
+                           for t, n in counts])
+
+
+def stream_records(directory, batch_size=8192, start=0, stop=None):
+    """ Batches of the records [@start, @stop) of a dataset.
+    Batches do not span shards, so the last one of a shard may be smaller.
+    Yields:
+        - obs, mask, action arrays, memory-mapped slices of one shard.
+    """
+    offset = 0
+    for shard in read_manifest(directory)['shards']:
+        lo = max(start - offset, 0)
+        hi = shard['records'] if stop is None \
+            else min(stop - offset, shard['records'])
+        offset += shard['records']
+        if lo >= hi:
+            continue
+        fields = [np.load(shard_path(directory, shard['shard'], field),
+                          mmap_mode='r')
+                  for field in ('obs', 'mask', 'action')]
+        for i in range(lo, hi, batch_size):
+            yield tuple(f[i:min(i + batch_size, hi)] for f in fields)
+
+
+def ensembles_by_architecture(paths, backend='numpy'):
+    """ Load the models and stack the ones sharing an architecture, e.g.
+    the imitators on one side and each distilled student on the other.
+    Returns:
+        - list of Ensemble.
+    """
+    groups = {}
+    for path in paths:
+        model = model_cache.get(path, LOADERS[backend], variant=backend)
+        name = model_name(path)
+        key = (tuple(W.shape for W in model.weights),
+               tuple(model.activations))
+        groups.setdefault(key, ([], []))
+        groups[key][0].append(model)
+        groups[key][1].append(name)
+    return [Ensemble(models, names) for models, names in groups.values()]
+
+
+class Scores(object):
+    def __init__(self, num_models, types):
+        """ Running counts of the metrics of several models.
+        Arguments:
+            - num_models: int
+                Number of models scored together.
+            - types: np.ndarray
+                Move type of every move uid, see move_types().
+        """
+        self.types = types
+        self.records = 0
+        counts = ('top1', 'top3', 'legal_top1', 'legal_top3',
+                  'illegal_argmax')
+        self.counts = {c: np.zeros(num_models, dtype=np.int64)
+                       for c in counts}
+        # (models, true type, predicted type) with legal argmax predictions
+        self.confusion = np.zeros((num_models, len(MOVE_TYPES),
+                                   len(MOVE_TYPES)), dtype=np.int64)
+
+    def add(self, probabilities, mask, action):
+        """ Count a batch.
+        Arguments:
+            - probabilities: np.ndarray
+                (models, n, num_moves) outputs, see Ensemble.predict().
+            - mask: np.ndarray
+                (n, num_moves) legal moves.
+            - action: np.ndarray
+                (n, ) move uids played.
+        """
+        action = np.asarray(action, dtype=np.intp)
+        legal = np.where(mask, probabilities, -np.inf)
+        for name, p in (('', probabilities), ('legal_', legal)):
+            top3 = np.argpartition(-p, 3, axis=2)[:, :, :3]
+            hits = top3 == action[np.newaxis, :, np.newaxis]
+            self.counts[name + 'top3'] += hits.any(axis=2).sum(axis=1)
+            argmax = p.argmax(axis=2)
+            self.counts[name + 'top1'] += (argmax == action).sum(axis=1)
+            if not name:
+                self.counts['illegal_argmax'] += \
+                    (~mask[np.arange(len(action)), argmax]).sum(axis=1)
+        predicted = self.types[legal.argmax(axis=2)]
+        true = np.broadcast_to(self.types[action], predicted.shape)
+        models = np.broadcast_to(np.arange(len(predicted))[:, np.newaxis],
+                                 predicted.shape)
+        np.add.at(self.confusion, (models, true, predicted), 1)
+        self.records += len(action)
+
+    def report(self, m):
+        """ Metrics of model @m, as a dict. """
+        n = max(self.records, 1)
+        report = {c: float(v[m]) / n for c, v in self.counts.items()}
+        confusion = self.confusion[m]
+        report['type_accuracy'] = {
+            t: float(confusion[i, i] / confusion[i].sum())
+            if confusion[i].sum() else None
+            for i, t in enumerate(MOVE_TYPES)}
+        report['confusion'] = {
+            t: {u: int(confusion[i, j]) for j, u in enumerate(MOVE_TYPES)}
+            for i, t in enumerate(MOVE_TYPES)}
+        return report
+
+
+def evaluate(paths, directory, batch_size=8192, start=0, stop=None,
+             backend='numpy', players=2):
+    """ Score every model over the records [@start, @stop) in one pass.
+    Arguments:
+        - paths: list
+            best.h5 paths.
+        - directory: str
+            Dataset directory.
+        - batch_size: int, default 8192
+            Records per forward pass; memory grows with batch_size times
+            the number of models sharing an architecture.
+        - start, stop: int, default 0 and None
+            Range of the records scored, e.g. the held-out last records.
+        - backend: str, default 'numpy'
+            'numpy', 'float16' or 'int8'.
+        - players: int, default 2
+            Number of players of the games, which sets the move types.
+    Returns:
+        - report dict with the metrics of each model and the throughput.
+    """
+    ensembles = ensembles_by_architecture(paths, backend)
+    types = move_types(players)
+    scores = [Scores(len(e), types) for e in ensembles]
+    forward_seconds = 0.
+    begin = time.perf_counter()
+    for obs, mask, action in stream_records(directory, batch_size, start,
+                                            stop):
+        mask = np.asarray(mask)
+        for ensemble, score in zip(ensembles, scores):
+            t = time.perf_counter()
+            probabilities = ensemble.predict(obs)
+            forward_seconds += time.perf_counter() - t
+            score.add(probabilities, mask, action)
+    seconds = time.perf_counter() - begin
+
+    records = scores[0].records
+    models = {}
+    for ensemble, score in zip(ensembles, scores):
+        for m, name in enumerate(ensemble.names):
+            models[name] = score.report(m)
+    return {'dataset': directory,
+            'backend': backend,
+            'records': records,
+            'seconds': seconds,
+            'forward_seconds': forward_seconds,
+            'records_per_sec': records / seconds if seconds else None,
+            'predictions_per_sec': records * len(models) / seconds
+            if seconds else None,
+            'models': models}
+
+
+def main(argv=None):
+    from tournament import find_models
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--dataset', required=True,
+                        help='directory written by dataset.ShardWriter')
+    parser.add_argument('--models', nargs='+', default=None,
+                        help='best.h5 paths, every imitator by default')
+    parser.add_argument('--model-dir',
+                        default=os.path.join(AGENTS_DIR, 'imitator_models'))
+    parser.add_argument('--validation-fraction', type=float, default=None,
+                        help='score only the last fraction of the records, '
+                             'as held out by train_validation_sequences')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--stop', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=8192)
+    parser.add_argument('--backend', default='numpy',
+                        choices=['numpy', 'float16', 'int8'])
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--output', default=None,
+                        help='JSON file the report is written to')
+    args = parser.parse_args(argv)
+
+    paths = args.models or list(find_models(args.model_dir).values())
+    start, stop = args.start, args.stop
+    if args.validation_fraction is not None:
+        num_records = read_manifest(args.dataset)['num_records']
+        start = int(round(num_records * (1 - args.validation_fraction)))
+    report = evaluate(paths, args.dataset, args.batch_size, start, stop,
+                      args.backend, args.players)
+    if args.output:
+        with open(args.output + '.tmp', 'w') as out:
+            json.dump(report, out, indent=2)
+        os.replace(args.output + '.tmp', args.output)
+
+    print('%-30s %8s %8s %8s %8s %8s' % ('model', 'top1', 'top3',
+                                         'legal1', 'legal3', 'illegal'))
+    for name, m in sorted(report['models'].items()):
+        print('%-30s %8.4f %8.4f %8.4f %8.4f %8.4f' % (
+            name, m['top1'], m['top3'], m['legal_top1'], m['legal_top3'],
+            m['illegal_argmax']))
+    print('%d records in %.1fs, %.0f records/s, %.0f predictions/s' % (
+        report['records'], report['seconds'], report['records_per_sec'] or 0,
+        report['predictions_per_sec'] or 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+""" Convert imitator models to float16 and per-channel int8 weights.
+
+For every best.h5 given, the float16 and int8 variants are written next to
+it as best.float16.npz and best.int8.npz, where Agent(backend='float16') and
+Agent(backend='int8') pick them up. A report of the action agreement of each
+variant with the float32 model is printed, measured on the recorded decisions
+of a dataset written by dataset.ShardWriter; random vectors are only used when
+asked for with --random, and say little about real decisions.
+
+    python agents/quantize.py agents/imitator_models/*.save/best.h5 \
+        --dataset imitation_data
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+from dataset import read_records
+from numpy_mlp import QUANTIZATIONS, numpy_path, random_observations
+from cross_play_wrappers.agent_wrapper import load_numpy_imitator
+
+
+def agreement_report(reference, variant, observations, mask=None):
+    """ Compare a quantized variant with the float32 network.
+    Arguments:
+        - reference: NumpyMlp
+            float32 network.
+        - variant: NumpyMlp
+            Quantized network.
+        - observations: np.ndarray
+            Observation vectors to compare on.
+        - mask: np.ndarray, default None
+            Legal moves of the observations; the agreement is then the one
+            of the legal moves the agents would play.
+    Returns:
+        - dict with the argmax agreement rate, the maximum absolute difference
+          of the action probabilities and the size of both networks.
+    """
+    expected = reference.predict(observations)
+    actual = variant.predict(observations)
+    diff = float(np.abs(expected - actual).max())
+    if mask is not None:
+        expected = np.where(mask, expected, -np.inf)
+        actual = np.where(mask, actual, -np.inf)
+    return {'agreement': float(np.mean(expected.argmax(1) ==
+                                       actual.argmax(1))),
+            'max_abs_diff': diff,
+            'nbytes': variant.nbytes,
+            'reference_nbytes': reference.nbytes}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('models', nargs='+', help='paths to best.h5 files')
+    parser.add_argument('--modes', nargs='+', default=list(QUANTIZATIONS),
+                        choices=QUANTIZATIONS)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dataset', default=None,
+                        help='directory written by dataset.ShardWriter '
+                             'whose decisions are compared on')
+    source.add_argument('--random', action='store_true',
+                        help='compare on random binary vectors instead')
+    parser.add_argument('--num-samples', type=int, default=65536)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print the report')
+    args = parser.parse_args(argv)
+
+    mask = None
+    if args.dataset:
+        records = read_records(args.dataset, max_records=args.num_samples)
+        observations = records['obs'].astype(np.float32)
+        mask = records['mask']
+    else:
+        observations = random_observations(args.num_samples)
+
+    print('%-60s %-8s %10s %12s %10s' % ('model', 'mode', 'agreement',
+                                         'max |diff|', 'MB'))
+    for path in args.models:
+        reference = load_numpy_imitator(path)
+        for mode in args.modes:
+            variant = reference.quantize(mode)
+            report = agreement_report(reference, variant, observations,
+                                      mask)
+            print('%-60s %-8s %10.4f %12.2e %10.2f' % (
+                path, mode, report['agreement'], report['max_abs_diff'],
+                report['nbytes'] / 2**20))
+            if not args.dry_run:
+                variant.save(numpy_path(path, mode))
+
+
+if __name__ == '__main__':
+    main()
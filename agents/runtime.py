@@ -0,0 +1,48 @@
+""" Process-level helpers shared by the multiprocess runners.
+
+This module imports neither numpy nor TensorFlow, so that limit_threads()
+can run before either is loaded.
+"""
+import os
+
+# Read by the BLAS libraries when numpy is first imported
+BLAS_THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS')
+# Read by TensorFlow when it is first imported
+TF_THREAD_VARS = ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS')
+
+
+def limit_threads(threads=1, tensorflow=False, override=True):
+    """ Size the thread pools of the numerical libraries of this process, so
+    that each worker stays on its own core instead of every worker spreading
+    its threads over all of them. Only effective before the libraries are
+    imported.
+    Arguments:
+        - threads: int, default 1
+            Threads per pool.
+        - tensorflow: bool, default False
+            Also size the TensorFlow pools.
+        - override: bool, default True
+            Replace the values already set, else keep them.
+    """
+    names = BLAS_THREAD_VARS + (TF_THREAD_VARS if tensorflow else ())
+    for var in names:
+        if override or var not in os.environ:
+            os.environ[var] = str(threads)
+
+
+def available_cores():
+    """ Number of cores this process may run on. """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def model_name(path):
+    """ Name of the imitator saved at @path, i.e. its *.save directory
+    without the suffix.
+    """
+    name = os.path.basename(os.path.dirname(path))
+    if name.endswith('.save'):
+        name = name[:-len('.save')]
+    return name
@@ -0,0 +1,221 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.utils import Sequence
+
+from dataset import read_manifest, shard_path
+
+
+class ShardSequence(Sequence):
+    def __init__(self, directory, batch_size=128, shuffle=True, seed=0,
+                 start=0, stop=None, num_actions=20):
+        """ Memory-mapped batches of a dataset written by ShardWriter.
+        The shards are never loaded in RAM. Every batch holds records of a
+        single shard, gathered from its memory-mapped .npy files with one
+        fancy-index read. At the end of each epoch the records of every
+        shard are permuted and cut into batches, and the order of all the
+        batches is shuffled, so that consecutive batches come from random
+        shards. The files are opened lazily in each process, which lets
+        Mlp.train_model use several workers with use_mp=True.
+        Arguments:
+            - directory: str
+                Dataset directory, containing manifest.json.
+            - batch_size: int, default 128
+                Number of records per batch; the last batch of a shard may
+                be smaller.
+            - shuffle: bool, default True
+                Draw new batches at every epoch.
+            - seed: int, default 0
+                Seed of the permutations, epoch e uses seed + e.
+            - start, stop: int, default 0 and None
+                Range of the records used, e.g. to hold out the last ones
+                for validation. See train_validation_sequences().
+            - num_actions: int, default 20
+                Size of the one-hot action targets.
+        """
+        self.directory = directory
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_actions = num_actions
+        manifest = read_manifest(directory)
+        self.shards = [s['shard'] for s in manifest['shards']]
+        counts = [s['records'] for s in manifest['shards']]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        stop = offsets[-1] if stop is None else stop
+        # (position in self.shards, first and last local record + 1)
+        self.ranges = []
+        for i, (offset, count) in enumerate(zip(offsets, counts)):
+            lo, hi = max(start - offset, 0), min(stop - offset, count)
+            if lo < hi:
+                self.ranges.append((i, int(lo), int(hi)))
+        self.epoch = 0
+        self.batches = []
+        self._pid = None
+        self.on_epoch_end()
+
+    def _open(self):
+        if self._pid != os.getpid():
+            self._obs = [np.load(shard_path(self.directory, s, 'obs'),
+                                 mmap_mode='r') for s in self.shards]
+            self._action = [np.load(shard_path(self.directory, s, 'action'),
+                                    mmap_mode='r') for s in self.shards]
+            self._pid = os.getpid()
+
+    def __getstate__(self):
+        # Memory maps are reopened by each worker instead of being pickled
+        state = self.__dict__.copy()
+        for key in ('_obs', '_action'):
+            state.pop(key, None)
+        state['_pid'] = None
+        return state
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, idx):
+        self._open()
+        shard, local = self.batches[idx]
+        X = self._obs[shard][local].astype(np.float32)
+        actions = self._action[shard][local]
+        Y = np.zeros((len(local), self.num_actions), dtype=np.float32)
+        Y[np.arange(len(local)), actions] = 1.
+        return X, Y
+
+    def on_epoch_end(self):
+        batches = []
+        rng = np.random.default_rng(self.seed + self.epoch)
+        for shard, lo, hi in self.ranges:
+            records = np.arange(lo, hi)
+            if self.shuffle:
+                records = rng.permutation(records)
+            for i in range(0, len(records), self.batch_size):
+                # Sorted, the gather reads the memory map forward
+                batches.append((shard,
+                                np.sort(records[i:i + self.batch_size])))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self.batches = batches
+        self.epoch += 1
+
+
+def train_validation_sequences(directory, validation_fraction=0.1, **kwargs):
+    """ Split a dataset in a training and a validation ShardSequence.
+    The last @validation_fraction of the records, i.e. the last games
+    written, are held out; the validation sequence is not shuffled.
+    Arguments:
+        - directory: str
+            Dataset directory.
+        - validation_fraction: float, default 0.1
+            Fraction of the records used for validation.
+        - kwargs:
+            Forwarded to both ShardSequence().
+    Returns:
+        - gen_tr, gen_va, to be passed to Mlp.train_model.
+    """
+    num_records = read_manifest(directory)['num_records']
+    split = int(round(num_records * (1 - validation_fraction)))
+    gen_tr = ShardSequence(directory, stop=split, **kwargs)
+    kwargs['shuffle'] = False
+    gen_va = ShardSequence(directory, start=split, **kwargs)
+    return gen_tr, gen_va
+
+
+def shard_dataset(directory, batch_size=128, shuffle=True, seed=0,
+                  shuffle_buffer=65536, cache=None, shards=None,
+                  num_actions=20):
+    """ tf.data pipeline over a dataset written by ShardWriter, to be used
+    with Mlp.train_model_dataset.
+    Shards are read in parallel and interleaved, records are shuffled in a
+    buffer with a fixed seed, and the uint8 observations are cast and the
+    actions one-hot encoded per batch by parallel map calls. Every stage is
+    deterministic, so a given seed always yields the same batches.
+    Arguments:
+        - directory: str
+            Dataset directory, containing manifest.json.
+        - batch_size: int, default 128
+            Number of records per batch.
+        - shuffle: bool, default True
+            Shuffle the records, with a new order at every epoch.
+        - seed: int, default 0
+            Seed of the shuffling.
+        - shuffle_buffer: int, default 65536
+            Number of records in the shuffle buffer.
+        - cache: str, default None
+            Cache the parsed records after the first epoch, in memory if ''
+            or in files with this prefix otherwise.
+        - shards: list, default None
+            Shard numbers to read, all shards if None. See
+            train_validation_datasets().
+        - num_actions: int, default 20
+            Size of the one-hot action targets.
+    Returns:
+        - tf.data.Dataset of (observations, one-hot actions) batches.
+    """
+    manifest = read_manifest(directory)
+    if shards is None:
+        shards = [s['shard'] for s in manifest['shards']]
+    obs_size = manifest['fields']['obs'][1][0]
+
+    def load_shard(shard):
+        shard = int(shard)
+        return (np.load(shard_path(directory, shard, 'obs')),
+                np.load(shard_path(directory, shard, 'action'))
+                .astype(np.int32))
+
+    def read_shard(shard):
+        obs, action = tf.numpy_function(load_shard, [shard],
+                                        (tf.uint8, tf.int32))
+        obs.set_shape((None, obs_size))
+        action.set_shape((None, ))
+        return tf.data.Dataset.from_tensor_slices((obs, action))
+
+    def parse(obs, action):
+        return (tf.cast(obs, tf.float32),
+                tf.one_hot(action, num_actions, dtype=tf.float32))
+
+    ds = tf.data.Dataset.from_tensor_slices(np.array(shards, dtype=np.int64))
+    ds = ds.interleave(read_shard, cycle_length=4,
+                       num_parallel_calls=tf.data.AUTOTUNE,
+                       deterministic=True)
+    if cache is not None:
+        ds = ds.cache(cache)
+    if shuffle:
+        ds = ds.shuffle(shuffle_buffer, seed=seed,
+                        reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(parse, num_parallel_calls=tf.data.AUTOTUNE,
+                deterministic=True)
+    return ds.prefetch(tf.data.AUTOTUNE)
+
+
+def train_validation_datasets(directory, validation_shards=1, **kwargs):
+    """ Split a dataset in training and validation tf.data pipelines.
+    The last @validation_shards shards are held out and not shuffled.
+    Arguments:
+        - directory: str
+            Dataset directory.
+        - validation_shards: int, default 1
+            Number of shards used for validation.
+        - kwargs:
+            Forwarded to both shard_dataset().
+    Returns:
+        - ds_tr, ds_va and the number of training records, to be passed to
+          Mlp.train_model_dataset with the batch size.
+    """
+    manifest = read_manifest(directory)
+    shards = [s['shard'] for s in manifest['shards']]
+    if not 0 < validation_shards < len(shards):
+        raise ValueError('Cannot hold out %d of the %d shards of %s, use '
+                         'train_validation_sequences() for a record-level '
+                         'split' % (validation_shards, len(shards),
+                                    directory))
+    ds_tr = shard_dataset(directory, shards=shards[:-validation_shards],
+                          **kwargs)
+    kwargs['shuffle'] = False
+    ds_va = shard_dataset(directory, shards=shards[-validation_shards:],
+                          **kwargs)
+    num_train = sum(s['records']
+                    for s in manifest['shards'][:-validation_shards])
+    return ds_tr, ds_va, num_train
@@ -0,0 +1,196 @@
+""" Opt-in per-phase timing of the game loops.
+
+Phases of a step (observation building, encoding, model forward, legal move
+selection, env.step / apply_move, state copying, page update) are timed with
+time.perf_counter and aggregated into histograms keyed by phase and labels,
+e.g. the agent or the GUI session. Timing is off by default and costs one
+attribute lookup per phase; it is turned on by timings.enable() or by the
+HANABI_TIMINGS environment variable, whose value is a file the histograms
+are written to at exit, as Prometheus text if it ends in .prom and as JSON
+otherwise.
+
+    with timings.phase('forward', agent='iggi'):
+        action_raw = model.predict(observation)
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds, in seconds, of the histogram buckets: 1us to ~16s
+BUCKETS = tuple(1e-6 * 2 ** i for i in range(25))
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the @q quantile. """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    __slots__ = ('timings', 'key', 'start')
+
+    def __init__(self, timings, key):
+        self.timings = timings
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class Timings(object):
+    def __init__(self, enabled=False):
+        """ Registry of the phase histograms of a process.
+        Arguments:
+            - enabled: bool, default False
+                Record the phases; phase() is a no-op otherwise.
+        """
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def phase(self, name, **labels):
+        """ Context manager timing one occurrence of phase @name.
+        Arguments:
+            - name: str
+                Phase, e.g. 'encode', 'forward', 'env_step'.
+            - labels: str
+                Series the time is aggregated in, e.g. agent='iggi' or
+                session=<session id>.
+        """
+        if not self.enabled:
+            return NULL_PHASE
+        return _Phase(self, (name, tuple(sorted(labels.items()))))
+
+    def add(self, key, seconds):
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def to_json(self):
+        """ List of the series, with their counts, totals, approximate
+        quantiles and cumulative bucket counts.
+        """
+        series = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for (name, labels), h in items:
+                cumulative, buckets = 0, {}
+                for bound, count in zip(BUCKETS + (float('inf'), ),
+                                        h.counts):
+                    cumulative += count
+                    buckets['%g' % bound] = cumulative
+                series.append({'phase': name,
+                               'labels': dict(labels),
+                               'count': h.count,
+                               'sum': h.sum,
+                               'mean': h.sum / h.count,
+                               'min': h.min,
+                               'max': h.max,
+                               'p50': h.quantile(0.5),
+                               'p90': h.quantile(0.9),
+                               'p99': h.quantile(0.99),
+                               'buckets': buckets})
+        return series
+
+    def to_prometheus(self, metric='hanabi_phase_seconds'):
+        """ Prometheus text exposition of the histograms. """
+        lines = ['# HELP %s Time spent in each phase of the game loop.'
+                 % metric,
+                 '# TYPE %s histogram' % metric]
+        for s in self.to_json():
+            labels = dict(s['labels'], phase=s['phase'])
+            text = ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                            for k, v in sorted(labels.items()))
+            for bound, count in s['buckets'].items():
+                le = '+Inf' if bound == 'inf' else bound
+                lines.append('%s_bucket{%s,le="%s"} %d'
+                             % (metric, text, le, count))
+            lines.append('%s_sum{%s} %.9f' % (metric, text, s['sum']))
+            lines.append('%s_count{%s} %d' % (metric, text, s['count']))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """ Write the histograms to @path, as Prometheus text if it ends in
+        .prom and as JSON otherwise.
+        """
+        if path.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_json(), indent=1)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as out:
+            out.write(text)
+        os.replace(tmp_path, path)
+
+
+def instrument_env(env, **labels):
+    """ Time the observation building of an rl_env.HanabiEnv, which happens
+    inside env.step() and env.reset(), as the 'observation' phase.
+    """
+    make_observations = env._make_observation_all_players
+
+    def timed_make_observations():
+        with timings.phase('observation', **labels):
+            return make_observations()
+
+    if timings.enabled:
+        env._make_observation_all_players = timed_make_observations
+    return env
+
+
+timings = Timings()
+if os.environ.get('HANABI_TIMINGS'):
+    timings.enable()
+    atexit.register(timings.dump, os.environ['HANABI_TIMINGS'])
@@ -0,0 +1,286 @@
+""" Cross-play tournament between all the imitators of a model directory.
+
+Every (agent0, agent1) pairing plays the same series of deck seeds. Games
+are split in chunks scheduled on a process pool, and every finished game is
+appended to <results>/games.jsonl as soon as its chunk returns. The mean
+score matrix is rewritten to <results>/matrix.csv after every chunk. When
+restarted with the same results directory, games already in games.jsonl are
+not played again.
+
+With a StoppingRule (see evaluation.py) the tournament is adaptive: a
+pairing stops being scheduled once its score interval is narrow enough or
+its ranking against a reference pairing is settled, so the workers are kept
+on the pairings that still need games. The games played, score interval and
+stop reason of every pairing are written to <results>/pairs.csv.
+
+Since all pairings play the same deals, a pairing is compared to a reference
+(baseline) pairing game by game: pairs.csv reports the mean paired difference
+of their scores, which removes the deck luck from the comparison. The
+duplicate mode goes further and plays every deck once from each start player
+(see game.duplicate_deals), so that both seats of a pairing get every hand.
+"""
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import sys
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, AGENTS_DIR)
+
+from evaluation import summarize  # noqa: E402
+from runtime import available_cores, limit_threads, model_name  # noqa: E402
+
+
+def find_models(model_dir):
+    """ Map the name of every imitator in @model_dir to its best.h5. """
+    paths = sorted(glob.glob(os.path.join(model_dir, '*.save', 'best.h5')))
+    return {model_name(p): p for p in paths}
+
+
+def read_results(path):
+    """ Read the per-game records of a results log.
+    A truncated last line, left by a crash in the middle of a write, is
+    ignored.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as log:
+        for line in log:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+def write_matrix(path, names, records):
+    """ Write the mean score and number of games of every pairing. """
+    totals = {}
+    for r in records:
+        total = totals.setdefault((r['agent0'], r['agent1']), [0., 0])
+        total[0] += r['score']
+        total[1] += 1
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['agent0 \\ agent1'] + names)
+        for agent0 in names:
+            row = [agent0]
+            for agent1 in names:
+                score, games = totals.get((agent0, agent1), (0., 0))
+                row.append('%.3f (%d)' % (score / games, games) if games
+                           else '')
+            writer.writerow(row)
+    os.replace(tmp_path, path)
+
+
+def write_pairs(path, pairs, scores, reference=None, rule=None,
+                reasons=None):
+    """ Write the games played, mean score and interval bounds of every
+    pairing, with its paired difference to the @reference pairing if any.
+    The intervals are at the corrected confidence level of @rule if given,
+    95% otherwise.
+    """
+    columns = ['agent0', 'agent1', 'games', 'mean', 'low', 'high']
+    if reference is not None:
+        columns += ['diff', 'diff_low', 'diff_high']
+    columns.append('stop')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as out:
+        writer = csv.DictWriter(out, columns)
+        writer.writeheader()
+        for pair in pairs:
+            reference_scores = None
+            if reference is not None and pair != reference:
+                reference_scores = scores[reference]
+            if rule is None:
+                summary = summarize(scores[pair], reference_scores,
+                                    paired=True)
+            else:
+                summary = rule.summary(scores[pair], reference_scores)
+            row = {k: '%.4f' % v if isinstance(v, float) else v
+                   for k, v in summary.items()}
+            row.update({'agent0': pair[0], 'agent1': pair[1],
+                        'stop': (reasons or {}).get(pair) or ''})
+            writer.writerow(row)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(threads):
+    sys.path.insert(1, AGENTS_DIR)
+    limit_threads(threads, tensorflow=True)
+
+
+def _play_chunk(task):
+    from vector_runner import VectorRunner
+
+    agent0, agent1, path0, path1, game_nums, deals, options = task
+    seeds, start_players = zip(*deals)
+    runner = VectorRunner(len(seeds), [path0, path1], seeds=seeds,
+                          start_players=start_players,
+                          num_envs=options['num_envs'],
+                          backend=options['backend'],
+                          memo=options['memo'])
+    scores = runner.runGame()
+    return [{'agent0': agent0, 'agent1': agent1, 'game': game_num,
+             'seed': seed, 'start_player': start_player, 'score': score}
+            for game_num, (seed, start_player), score
+            in zip(game_nums, deals, scores)]
+
+
+def run_tournament(model_dir, games_per_pair, results_dir, workers=None,
+                   chunk_size=50, seed=1, num_envs=64, backend='keras',
+                   rule=None, reference=None, duplicate=False, memo=False):
+    """ Play or resume a tournament.
+    Arguments:
+        - model_dir: str
+            Directory containing the *.save/best.h5 models.
+        - games_per_pair: int
+            Number of games of each (agent0, agent1) pairing, the maximum
+            number of games when @rule is given.
+        - results_dir: str
+            Directory of games.jsonl, matrix.csv and pairs.csv.
+        - workers: int, default None
+            Size of the process pool, number of available cores if None.
+        - chunk_size: int, default 50
+            Number of games of a pairing played by one task. With @rule, the
+            stopping decision is taken after every chunk.
+        - seed: int, default 1
+            Deck seed of the first game of every pairing.
+        - num_envs: int, default 64
+            Games played in lockstep by each worker, see VectorRunner.
+        - backend: str, default 'keras'
+            Backend of the agents.
+        - rule: evaluation.StoppingRule, default None
+            Stop each pairing early according to this rule, play
+            @games_per_pair games per pairing if None.
+        - reference: tuple, default None
+            (agent0, agent1) baseline pairing the others are compared to,
+            both in pairs.csv and by @rule.
+        - duplicate: bool, default False
+            Play every deck from each start player, see
+            game.duplicate_deals(). Otherwise game i uses deck @seed + i and
+            player 0 starts.
+        - memo: bool, default False
+            Memoize the predictions of each worker by observation, see
+            agent_wrapper.Agent.
+    Returns:
+        - list of all per-game records.
+    """
+    from game import duplicate_deals, game_seeds
+
+    models = find_models(model_dir)
+    if not models:
+        raise ValueError('No *.save/best.h5 model in %s' % model_dir)
+    names = list(models)
+    pairs = [(agent0, agent1) for agent0 in names for agent1 in names]
+    if reference is not None and reference not in pairs:
+        raise ValueError('Unknown reference pairing %s' % (reference, ))
+    if duplicate:
+        deals = duplicate_deals(games_per_pair, seed)
+    else:
+        deals = [(s, 0) for s in game_seeds(games_per_pair, seed)]
+    os.makedirs(results_dir, exist_ok=True)
+    log_path = os.path.join(results_dir, 'games.jsonl')
+    matrix_path = os.path.join(results_dir, 'matrix.csv')
+    pairs_path = os.path.join(results_dir, 'pairs.csv')
+
+    records = read_results(log_path)
+    # Rewrite the log without a possibly truncated last line
+    tmp_path = log_path + '.tmp'
+    with open(tmp_path, 'w') as log:
+        for r in records:
+            log.write(json.dumps(r) + '\n')
+    os.replace(tmp_path, log_path)
+    for r in records:
+        if r['game'] < len(deals) and \
+                (r['seed'], r.get('start_player', 0)) != deals[r['game']]:
+            raise ValueError('%s was played with other deals, use another '
+                             'results directory' % log_path)
+    done = {(r['agent0'], r['agent1'], r['game']) for r in records}
+    # pairing -> {game number: score}, so that pairings are compared on the
+    # games both have played
+    scores = {pair: {} for pair in pairs}
+    for r in records:
+        scores.setdefault((r['agent0'], r['agent1']), {})[r['game']] = \
+            r['score']
+
+    def decide(pair):
+        if rule is None:
+            return None
+        reference_scores = None
+        if reference is not None and pair != reference:
+            reference_scores = scores[reference]
+        return rule.decide(scores[pair], reference_scores)
+
+    todo = {pair: [g for g in range(games_per_pair)
+                   if pair + (g, ) not in done] for pair in pairs}
+    reasons = {pair: decide(pair) for pair in pairs}
+    in_flight = {pair: 0 for pair in pairs}
+    options = {'num_envs': num_envs, 'backend': backend, 'memo': memo}
+
+    def next_task():
+        # The open pairing with the fewest chunks in flight gets the next one
+        open_pairs = [p for p in pairs if todo[p] and reasons[p] is None]
+        if not open_pairs:
+            return None
+        pair = min(open_pairs, key=in_flight.get)
+        game_nums = todo[pair][:chunk_size]
+        del todo[pair][:chunk_size]
+        in_flight[pair] += 1
+        return (pair[0], pair[1], models[pair[0]], models[pair[1]],
+                game_nums, [deals[g] for g in game_nums], options)
+
+    print('%d games already played, %d pairings open' % (
+        len(records),
+        sum(1 for p in pairs if todo[p] and reasons[p] is None)))
+    if workers is None:
+        workers = available_cores()
+    finished = queue.Queue()
+    pending = 0
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(1, )) as pool, open(log_path, 'a') as log:
+        while True:
+            # Only a couple of chunks per worker are queued at a time, so
+            # that stopped pairings do not keep the pool busy.
+            while pending < 2 * workers:
+                task = next_task()
+                if task is None:
+                    break
+                pool.apply_async(_play_chunk, (task, ),
+                                 callback=finished.put,
+                                 error_callback=finished.put)
+                pending += 1
+            if pending == 0:
+                break
+            chunk = finished.get()
+            pending -= 1
+            if isinstance(chunk, BaseException):
+                raise chunk
+            for r in chunk:
+                log.write(json.dumps(r) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+            records.extend(chunk)
+            pair = (chunk[0]['agent0'], chunk[0]['agent1'])
+            in_flight[pair] -= 1
+            scores[pair].update((r['game'], r['score']) for r in chunk)
+            reasons[pair] = decide(pair)
+            write_matrix(matrix_path, names, records)
+            write_pairs(pairs_path, pairs, scores, reference, rule, reasons)
+            print('%d games played, %d pairings open' % (
+                len(records),
+                sum(1 for p in pairs if todo[p] and reasons[p] is None)))
+
+    if rule is not None:
+        for pair in pairs:
+            if reasons[pair] is None and not todo[pair]:
+                reasons[pair] = 'max_games'
+    write_matrix(matrix_path, names, records)
+    write_pairs(pairs_path, pairs, scores, reference, rule, reasons)
+    return records
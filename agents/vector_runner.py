@@ -0,0 +1,179 @@
+import itertools
+
+from hanabi_learning_environment import rl_env
+from cross_play_wrappers import agent_wrapper
+from cross_play_wrappers.encoding import (ObservationBuffer,
+                                          acting_observation, lean_reset,
+                                          lean_step)
+from game import game_config, game_seeds
+
+
+class LockstepGames(object):
+    def __init__(self, num_envs, num_players, seeds, start_players=None):
+        """ Slots of games played in lockstep, the loop shared by the
+        runners that batch the forward passes of many games.
+        Every live game owns a row of one ObservationBuffer. observe()
+        starts new games in the free slots and builds only the acting
+        player's observation of every live game, encoded into its row;
+        step() applies one move per live game and frees the slots of the
+        finished ones.
+        Arguments:
+            - num_envs: int
+                Number of slots, i.e. of games live at once.
+            - num_players: int
+                Number of players.
+            - seeds: iterable
+                Deck seed of each game, in order; may be endless.
+            - start_players: iterable, default None
+                Player moving first in each game, see VectorRunner; player
+                0 if None.
+        """
+        self.num_players = num_players
+        if start_players is None:
+            start_players = itertools.repeat(0)
+        self._deals = enumerate(zip(seeds, start_players))
+        self._next = next(self._deals, None)
+        # The encoder belongs to its game, so the buffer keeps its own env
+        self._encoder_env = rl_env.HanabiEnv(game_config(num_players))
+        self.buffer = ObservationBuffer(
+            num_envs, self._encoder_env.observation_encoder)
+        self.free_slots = list(range(num_envs))[::-1]
+        self.live = []
+
+    @property
+    def done(self):
+        """ Whether every game was played. """
+        return not self.live and self._next is None
+
+    def observe(self):
+        """ Fill the free slots and observe the acting players.
+        Returns:
+            - list of the live games, dicts with the game number, the slot,
+              the environment, the acting player's observation and, with
+              the start player applied, the player acting.
+        """
+        while self.free_slots and self._next is not None:
+            game_num, (seed, start_player) = self._next
+            self._next = next(self._deals, None)
+            environment = rl_env.HanabiEnv(game_config(self.num_players,
+                                                       seed))
+            lean_reset(environment)
+            self.live.append({'game_num': game_num,
+                              'slot': self.free_slots.pop(),
+                              'start_player': start_player,
+                              'environment': environment})
+        for g in self.live:
+            g['observation'] = acting_observation(
+                g['environment'], self.buffer, g['slot'])
+            g['player'] = (g['observation']['current_player'] +
+                           g['start_player']) % self.num_players
+        return self.live
+
+    def vectors(self, games=None):
+        """ Encoded observations of @games, all the live games if None. """
+        if games is None:
+            games = self.live
+        return self.buffer.data[[g['slot'] for g in games]]
+
+    def step(self, actions):
+        """ Apply one move per live game.
+        Arguments:
+            - actions: list
+                Move of each game returned by observe(), in that order, as
+                accepted by encoding.lean_step().
+        Returns:
+            - list of (game number, score) of the games that ended.
+        """
+        finished, still_live = [], []
+        for g, action in zip(self.live, actions):
+            if lean_step(g['environment'], action):
+                self.free_slots.append(g['slot'])
+                finished.append((g['game_num'],
+                                 g['environment'].state.score()))
+            else:
+                still_live.append(g)
+        self.live = still_live
+        return finished
+
+
+class VectorRunner(object):
+    def __init__(self, num_games, paths_models, num_envs=64, seed=1,
+                 backend='keras', seeds=None, start_players=None,
+                 memo=None):
+        """ Play many cross-play games in lockstep.
+        Up to @num_envs games are live at once. At every step the observations
+        of the acting players of all live games are gathered into one batch
+        per model and evaluated with a single forward pass, then every game
+        is stepped. Only the acting player's observation of each game is
+        built, encoded into the row of the game's slot in a shared
+        ObservationBuffer, and the model input is gathered from that buffer.
+        A finished game is immediately replaced by the next one
+        until @num_games games have been played. Game i is dealt with the
+        same seed as in game.runGame, so both runners produce the same games.
+        Arguments:
+            - num_games: int
+                Total number of games to play.
+            - paths_models: list
+                Path of the model of each seat; the number of paths is the
+                number of players.
+            - num_envs: int, default 64
+                Number of games played simultaneously.
+            - seed: int, default 1
+                Seed of the first game, see game.game_seeds().
+            - backend: str, default 'keras'
+                Backend of the agents, see agent_wrapper.Agent.
+            - seeds: list, default None
+                Explicit deck seed of each game, overrides @num_games and
+                @seed. Used to play a subset of a longer series.
+            - start_players: list, default None
+                Player moving first in each game, see game.duplicate_deals().
+                The environment always starts with its seat 0, so the seats
+                are rotated instead: player p sits at seat
+                (p - start_player) % players and gets that seat's hand.
+            - memo: bool or PredictionMemo, default None
+                Memoize the predictions by observation, see
+                agent_wrapper.Agent. Duplicate decks replay the same
+                positions, the openings in particular.
+        """
+        if seeds is None:
+            seeds = game_seeds(num_games, seed)
+        self.num_players = len(paths_models)
+        self.num_games = len(seeds)
+        self.num_envs = max(1, min(num_envs, self.num_games))
+        self.seeds = list(seeds)
+        if start_players is None:
+            start_players = [0] * self.num_games
+        self.start_players = list(start_players)
+        self.agent_object = [agent_wrapper.Agent(path, backend=backend,
+                                                 memo=memo)
+                             for path in paths_models]
+        # Seats played by the same model share their batches
+        self.model_seats = {}
+        for seat, path in enumerate(paths_models):
+            self.model_seats.setdefault(path, []).append(seat)
+
+    def runGame(self):
+        """ Play all the games.
+        Returns:
+            - list of the final score of each game, in game order.
+        """
+        scores = [None] * self.num_games
+        games = LockstepGames(self.num_envs, self.num_players, self.seeds,
+                              self.start_players)
+        while not games.done:
+            live = games.observe()
+            actions = [None] * len(live)
+            for path, seats in self.model_seats.items():
+                playing = [i for i, g in enumerate(live)
+                           if g['player'] in seats]
+                if not playing:
+                    continue
+                observations = [live[i]['observation'] for i in playing]
+                vectors = games.vectors([live[i] for i in playing])
+                agent = self.agent_object[seats[0]]
+                for i, (action, _) in zip(playing, agent.act_batch(
+                        observations, observation_vectors=vectors)):
+                    actions[i] = action
+            for game_num, score in games.step(actions):
+                scores[game_num] = score
+        return scores
@@ -0,0 +1,236 @@
+""" Self-play worker pool sharing one copy of the imitator weights.
+
+The parent loads every model once as a NumPy engine (see numpy_mlp.py) and
+freezes its arrays before starting the workers, which then never import
+TensorFlow nor read a best.h5:
+  - fork: the workers inherit the parent's model cache and share the weight
+    pages copy-on-write; the arrays being read-only, the pages are never
+    copied.
+  - spawn / forkserver: the parent writes the weights as flat weight files
+    (see NumpyMlp.save_flat) and every worker memory-maps them, sharing the
+    pages through the page cache.
+Each worker reports its startup time and its RSS and PSS (the RSS with the
+shared pages divided among the processes that map them), next to the games
+per second of the whole pool.
+
+    python agents/worker_pool.py --workers 64 --games-per-model 1000
+"""
+import os
+import sys
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, AGENTS_DIR)
+
+from runtime import available_cores, limit_threads  # noqa: E402
+
+if __name__ == '__main__':
+    # Single-threaded BLAS in every worker, set before numpy is imported so
+    # that forked workers inherit it
+    limit_threads(1, override=False)
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import multiprocessing  # noqa: E402
+import shutil  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from numpy_mlp import NumpyMlp  # noqa: E402
+from cross_play_wrappers.agent_wrapper import LOADERS  # noqa: E402
+from cross_play_wrappers.model_cache import model_cache  # noqa: E402
+
+
+def memory_usage():
+    """ RSS and PSS of the current process in bytes, from /proc (Linux).
+    PSS is None where /proc/self/smaps_rollup is not available.
+    """
+    usage = {'rss': None, 'pss': None}
+    for path, keys in (('/proc/self/status', {'VmRSS:': 'rss'}),
+                       ('/proc/self/smaps_rollup', {'Pss:': 'pss'})):
+        try:
+            with open(path) as status:
+                for line in status:
+                    fields = line.split()
+                    if fields and fields[0] in keys:
+                        usage[keys[fields[0]]] = int(fields[1]) * 1024
+        except OSError:
+            pass
+    if usage['rss'] is None:
+        import resource
+        usage['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss \
+            * 1024
+    return usage
+
+
+def load_shared_models(paths, backend='numpy'):
+    """ Load and freeze the models in the process-wide cache, under the keys
+    Agent(path, backend=backend) looks up.
+    Arguments:
+        - paths: list
+            best.h5 paths.
+        - backend: str, default 'numpy'
+            'numpy', 'float16' or 'int8', see agent_wrapper.LOADERS.
+    Returns:
+        - dict path -> frozen NumpyMlp.
+    """
+    if backend == 'keras':
+        raise ValueError('The worker pool shares NumPy engines, not keras '
+                         'models')
+    return {path: model_cache.get(path, LOADERS[backend],
+                                  variant=backend).freeze()
+            for path in paths}
+
+
+def export_shared_models(models, directory):
+    """ Write the models as memory-mappable flat weight files.
+    Returns:
+        - dict path -> flat weight file.
+    """
+    exported = {}
+    for i, (path, model) in enumerate(sorted(models.items())):
+        exported[path] = os.path.join(directory, 'model%d.hnw' % i)
+        model.save_flat(exported[path])
+    return exported
+
+
+def _init_worker(launch_time, backend, exported, reports):
+    limit_threads(1)
+    if AGENTS_DIR not in sys.path:
+        sys.path.insert(1, AGENTS_DIR)
+    # With fork the cache is inherited, with spawn the arrays are mapped
+    for path, flat in (exported or {}).items():
+        model_cache.get(path, lambda _, f=flat: NumpyMlp.load_flat(f),
+                        variant=backend)
+    report = {'pid': os.getpid(),
+              'startup_seconds': time.time() - launch_time}
+    report.update(memory_usage())
+    reports.put(report)
+
+
+def _play_chunk(task):
+    from vector_runner import VectorRunner
+
+    path, seeds, num_envs, backend = task
+    runner = VectorRunner(len(seeds), [path, path], seeds=seeds,
+                          num_envs=num_envs, backend=backend)
+    return path, runner.runGame(), os.getpid(), memory_usage()
+
+
+def run_pool(paths, games_per_model, workers=None, start_method='fork',
+             chunk_size=50, num_envs=16, seed=1, backend='numpy'):
+    """ Play self-play games of every model on a pool sharing the weights.
+    Arguments:
+        - paths: list
+            best.h5 paths of the models.
+        - games_per_model: int
+            Number of self-play games of each model.
+        - workers: int, default None
+            Number of processes, number of available cores if None.
+        - start_method: str, default 'fork'
+            'fork' shares the parent's arrays copy-on-write, 'spawn' and
+            'forkserver' memory-map exported arrays.
+        - chunk_size: int, default 50
+            Games per task.
+        - num_envs: int, default 16
+            Games played in lockstep by a worker, see VectorRunner.
+        - seed: int, default 1
+            Deck seed of the first game of every model.
+        - backend: str, default 'numpy'
+            'numpy', 'float16' or 'int8'.
+    Returns:
+        - report dict: parent memory, per-worker startup time and memory,
+          games per second and mean score per model.
+    """
+    if workers is None:
+        workers = available_cores()
+    report = {'workers': workers, 'start_method': start_method,
+              'backend': backend}
+    report['parent_before_load'] = memory_usage()
+    start = time.time()
+    models = load_shared_models(paths, backend)
+    report['load_seconds'] = time.time() - start
+    report['model_bytes'] = sum(m.nbytes for m in models.values())
+    report['parent_after_load'] = memory_usage()
+
+    tmp_dir = None
+    exported = None
+    if start_method != 'fork':
+        tmp_dir = tempfile.mkdtemp(prefix='hanabi_weights_')
+        exported = export_shared_models(models, tmp_dir)
+
+    tasks = []
+    for path in paths:
+        for i in range(0, games_per_model, chunk_size):
+            seeds = [seed + g for g in
+                     range(i, min(i + chunk_size, games_per_model))]
+            tasks.append((path, seeds, num_envs, backend))
+
+    context = multiprocessing.get_context(start_method)
+    reports = context.Queue()
+    scores = {path: [] for path in paths}
+    peak = {}  # pid -> largest memory usage seen after a task
+    try:
+        launch_time = time.time()
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=(launch_time, backend, exported,
+                                    reports)) as pool:
+            results = pool.imap_unordered(_play_chunk, tasks)
+            startups = [reports.get() for _ in range(workers)]
+            for path, chunk, pid, usage in results:
+                scores[path].extend(chunk)
+                worker_peak = peak.setdefault(pid, {})
+                for key, value in usage.items():
+                    if value is not None:
+                        worker_peak[key] = max(value,
+                                               worker_peak.get(key, 0))
+        elapsed = time.time() - launch_time
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for worker in startups:
+        worker['peak'] = peak.get(worker['pid'])
+    num_games = sum(len(s) for s in scores.values())
+    report.update({
+        'worker_reports': sorted(startups, key=lambda w: w['pid']),
+        'max_startup_seconds': max((w['startup_seconds'] for w in startups),
+                                   default=None),
+        'total_worker_pss': sum((w['peak'] or {}).get('pss') or 0
+                                for w in startups),
+        'seconds': elapsed,
+        'games': num_games,
+        'games_per_sec': num_games / elapsed,
+        'mean_scores': {os.path.basename(os.path.dirname(p)):
+                        float(np.mean(s)) for p, s in scores.items() if s}})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--models', nargs='+', default=None,
+                        help='best.h5 paths, every imitator by default')
+    parser.add_argument('--games-per-model', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--start-method', default='fork',
+                        choices=['fork', 'spawn', 'forkserver'])
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--num-envs', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backend', default='numpy',
+                        choices=['numpy', 'float16', 'int8'])
+    args = parser.parse_args(argv)
+
+    from tournament import find_models
+    paths = args.models or list(find_models(
+        os.path.join(AGENTS_DIR, 'imitator_models')).values())
+    report = run_pool(paths, args.games_per_model, workers=args.workers,
+                      start_method=args.start_method,
+                      chunk_size=args.chunk_size, num_envs=args.num_envs,
+                      seed=args.seed, backend=args.backend)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
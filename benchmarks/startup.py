@@ -0,0 +1,95 @@
+""" Startup-time benchmark of the GUI server.
+
+Starts gui/gui.py in a subprocess and reports, in seconds since launch:
+  - time_to_first_page: the front page is served,
+  - time_to_first_agent_move: an agent has played the first move of a fresh
+    game through Agent.act, requested on /first_move as soon as the front
+    page is served, whether the warm-up is done or not,
+  - time_to_warm_up: every imitator is loaded and has run a forward pass,
+    i.e. the earliest point at which an agent move costs no model load,
+  - the milestones recorded by the server itself on /startup.
+
+    python benchmarks/startup.py [--timeout 300]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_port():
+    """ Port configured in justpy.env, 8000 being the justpy default. """
+    try:
+        with open(os.path.join(ROOT, 'justpy.env')) as env:
+            for line in env:
+                key, _, value = line.partition('=')
+                if key.strip() == 'PORT':
+                    return int(value.strip().strip('\'"'))
+    except OSError:
+        pass
+    return 8000
+
+
+def get(url, timeout=1.):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as err:
+        return err.code, err.read()
+    except OSError:
+        return None, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=read_port())
+    parser.add_argument('--timeout', type=float, default=300.)
+    args = parser.parse_args(argv)
+    base_url = 'http://127.0.0.1:%d' % args.port
+
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, os.path.join('gui', 'gui.py')],
+                              cwd=ROOT, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    report = {}
+    try:
+        while time.monotonic() - start < args.timeout:
+            if server.poll() is not None:
+                sys.exit('gui.py exited with code %d' % server.returncode)
+            if 'time_to_first_page' not in report:
+                status, _ = get(base_url + '/')
+                if status == 200:
+                    report['time_to_first_page'] = time.monotonic() - start
+            elif 'time_to_first_agent_move' not in report:
+                remaining = args.timeout - (time.monotonic() - start)
+                status, body = get(base_url + '/first_move',
+                                   timeout=max(remaining, 1.))
+                if status != 200:
+                    sys.exit('/first_move failed: %s' % body)
+                report['time_to_first_agent_move'] = \
+                    time.monotonic() - start
+                report['first_move'] = json.loads(body)
+            else:
+                _, body = get(base_url + '/startup')
+                timings = json.loads(body) if body else {}
+                if 'warm_up_done' in timings:
+                    report['time_to_warm_up'] = time.monotonic() - start
+                    report['server_timings'] = timings
+                    break
+            time.sleep(0.05)
+        else:
+            report['timed_out'] = True
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+""" Benchmark suite of the environment, the imitators and the GUI.
+
+Measures, and prints as one JSON document:
+  - env_step: HanabiEnv.step throughput with random legal moves, 2 to 5
+    players,
+  - agent_act: Agent.act latency percentiles at batch size 1 and
+    Agent.act_batch throughput, for each imitator,
+  - run_game: end-to-end games/sec of game.runGame,
+  - main_page: wall time to build a MainPage component tree for a late-game
+    5-player state and to serialize it as justpy sends it to the browser.
+
+The report also holds the machine and git revision, so that runs on the same
+hardware can be compared.
+
+    python benchmarks/suite.py [--only env_step agent_act] [--output out.json]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTS_DIR = os.path.join(ROOT, 'agents')
+GUI_DIR = os.path.join(ROOT, 'gui')
+for path in (ROOT, AGENTS_DIR, GUI_DIR):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+from hanabi_learning_environment import pyhanabi  # noqa: E402
+from hanabi_learning_environment import rl_env  # noqa: E402
+from game import game_config  # noqa: E402
+from runtime import model_name  # noqa: E402
+
+BENCHMARKS = ['env_step', 'agent_act', 'run_game', 'main_page']
+
+
+def percentiles(seconds):
+    """ Latency summary, in milliseconds, of a list of durations. """
+    ms = np.asarray(seconds) * 1e3
+    return {'count': len(ms),
+            'mean_ms': float(ms.mean()),
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p90_ms': float(np.percentile(ms, 90)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'max_ms': float(ms.max())}
+
+
+def find_models():
+    return sorted(glob.glob(os.path.join(AGENTS_DIR, 'imitator_models',
+                                         '*.save', 'best.h5')))
+
+
+def bench_env_step(steps=20000, seed=1):
+    """ Steps per second of HanabiEnv.step for 2 to 5 players. """
+    rng = np.random.RandomState(seed)
+    report = {}
+    for players in range(2, 6):
+        env = rl_env.HanabiEnv(game_config(players, seed))
+        observations = env.reset()
+        games = 0
+        start = time.perf_counter()
+        for _ in range(steps):
+            observation = observations['player_observations'][
+                observations['current_player']]
+            legal_moves = observation['legal_moves']
+            action = legal_moves[rng.randint(len(legal_moves))]
+            observations, _, done, _ = env.step(action)
+            if done:
+                games += 1
+                observations = env.reset()
+        elapsed = time.perf_counter() - start
+        report[str(players)] = {'steps': steps,
+                                'seconds': elapsed,
+                                'steps_per_sec': steps / elapsed,
+                                'games': games}
+    return report
+
+
+def acting_observations(count, players=2, seed=1):
+    """ Observations of the acting player along random 2-player games. """
+    rng = np.random.RandomState(seed)
+    env = rl_env.HanabiEnv(game_config(players, seed))
+    observations = env.reset()
+    acting = []
+    while len(acting) < count:
+        observation = observations['player_observations'][
+            observations['current_player']]
+        acting.append(observation)
+        legal_moves = observation['legal_moves']
+        observations, _, done, _ = env.step(
+            legal_moves[rng.randint(len(legal_moves))])
+        if done:
+            observations = env.reset()
+    return acting, env.num_moves()
+
+
+def bench_agent_act(models, backend='keras', samples=500, batch_size=64,
+                    batches=50):
+    """ Agent.act latency at batch size 1 and Agent.act_batch throughput of
+    each imitator, on the same acting-player observations.
+    """
+    from cross_play_wrappers.agent_wrapper import Agent
+
+    observations, num_moves = acting_observations(max(samples, batch_size))
+    report = {}
+    for path in models:
+        load_start = time.perf_counter()
+        agent = Agent(path, backend=backend)
+        load_seconds = time.perf_counter() - load_start
+        agent.act(observations[0], num_moves)  # warm-up
+
+        latencies = []
+        for observation in observations[:samples]:
+            start = time.perf_counter()
+            agent.act(observation, num_moves)
+            latencies.append(time.perf_counter() - start)
+
+        batch = observations[:batch_size]
+        agent.act_batch(batch)
+        start = time.perf_counter()
+        for _ in range(batches):
+            agent.act_batch(batch)
+        elapsed = time.perf_counter() - start
+        report[model_name(path)] = {
+            'load_seconds': load_seconds,
+            'act': percentiles(latencies),
+            'act_batch': {'batch_size': batch_size,
+                          'batches': batches,
+                          'observations_per_sec':
+                              batch_size * batches / elapsed}}
+    return report
+
+
+def bench_run_game(models, num_games=10, seed=1):
+    """ Games per second of game.runGame, first imitator against itself. """
+    from game import game
+
+    runner = game(num_games, models[0], models[0], seed=seed)
+    # runGame prints the fireworks and the actions of every step
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        scores = runner.runGame()
+        elapsed = time.perf_counter() - start
+    return {'model': model_name(models[0]),
+            'games': num_games,
+            'seconds': elapsed,
+            'games_per_sec': num_games / elapsed,
+            'mean_score': float(np.mean(scores))}
+
+
+def late_game_state(players=5, seed=1):
+    """ Last state before the end of a random 5-player game, with the deck
+    empty and long discard pile and move history.
+    """
+    rng = np.random.RandomState(seed)
+    game = pyhanabi.HanabiGame(dict(game_config(players, seed)))
+    state = game.new_initial_state()
+    previous = state.copy()
+    while not state.is_terminal():
+        if state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+            state.deal_random_card()
+            continue
+        previous = state.copy()
+        legal_moves = state.legal_moves()
+        state.apply_move(legal_moves[rng.randint(len(legal_moves))])
+    return previous
+
+
+def bench_main_page(repeats=20, players=5, seed=1):
+    """ Build and serialization time of the MainPage of a late-game state. """
+    with contextlib.redirect_stdout(io.StringIO()):
+        import gui
+    state = late_game_state(players, seed)
+    session = {'id': 'benchmark', 'current_state': state, 'states': [state],
+               'view': 'observer', 'step_frequency': 0,
+               'num_players': players, 'current_player': state.cur_player(),
+               'is_running': True, 'is_paused': False,
+               'wait_event': None,
+               'human_player': {'move_made': False, 'human_moves': [],
+                                'card_clicked': ''},
+               'agents': {'Agent%d' % i: '' for i in range(players - 1)}}
+    build, serialize, size = [], [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        page = gui.MyPage(body_classes='bg-gray-900')
+        gui.MainPage(name='main_page', session=session, state=state, a=page)
+        built = time.perf_counter()
+        # What WebPage.update() sends over the websocket
+        data = json.dumps({'type': 'page_update',
+                           'data': page.build_list()}, default=str)
+        done = time.perf_counter()
+        build.append(built - start)
+        serialize.append(done - built)
+        size = len(data)
+    return {'players': players,
+            'moves': len(state.move_history()),
+            'build': percentiles(build),
+            'serialize': percentiles(serialize),
+            'json_bytes': size}
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True,
+                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'git_revision': revision,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=BENCHMARKS)
+    parser.add_argument('--models', nargs='+', default=None,
+                        help='model paths, every imitator by default')
+    parser.add_argument('--backend', default='keras',
+                        choices=['keras', 'numpy', 'float16', 'int8'])
+    parser.add_argument('--steps', type=int, default=20000,
+                        help='environment steps per player count')
+    parser.add_argument('--samples', type=int, default=500,
+                        help='Agent.act calls per imitator')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--games', type=int, default=10,
+                        help='games played by game.runGame')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None,
+                        help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    models = args.models or find_models()
+    report = {'environment': environment(), 'backend': args.backend}
+    if 'env_step' in args.only:
+        report['env_step'] = bench_env_step(args.steps, args.seed)
+    if 'agent_act' in args.only:
+        report['agent_act'] = bench_agent_act(models, args.backend,
+                                              args.samples, args.batch_size)
+    if 'run_game' in args.only:
+        report['run_game'] = bench_run_game(models, args.games, args.seed)
+    if 'main_page' in args.only:
+        report['main_page'] = bench_main_page(seed=args.seed)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -26,11 +26,15 @@ from asyncio.runners import run
 parentDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 sys.path.append(parentDirectory)
+#the agent wrapper imports its siblings from agents/, timings must be the same module
+sys.path.append(os.path.join(parentDirectory, 'agents'))
 
 
-from agents.cross_play_wrappers import agent_wrapper
 from hanabi_learning_environment import pyhanabi
 from hanabi_learning_environment import rl_env
+from agents.game_record import GameRecordWriter
+from timings import timings
+from cross_play_wrappers.encoding import ObservationBuffer, acting_observation, lean_reset
 from game_components import *
 import numpy as np
 import time
@@ -38,6 +42,11 @@ import threading
 import asyncio
 import copy
 import justpy as jp
+from starlette.responses import JSONResponse, PlainTextResponse
+
+#monotonic timestamps of the startup milestones, served on /startup
+process_start = time.monotonic()
+startup_timings = {}
 
 """Tailwind CSS classes"""
 label_classes = 'block uppercase text-gray-500 text-xs font-bold'
@@ -70,6 +79,14 @@ print(newPath)
 
 threads = []
 sessions = {}
+agent_wrapper = None
+#compact records of the games played in the GUI, see agents/game_record.py
+game_records_path = os.path.join(parentDirectory, 'game_records', 'gui.hgr')
+game_records = None
+#backend of the GUI agents, one of agent_wrapper.LOADERS. If unset, a model
+#runs on the NumPy backend when its exported weights are up to date (see
+#agents/export_weights.py) and on keras otherwise
+agent_backend = os.environ.get('HANABI_AGENT_BACKEND') or None
 
 def Agents():
 
@@ -81,6 +98,69 @@ def Agents():
 
     return agents
 
+def record_startup_timing(milestone):
+    """Records the seconds elapsed since process start for a milestone, the first time only."""
+    if milestone not in startup_timings:
+        startup_timings[milestone] = time.monotonic() - process_start
+        print('Startup: {} after {:.3f}s'.format(milestone, startup_timings[milestone]))
+
+def load_agent_wrapper():
+    """Imports the agent wrapper on first agent use.
+       Keeps the model code, and TensorFlow with it, out of the server startup.
+
+       Returns: agent_wrapper: module, agents.cross_play_wrappers.agent_wrapper.
+    """
+    global agent_wrapper
+    if agent_wrapper is None:
+        from agents.cross_play_wrappers import agent_wrapper as wrapper
+        agent_wrapper = wrapper
+    return agent_wrapper
+
+def make_agent(path):
+    """Builds the agent of a model with the GUI's backend, see agent_backend.
+       Agents of all sessions share the model cache and are batched together,
+       repeated positions are memoized.
+
+       Args: path: str, best.h5 of the agent.
+
+       Returns: agent: agent_wrapper.Agent.
+    """
+    wrapper = load_agent_wrapper()
+    backend = agent_backend or wrapper.default_backend(path)
+    return wrapper.Agent(path, batched = True, memo = True, backend = backend)
+
+def warm_up_agents():
+    """Loads every model found by Agents() and runs a dummy forward pass,
+       so that the first agent move of a session does not pay for it.
+    """
+    try:
+        for path in Agents():
+            agent = make_agent(path)
+            agent.broker.predict(np.zeros(658, dtype = np.float32))
+            print('Warmed up {}'.format(path))
+        record_startup_timing('warm_up_done')
+    except Exception as err:
+        print('The agent warm-up failed.')
+        print('Exception: {}'.format(err))
+
+def record_game(env, seed, random_start_player):
+    """Appends the compact record of a game to the GUI's game record file."""
+    global game_records
+    try:
+        if game_records is None:
+            os.makedirs(os.path.dirname(game_records_path), exist_ok = True)
+            game_records = GameRecordWriter(game_records_path)
+        game_records.write_state(env.state, env.game, seed, random_start_player)
+        game_records.flush()
+    except Exception as err:
+        print('The game could not be recorded.')
+        print('Exception: {}'.format(err))
+
+def start_warm_up():
+    """Startup hook of the server, runs the warm-up in the background once the server is listening."""
+    record_startup_timing('server_started')
+    threading.Thread(target = warm_up_agents, name = 'warm_up', daemon = True).start()
+
 class Menu(jp.Div):
     """The menu component.
 
@@ -1134,11 +1214,56 @@ def render_front_page(request):
     print("{} has connected".format(session['id']))
 
     FrontPage(name = 'front_page', a = front_page)
+    record_startup_timing('first_page')
     return front_page
   except Exception as err:
       print('The front page failed to load.')
       print('Exception: {}'.format(err))
 
+@jp.SetRoute('/startup')
+def render_startup_timings(request):
+  """Startup milestones in seconds since process start, used by benchmarks/startup.py."""
+  return JSONResponse(startup_timings)
+
+def play_first_agent_move(path):
+    """Plays the first move of a fresh two-player game with an agent, the way agent_player does.
+
+       Args: path: str, best.h5 of the agent.
+
+       Returns: move: dict, the move played.
+    """
+    env = rl_env.HanabiEnv({'players': 2, 'seed': 1})
+    lean_reset(env)
+    observation = acting_observation(env, ObservationBuffer(1, env.observation_encoder))
+    action = make_agent(path).act(observation, env.num_moves())
+    record_startup_timing('first_agent_move')
+    return action[0]
+
+@jp.SetRoute('/first_move')
+async def render_first_move(request):
+  """Plays one agent move on a fresh game with the first model found, used by benchmarks/startup.py."""
+  paths = sorted(Agents())
+  if not paths:
+    return JSONResponse({'error': 'no model found'}, status_code = 404)
+  try:
+    #off the event loop, the first move may have to load the model
+    move = await asyncio.to_thread(play_first_agent_move, paths[0])
+  except Exception as err:
+    print('The first agent move failed.')
+    print('Exception: {}'.format(err))
+    return JSONResponse({'error': str(err)}, status_code = 500)
+  return JSONResponse({'model': paths[0], 'move': move})
+
+@jp.SetRoute('/metrics')
+def render_metrics(request):
+  """Per-phase timing histograms in Prometheus text format, empty unless HANABI_TIMINGS is set."""
+  return PlainTextResponse(timings.to_prometheus())
+
+@jp.SetRoute('/metrics.json')
+def render_metrics_json(request):
+  """Per-phase timing histograms as JSON, see agents/timings.py."""
+  return JSONResponse(timings.to_json())
+
 def run_game(game_parameters, session, page):
     """Play a game, selecting random actions."""
     async def update_page(state, session, page):
@@ -1152,21 +1277,24 @@ def run_game(game_parameters, session, page):
             page.delete_components()
             if (state.cur_player() != -1 and session['view'] == 'observer'): #only observer follows the players as they makes their move
                 session['current_player'] = state.cur_player()
-            MainPage(name = 'main_page', session = session, state = state, a = page)
-            await page.update()
+            with timings.phase('page_update', session = session['id']):
+                MainPage(name = 'main_page', session = session, state = state, a = page)
+                await page.update()
         except Exception as err:
             print('The main page failed to update.')
             print('Exception: {}'.format(err))
 
     def set_current_state(state):
-        copied_state = state.copy()
+        with timings.phase('copy_state', session = session['id']):
+            copied_state = state.copy()
         session['states'].insert(0, copied_state)
         session['current_state'] = copied_state
     
     def random_player(state):
         legal_moves = state.legal_moves()
         move = np.random.choice(legal_moves)
-        state.apply_move(move)
+        with timings.phase('apply_move', session = session['id']):
+            state.apply_move(move)
         return state
 
     #function to wait for human input, using condition.wait_for
@@ -1195,7 +1323,6 @@ def run_game(game_parameters, session, page):
     
     def human_play(env):
         state = env.state
-        observation = env._make_observation_all_players()
         if state.cur_player() == 0: #checks the state instead of the session since the session['current_player] should be 0 for human-play
                     session['wait_event'].wait_for(wait_human_input)
                     #apply move
@@ -1203,35 +1330,41 @@ def run_game(game_parameters, session, page):
                         print('in for loop')
                         if str(p_move) == str(session['human_player']['human_moves'][0]):
                             print('applying move')
-                            state.apply_move(p_move)
+                            with timings.phase('apply_move', session = session['id']):
+                                state.apply_move(p_move)
                             break
                     #/apply move
                     session['human_player']['move_made'] = not session['human_player']['move_made']
         else:
             if session['agents'][f'Agent{state.cur_player() - 1}'] != '': #if there are agents in the agents list this will run otherwise the initial random agent will be run
-                #print(f'Agent-player function: {agent_player(observation, int(state.cur_player()), env)}')
+                #only the acting agent's observation is built and encoded
+                with timings.phase('observation', session = session['id']):
+                    observation = acting_observation(env, observation_buffer)
                 action = agent_action_decoder(agent_player(observation, state.cur_player(), env))
-                state.apply_move(action)
+                with timings.phase('apply_move', session = session['id']):
+                    state.apply_move(action)
             else:
                 print('random_player')
                 state = random_player(state)
         return state
     #hoad code
-    def agent_player(observations, agent_id, env):
-        observation = observations['player_observations'][agent_id]
-        action = agent_wrapper.Agent(session['agents'][f'Agent{agent_id - 1}']).act(observation, env.num_moves())
+    def agent_player(observation, agent_id, env):
+        action = make_agent(session['agents'][f'Agent{agent_id - 1}']).act(observation, env.num_moves())
+        record_startup_timing('first_agent_move')
         return action[0]
     #hoad code/
 
+    #an explicit seed makes the game replayable from its record
+    seed = game_parameters.setdefault('seed', int(np.random.randint(2**31 - 1)))
     env = rl_env.HanabiEnv(game_parameters)
     '''game = env.game #grabs the game from environment instead of from pyhanabi
     #game = pyhanabi.HanabiGame(game_parameters)'''
-    observation = env.reset()
 
     print('\nBenchmark started for session: {}\n'.format(session['id']))
     print(env.game.parameter_string(), end="")
 
     obs_encoder = env.observation_encoder
+    observation_buffer = ObservationBuffer(1, obs_encoder)
     env.state = env.game.new_initial_state()
     
     while not env.state .is_terminal() and session['is_running']:
@@ -1241,7 +1374,8 @@ def run_game(game_parameters, session, page):
 
             
             if env.state .cur_player() == pyhanabi.CHANCE_PLAYER_ID:
-                env.state .deal_random_card()
+                with timings.phase('apply_move', session = session['id']):
+                    env.state .deal_random_card()
                 set_current_state(env.state )
                 asyncio.run(update_page(env.state , session, page))
                 if session['step_frequency'] > 0:
@@ -1258,6 +1392,7 @@ def run_game(game_parameters, session, page):
             if session['step_frequency'] > 0:
                 session['wait_event'].wait(timeout=float(session['step_frequency']))
     session['is_running'] = False
+    record_game(env, seed, game_parameters.get('random_start_player', False))
     asyncio.run(update_page(env.state , session, page))
     print(env.state.score())
     print("Stopping benchmark...")
@@ -1269,5 +1404,5 @@ if __name__ == "__main__":
     # Check that the cdef and library were loaded from the standard paths.
     assert pyhanabi.cdef_loaded(), "cdef failed to load"
     assert pyhanabi.lib_loaded(), "lib failed to load"
-    jp.justpy(render_front_page)
+    jp.justpy(render_front_page, startup = start_warm_up)
     
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The agents modules import each other as top-level modules
+AGENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'agents')
+if AGENTS_DIR not in sys.path:
+    sys.path.insert(1, AGENTS_DIR)
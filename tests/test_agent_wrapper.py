@@ -0,0 +1,95 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from cross_play_wrappers.agent_wrapper import (  # noqa: E402
+    legal_moves_mask, select_legal_actions)
+
+
+def observation(legal):
+    """ The keys of a player observation the selection reads. """
+    return {'legal_moves_as_int': list(legal),
+            'legal_moves': ['move%d' % m for m in legal]}
+
+
+def policy(*rows, action_dim=6):
+    out = np.zeros((len(rows), action_dim), dtype=np.float32)
+    for out_row, row in zip(out, rows):
+        for action, p in row.items():
+            out_row[action] = p
+    return out
+
+
+def test_legal_moves_mask():
+    mask, positions = legal_moves_mask(
+        [observation([4, 1]), observation([0, 2, 5])], action_dim=6)
+    np.testing.assert_array_equal(mask, [[0, 1, 0, 0, 1, 0],
+                                         [1, 0, 1, 0, 0, 1]])
+    np.testing.assert_array_equal(positions, [[-1, 1, -1, -1, 0, -1],
+                                              [0, -1, 1, -1, -1, 2]])
+
+
+def test_argmax_takes_the_most_likely_legal_move():
+    observations = [observation([1, 3]), observation([0, 2, 5])]
+    action_raw = policy({0: .5, 1: .1, 3: .4}, {2: .2, 4: .6, 5: .2})
+    actions, indices = select_legal_actions(action_raw, observations)
+    np.testing.assert_array_equal(indices, [3, 2])
+    assert actions == ['move3', 'move2']
+
+
+def sample(probabilities, legal, mode, n=4000, k=3):
+    """ Indices chosen by @mode for @n copies of one observation. """
+    actions, indices = select_legal_actions(
+        policy(*[probabilities] * n), [observation(legal)] * n, mode=mode,
+        k=k, rng=np.random.default_rng(0))
+    assert actions == ['move%d' % i for i in indices]
+    return indices
+
+
+def test_sample_follows_the_policy_on_legal_moves():
+    legal = [0, 2, 3, 5]
+    probabilities = {0: .1, 1: .3, 2: .2, 3: .15, 4: .1, 5: .15}
+    indices = sample(probabilities, legal, 'sample')
+    assert set(indices) <= set(legal)
+    expected = np.array([probabilities[a] if a in legal else 0.
+                         for a in range(6)])
+    counts = np.bincount(indices, minlength=6) / len(indices)
+    np.testing.assert_allclose(counts, expected / expected.sum(), atol=.03)
+
+
+def test_top_k_samples_among_the_k_best_legal_moves():
+    legal = [0, 2, 3, 5]
+    probabilities = {0: .1, 1: .3, 2: .25, 3: .2, 4: .1, 5: .15}
+    indices = sample(probabilities, legal, 'top_k', k=2)
+    assert set(indices) == {2, 3}
+    np.testing.assert_allclose(np.mean(indices == 2), .25 / .45, atol=.03)
+
+
+def test_top_k_of_one_is_argmax():
+    observations = [observation([1, 3]), observation([0, 2, 5])]
+    action_raw = policy({0: .5, 1: .1, 3: .4}, {2: .2, 4: .6, 5: .3})
+    _, indices = select_legal_actions(action_raw, observations,
+                                      mode='top_k', k=1,
+                                      rng=np.random.default_rng(0))
+    np.testing.assert_array_equal(indices, [3, 5])
+
+
+@pytest.mark.parametrize('mode', ['argmax', 'sample', 'top_k'])
+def test_all_mass_on_illegal_moves(mode):
+    # Uniform over the legal moves when the policy gives them no mass
+    legal = [1, 4]
+    n = 2000
+    action_raw = policy(*[{0: .5, 2: .5}] * n)
+    _, indices = select_legal_actions(
+        action_raw, [observation(legal)] * n, mode=mode,
+        rng=np.random.default_rng(0))
+    assert set(indices) <= set(legal)
+    if mode != 'argmax':
+        counts = np.bincount(indices, minlength=6) / n
+        np.testing.assert_allclose(counts[legal], [.5, .5], atol=.05)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        select_legal_actions(policy({0: 1.}), [observation([0])],
+                             mode='greedy')
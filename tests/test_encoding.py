@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('hanabi_learning_environment')
+np = pytest.importorskip('numpy')
+from hanabi_learning_environment import rl_env  # noqa: E402
+
+from cross_play_wrappers.encoding import (ObservationBuffer,  # noqa: E402
+                                          acting_observation, lean_reset,
+                                          lean_step)
+from game import game_config  # noqa: E402
+
+KEYS = ('current_player', 'current_player_offset', 'fireworks',
+        'legal_moves', 'legal_moves_as_int')
+
+
+@pytest.mark.parametrize('players', [2, 3, 5])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_lean_path_matches_env_step(players, seed):
+    full = rl_env.HanabiEnv(game_config(players, seed))
+    lean = rl_env.HanabiEnv(game_config(players, seed))
+    buffer = ObservationBuffer(1, lean.observation_encoder)
+    observations = full.reset()
+    lean_reset(lean)
+    game_done = False
+    num_moves = 0
+    while not game_done:
+        expected = observations['player_observations'][
+            observations['current_player']]
+        actual = acting_observation(lean, buffer)
+        for key in KEYS:
+            assert actual[key] == expected[key], key
+        np.testing.assert_array_equal(actual['vectorized'],
+                                      expected['vectorized'])
+
+        # Any fixed choice among the legal moves, the same on both paths
+        choice = 7 * num_moves % len(expected['legal_moves'])
+        observations, _, game_done, _ = full.step(
+            expected['legal_moves'][choice])
+        assert lean_step(lean, expected['legal_moves_as_int'][choice]) == \
+            game_done
+        num_moves += 1
+    assert lean.state.score() == full.state.score()
+    assert lean.num_moves() == full.num_moves()
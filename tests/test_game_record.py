@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+pyhanabi = pytest.importorskip('hanabi_learning_environment.pyhanabi')
+
+from game_record import GameRecordWriter, read_records  # noqa: E402
+
+
+def play(game, seed, stop_after=None):
+    """ Play random legal moves until the end of the game, or until the
+    first play or discard from move @stop_after on, before the card it
+    frees is dealt.
+    """
+    rng = random.Random(seed)
+    state = game.new_initial_state()
+    num_moves = 0
+    while not state.is_terminal():
+        if state.cur_player() == pyhanabi.CHANCE_PLAYER_ID:
+            if stop_after is not None and num_moves > stop_after:
+                break
+            state.deal_random_card()
+            continue
+        state.apply_move(rng.choice(state.legal_moves()))
+        num_moves += 1
+    return state
+
+
+def history(state):
+    return [(item.player(), str(item.move()))
+            for item in state.move_history()]
+
+
+@pytest.mark.parametrize('stop_after', [None, 10])
+def test_write_read_replay(tmp_path, stop_after):
+    seed = 7
+    game = pyhanabi.HanabiGame({'players': 3, 'seed': seed})
+    state = play(game, seed, stop_after)
+    if stop_after is not None:
+        assert state.cur_player() == pyhanabi.CHANCE_PLAYER_ID
+    path = str(tmp_path / 'games.bin')
+    with GameRecordWriter(path) as writer:
+        writer.write_state(state, game, seed)
+
+    record, = read_records(path)
+    replayed = record.replay()
+    assert replayed.score() == state.score() == record.score
+    assert history(replayed) == history(state)
+    assert replayed.cur_player() == state.cur_player()
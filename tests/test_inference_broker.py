@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from cross_play_wrappers.inference_broker import (  # noqa: E402
+    BrokerClosed, close_brokers, get_broker)
+
+
+def test_new_version_closes_stale_broker(tmp_path):
+    path = tmp_path / 'best.h5'
+    path.write_bytes(b'')
+    os.utime(path, (1, 1))
+    predict = lambda x: x * 2
+    try:
+        old = get_broker(str(path), predict, input_size=4)
+        assert get_broker(str(path), predict, input_size=4) is old
+        other = get_broker(str(path), predict, variant='numpy', input_size=4)
+
+        os.utime(path, (2, 2))
+        new = get_broker(str(path), predict, input_size=4)
+        assert new is not old
+        assert old.closed and not new.closed
+        with pytest.raises(BrokerClosed):
+            old.predict(np.ones(4))
+        # Brokers of other variants of the file are left alone
+        assert not other.closed
+        np.testing.assert_array_equal(new.predict(np.ones(4)), 2 * np.ones(4))
+    finally:
+        close_brokers()
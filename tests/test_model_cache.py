@@ -0,0 +1,79 @@
+import os
+import threading
+
+import pytest
+
+from cross_play_wrappers.model_cache import ModelCache
+
+
+def model_file(directory, name, mtime=1):
+    path = os.path.join(str(directory), name)
+    with open(path, 'wb'):
+        pass
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class SlowLoader(object):
+    """ Loader blocking until released, counting its calls. """
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        return object()
+
+
+def test_cold_load_does_not_block_hits(tmp_path):
+    cache = ModelCache(size_fn=lambda model: 1)
+    warm = model_file(tmp_path, 'warm.h5')
+    cold = model_file(tmp_path, 'cold.h5')
+    warm_model = cache.get(warm, lambda path: object())
+
+    loader = SlowLoader()
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(cache.get(cold, loader)))
+        for _ in range(3)]
+    threads[0].start()
+    assert loader.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # The cache lock is free while the cold model loads
+    assert cache.get(warm, pytest.fail) is warm_model
+    loader.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert loader.calls == 1
+    assert len(results) == 3 and all(r is results[0] for r in results)
+    assert cache.get(cold, pytest.fail) is results[0]
+    assert cache.stats()['misses'] == 2
+
+
+def test_failed_load_is_retried(tmp_path):
+    cache = ModelCache(size_fn=lambda model: 1)
+    path = model_file(tmp_path, 'best.h5')
+
+    def broken(path):
+        raise OSError('unreadable')
+
+    with pytest.raises(OSError):
+        cache.get(path, broken)
+    model = object()
+    assert cache.get(path, lambda path: model) is model
+    assert len(cache) == 1
+
+
+def test_new_version_replaces_the_old_one(tmp_path):
+    cache = ModelCache(size_fn=lambda model: 1)
+    path = model_file(tmp_path, 'best.h5', mtime=1)
+    old = cache.get(path, lambda path: object())
+    os.utime(path, (2, 2))
+    new = cache.get(path, lambda path: object())
+    assert new is not old
+    assert len(cache) == 1 and cache.get(path, pytest.fail) is new
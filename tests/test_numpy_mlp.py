@@ -0,0 +1,160 @@
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from numpy_mlp import (FLAT_HEADER, QUANTIZATIONS, NumpyMlp,  # noqa: E402
+                       random_observations)
+
+
+def small_engine(sizes=(658, 64, 32, 20), seed=0):
+    """ NumpyMlp with random weights, no TensorFlow involved. """
+    rng = np.random.default_rng(seed)
+    weights = [rng.normal(0., 0.1, (n_in, n_out)).astype(np.float32)
+               for n_in, n_out in zip(sizes[:-1], sizes[1:])]
+    biases = [rng.normal(0., 0.1, n_out).astype(np.float32)
+              for n_out in sizes[1:]]
+    activations = ['relu'] * (len(sizes) - 2) + ['softmax']
+    return NumpyMlp(weights, biases, activations)
+
+
+def small_mlp(seed=0):
+    """ Small Mlp with BatchNormalization and Dropout after every hidden
+    layer, whose normalization statistics are far from the identity.
+    """
+    pytest.importorskip('tensorflow')
+    from tensorflow.keras.layers import BatchNormalization, ReLU, Softmax
+    from mlp import Mlp
+
+    m = Mlp(io_sizes=(658, 20), out_activation=Softmax,
+            loss='categorical_crossentropy', metrics=['accuracy'], lr=1e-3,
+            batch_size=32, hl_activations=[ReLU, ReLU, ReLU],
+            hl_sizes=[64, 32, 16], decay=0., bNorm=True, dropout=True,
+            verbose=0)
+    m.construct_model()
+    rng = np.random.default_rng(seed)
+    for layer in m.model.layers:
+        if isinstance(layer, BatchNormalization):
+            gamma, beta, mean, var = layer.get_weights()
+            layer.set_weights([rng.uniform(0.5, 2., gamma.shape),
+                               rng.normal(0., 0.5, beta.shape),
+                               rng.normal(0., 0.5, mean.shape),
+                               rng.uniform(0.5, 2., var.shape)])
+    return m
+
+
+def test_matches_keras():
+    m = small_mlp()
+    x = random_observations(256)
+    expected = m.model.predict(x, verbose=0)
+    engine = NumpyMlp.from_mlp(m)
+    assert len(engine.weights) == 4
+    np.testing.assert_allclose(engine.predict(x), expected, atol=1e-5)
+    np.testing.assert_array_equal(engine.predict(x).argmax(1),
+                                  expected.argmax(1))
+
+
+def test_matches_keras_after_training():
+    m = small_mlp(seed=1)
+    x = random_observations(512, seed=1)
+    y = np.eye(20, dtype=np.float32)[np.random.default_rng(1)
+                                     .integers(20, size=len(x))]
+    m.model.fit(x, y, batch_size=32, epochs=2, verbose=0)
+    np.testing.assert_allclose(NumpyMlp.from_mlp(m).predict(x),
+                               m.model.predict(x, verbose=0), atol=1e-5)
+
+
+
+@pytest.mark.parametrize('mode', QUANTIZATIONS)
+def test_quantized_holds_only_compressed_weights(mode):
+    engine = small_engine()
+    variant = engine.quantize(mode)
+    dequantized = NumpyMlp(
+        [W.astype(np.float32) * (1. if s is None else s)
+         for W, s in zip(variant.weights, variant.scales)],
+        variant.biases, variant.activations)
+    x = random_observations(64)
+    np.testing.assert_allclose(variant.predict(x), dequantized.predict(x),
+                               rtol=1e-5, atol=1e-6)
+    assert all(W.dtype == np.dtype(mode) for W in variant.weights)
+    resident = sum(a.nbytes for a in vars(variant).values()
+                   if isinstance(a, np.ndarray))
+    resident += sum(a.nbytes for arrays in vars(variant).values()
+                    if isinstance(arrays, list)
+                    for a in arrays if isinstance(a, np.ndarray))
+    assert variant.nbytes == resident
+    assert variant.nbytes < engine.nbytes / (1.9 if mode == 'float16' else 3.)
+
+
+def assert_same_arrays(expected, actual):
+    assert len(expected) == len(actual)
+    for a, b in zip(expected, actual):
+        if a is None or b is None:
+            assert a is None and b is None
+        else:
+            assert a.dtype == b.dtype
+            np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('mode', (None, ) + QUANTIZATIONS)
+def test_flat_round_trip_is_bit_identical(tmp_path, mode):
+    engine = small_engine()
+    if mode is not None:
+        engine = engine.quantize(mode)
+    engine.save(str(tmp_path / 'best.npz'))
+    engine.save_flat(str(tmp_path / 'best.hnw'))
+    npz = NumpyMlp.load(str(tmp_path / 'best.npz'))
+    flat = NumpyMlp.load_flat(str(tmp_path / 'best.hnw'))
+    for loaded in (npz, flat):
+        assert_same_arrays(engine.weights, loaded.weights)
+        assert_same_arrays(engine.biases, loaded.biases)
+        assert_same_arrays(engine.scales, loaded.scales)
+        assert loaded.activations == engine.activations
+    x = random_observations(64)
+    np.testing.assert_array_equal(flat.predict(x), npz.predict(x))
+
+
+def test_flat_matches_keras_weights(tmp_path):
+    m = small_mlp()
+    engine = NumpyMlp.from_mlp(m)
+    engine.save_flat(str(tmp_path / 'best.hnw'))
+    flat = NumpyMlp.load_flat(str(tmp_path / 'best.hnw'))
+    assert_same_arrays(engine.weights, flat.weights)
+    assert_same_arrays(engine.biases, flat.biases)
+    x = random_observations(64)
+    np.testing.assert_array_equal(flat.predict(x), engine.predict(x))
+    np.testing.assert_allclose(flat.predict(x), m.model.predict(x, verbose=0),
+                               atol=1e-5)
+
+
+# Offset of the kernel offset in the entry of the first layer
+W_OFFSET = FLAT_HEADER.size + 12
+CORRUPTIONS = {
+    'empty': lambda data: b'',
+    'cut_header': lambda data: data[:FLAT_HEADER.size - 1],
+    'truncated': lambda data: data[:len(data) // 2],
+    'trailing_bytes': lambda data: data + bytes(64),
+    'magic': lambda data: b'XXXX' + data[4:],
+    'version': lambda data: data[:4] + struct.pack('<H', 99) + data[6:],
+    'no_layers': lambda data: data[:6] + struct.pack('<H', 0) + data[8:],
+    'layer_table': lambda data: data[:6] + struct.pack('<H', 60000) +
+                                data[8:],
+    'kernel_offset': lambda data: data[:W_OFFSET] +
+                                  struct.pack('<Q', len(data)) +
+                                  data[W_OFFSET + 8:],
+    'activation': lambda data: data[:FLAT_HEADER.size] + bytes([200]) +
+                               data[FLAT_HEADER.size + 1:],
+}
+
+
+@pytest.mark.parametrize('corruption', sorted(CORRUPTIONS))
+def test_flat_rejects_malformed_files(tmp_path, corruption):
+    path = str(tmp_path / 'best.hnw')
+    small_engine().save_flat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(CORRUPTIONS[corruption](data))
+    with pytest.raises(ValueError):
+        NumpyMlp.load_flat(path)
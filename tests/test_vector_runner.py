@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('hanabi_learning_environment')
+pytest.importorskip('tensorflow')
+from tensorflow.keras.layers import ReLU, Softmax  # noqa: E402
+
+from cross_play_wrappers.agent_wrapper import ARCHITECTURE_FILE  # noqa: E402
+from game import game  # noqa: E402
+from mlp import Mlp  # noqa: E402
+from vector_runner import VectorRunner  # noqa: E402
+
+
+def save_model(directory, seed):
+    """ Save a small randomly initialized imitator as best.h5, loadable by
+    agent_wrapper.load_imitator. Argmax agents are deterministic.
+    """
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    os.makedirs(directory)
+    with open(os.path.join(directory, ARCHITECTURE_FILE), 'w') as out:
+        json.dump({'hl_sizes': [32], 'bNorm': False, 'dropout': False}, out)
+    m = Mlp(io_sizes=(658, 20), out_activation=Softmax,
+            loss='categorical_crossentropy', metrics=['accuracy'], lr=1e-3,
+            batch_size=32, hl_activations=[ReLU], hl_sizes=[32], decay=0.,
+            verbose=0)
+    m.construct_model()
+    path = os.path.join(directory, 'best.h5')
+    m.model.save_weights(path)
+    return path
+
+
+def test_lockstep_scores_match_run_game(tmp_path):
+    paths = [save_model(str(tmp_path / ('m%d.save' % i)), seed=i)
+             for i in range(2)]
+    num_games, seed = 6, 11
+    expected = game(num_games, paths[0], paths[1], seed=seed).runGame()
+    for num_envs in (1, 4):
+        runner = VectorRunner(num_games, paths, num_envs=num_envs, seed=seed)
+        assert runner.runGame() == expected